@@ -0,0 +1,316 @@
+"""
+Approximate nearest-neighbour index (IVF-PQ) over the dense vector store
+
+Vectors are clustered into nlist inverted lists by a coarse k-means quantizer,
+residuals are compressed with product quantization (pq_m bytes per vector) and
+queries scan only the nprobe closest lists. The best top_k * refine candidates
+are re-scored exactly against the memory-mapped dense store.
+
+Knobs:
+    nlist       - more lists: longer build, faster queries (0 = 4 * sqrt(n))
+    pq_m        - bytes per vector: memory vs. approximation quality
+    nprobe      - lists scanned per query: recall vs. latency
+    refine      - exact re-scoring factor: recall vs. latency
+    train_size  - vectors sampled for k-means: build time vs. quality
+
+Usage:
+    python ann_index.py build
+    python ann_index.py bench [--k 10] [--queries 200] [--nprobe 1,4,8,16,32]
+"""
+
+import json
+import os
+import time
+import numpy as np
+from debug_logger import debug_logger
+
+ANN_INDEX_VERSION = 1
+ANN_INDEX_DIR = "./storage/ann"
+
+# Rebuild once this fraction of dense rows is outside the index
+STALE_TAIL_FRACTION = 0.1
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0, block_rows: int = 16384) -> np.ndarray:
+    """Euclidean k-means with blocked assignment, returns centroids (k x dim)"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = _assign(data, centroids, block_rows)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        counts = np.bincount(assignment, minlength=k).astype(np.float32)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Re-seed empty clusters with random points
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, block_rows: int = 16384) -> np.ndarray:
+    """Nearest centroid per row: argmax(x.c - |c|^2 / 2) equals argmin |x - c|^2"""
+    half_norms = 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+    assignment = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), block_rows):
+        block = np.asarray(data[start:start + block_rows], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return assignment
+
+
+class IVFPQIndex:
+    def __init__(self, index_dir: str = ANN_INDEX_DIR):
+        self.index_dir = index_dir
+        self.nlist = 0
+        self.pq_m = 0
+        self.nprobe = 8
+        self.refine = 4
+        self.indexed_count = 0
+        self.store_generation = None
+        self.centroids = None
+        self.codebooks = None
+        self.list_offsets = None
+        self.list_rows = None
+        self.codes = None
+
+    @staticmethod
+    def exists(index_dir: str = ANN_INDEX_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, "meta.json"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    @staticmethod
+    def _pick_pq_m(dim: int, pq_m: int) -> int:
+        """Largest subquantizer count <= pq_m that divides the dimension"""
+        for m in range(min(pq_m, dim), 0, -1):
+            if dim % m == 0:
+                return m
+        return 1
+
+    def build(self, dense_store, nlist: int = 0, pq_m: int = 48, train_size: int = 50000, seed: int = 0):
+        """Train quantizers on a sample of the dense store and encode every row"""
+        started = time.time()
+        count = dense_store.count
+        if count == 0:
+            raise ValueError("Dense store is empty")
+        dim = dense_store.dim
+        self.nlist = nlist if nlist > 0 else max(1, int(4 * np.sqrt(count)))
+        self.nlist = min(self.nlist, count)
+        self.pq_m = self._pick_pq_m(dim, pq_m)
+        dsub = dim // self.pq_m
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, min(train_size, count), replace=False))
+        sample = dense_store.get_vectors(sample_rows)
+
+        # Coarse quantizer, then PQ codebooks on residuals of the sample
+        self.centroids = _kmeans(sample, self.nlist, seed=seed)
+        self.nlist = len(self.centroids)
+        residuals = sample - self.centroids[_assign(sample, self.centroids)]
+        ksub = min(256, len(sample))
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), ksub, seed=seed + j)
+            for j in range(self.pq_m)
+        ])
+
+        # Encode all rows block by block
+        assignment = np.empty(count, dtype=np.int64)
+        codes = np.empty((count, self.pq_m), dtype=np.uint8)
+        for start in range(0, count, 16384):
+            block = dense_store.get_vectors(slice(start, start + 16384))
+            assignment[start:start + len(block)] = _assign(block, self.centroids)
+            block_residuals = block - self.centroids[assignment[start:start + len(block)]]
+            for j in range(self.pq_m):
+                codes[start:start + len(block), j] = _assign(block_residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+
+        order = np.argsort(assignment, kind="stable")
+        self.list_rows = order.astype(np.int64)
+        self.codes = codes[order]
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=self.nlist), out=self.list_offsets[1:])
+        self.indexed_count = count
+        self.store_generation = dense_store.generation
+        debug_logger.log_info(f"IVF-PQ index built: {count} vectors, nlist={self.nlist}, pq_m={self.pq_m}, "
+                              f"{time.time() - started:.1f}s")
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        # meta.json goes last, an interrupted save leaves no index and the next start rebuilds it
+        if os.path.exists(self._path("meta.json")):
+            os.remove(self._path("meta.json"))
+        for name in ("centroids", "codebooks", "list_offsets", "list_rows", "codes"):
+            np.save(self._path(f"{name}.npy"), getattr(self, name))
+        meta = {
+            "version": ANN_INDEX_VERSION,
+            "nlist": self.nlist,
+            "pq_m": self.pq_m,
+            "indexed_count": self.indexed_count,
+            "store_generation": self.store_generation
+        }
+        with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def load(self):
+        with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != ANN_INDEX_VERSION:
+            raise ValueError(f"Unsupported ANN index version: {meta.get('version')}")
+        self.nlist = meta["nlist"]
+        self.pq_m = meta["pq_m"]
+        self.indexed_count = meta["indexed_count"]
+        self.store_generation = meta["store_generation"]
+        self.centroids = np.load(self._path("centroids.npy"))
+        self.codebooks = np.load(self._path("codebooks.npy"))
+        self.list_offsets = np.load(self._path("list_offsets.npy"))
+        # Large per-vector arrays stay memory-mapped
+        self.list_rows = np.load(self._path("list_rows.npy"), mmap_mode="r")
+        self.codes = np.load(self._path("codes.npy"), mmap_mode="r")
+
+    def is_stale(self, dense_store) -> bool:
+        """Index must be rebuilt after compaction or when too many rows were appended since build"""
+        if self.store_generation != dense_store.generation:
+            return True
+        return dense_store.count - self.indexed_count > STALE_TAIL_FRACTION * max(self.indexed_count, 1)
+
+    def search(self, dense_store, query_embedding, top_k: int = 5, nprobe: int = None, refine: int = None,
+               exclude_rows=None) -> list:
+        """Approximate cosine top-k, returns [(node_id, score), ...] with exact re-scored scores"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        refine = refine or self.refine
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        with dense_store._lock:
+            count = dense_store.count
+            deleted = dense_store.deleted.copy()
+            ids = dense_store.ids
+        if exclude_rows is not None:
+            deleted.update(int(row) for row in exclude_rows)
+
+        # Scan the closest inverted lists with asymmetric distance tables
+        coarse = self.centroids @ query
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        lut = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.pq_m, -1))
+        subspaces = np.arange(self.pq_m)
+        rows_parts = []
+        score_parts = []
+        for list_no in probe:
+            start, end = self.list_offsets[list_no], self.list_offsets[list_no + 1]
+            if start == end:
+                continue
+            rows_parts.append(np.asarray(self.list_rows[start:end]))
+            score_parts.append(coarse[list_no] + lut[subspaces, np.asarray(self.codes[start:end])].sum(axis=1))
+
+        # Rows appended after the build are scanned exactly
+        if count > self.indexed_count:
+            tail_rows = np.arange(self.indexed_count, count)
+            rows_parts.append(tail_rows)
+            score_parts.append(dense_store.get_vectors(slice(self.indexed_count, count), full_precision=False) @ query)
+        if not rows_parts:
+            return []
+        rows = np.concatenate(rows_parts)
+        scores = np.concatenate(score_parts)
+        if deleted:
+            live = ~np.isin(rows, np.fromiter(deleted, dtype=np.int64))
+            rows, scores = rows[live], scores[live]
+        if len(rows) == 0:
+            return []
+
+        # Exact re-scoring of the best approximate candidates
+        pool = min(len(rows), top_k * refine)
+        candidates = np.sort(rows[np.argpartition(-scores, pool - 1)[:pool]])
+        exact = dense_store.get_vectors(candidates) @ query
+        best = np.argsort(-exact)[:top_k]
+        return [(ids[candidates[i]], float(exact[i])) for i in best]
+
+
+def evaluate(dense_store, ann_index: IVFPQIndex, k: int = 10, query_count: int = 200, nprobe_values: list = None,
+             queries: np.ndarray = None, seed: int = 0) -> list:
+    """Recall@k and latency of the ANN index against exact search, one report row per nprobe"""
+    if queries is None:
+        # Perturbed stored vectors stand in for real queries
+        rng = np.random.default_rng(seed)
+        live_rows = np.array(sorted(dense_store.id_to_row.values()))
+        sample = rng.choice(live_rows, min(query_count, len(live_rows)), replace=False)
+        queries = dense_store.get_vectors(np.sort(sample))
+        queries = queries + rng.normal(0, 0.05, queries.shape).astype(np.float32)
+
+    exact_results = []
+    exact_times = []
+    for query in queries:
+        started = time.perf_counter()
+        exact_results.append({node_id for node_id, _ in dense_store.search(query, k)})
+        exact_times.append(time.perf_counter() - started)
+
+    report = [{"mode": "exact", "nprobe": None, "recall": 1.0,
+               "mean_ms": 1000 * float(np.mean(exact_times)), "p95_ms": 1000 * float(np.percentile(exact_times, 95))}]
+    for nprobe in nprobe_values or [ann_index.nprobe]:
+        hits = 0
+        times = []
+        for query, expected in zip(queries, exact_results):
+            started = time.perf_counter()
+            found = {node_id for node_id, _ in ann_index.search(dense_store, query, k, nprobe=nprobe)}
+            times.append(time.perf_counter() - started)
+            hits += len(found & expected)
+        report.append({"mode": "ivfpq", "nprobe": nprobe,
+                       "recall": hits / max(1, sum(len(e) for e in exact_results)),
+                       "mean_ms": 1000 * float(np.mean(times)), "p95_ms": 1000 * float(np.percentile(times, 95))})
+    return report
+
+
+def rebuild(index: IVFPQIndex, dense_store, nlist: int = 0, pq_m: int = 48, train_size: int = 50000) -> IVFPQIndex:
+    """Fresh index over every dense row with the search settings of index, not yet saved"""
+    rebuilt = IVFPQIndex(index.index_dir)
+    rebuilt.build(dense_store, nlist, pq_m, train_size)
+    rebuilt.nprobe = index.nprobe
+    rebuilt.refine = index.refine
+    return rebuilt
+
+
+def load_or_build(dense_store, nlist: int = 0, pq_m: int = 48, nprobe: int = 8, refine: int = 4,
+                  train_size: int = 50000, index_dir: str = ANN_INDEX_DIR) -> IVFPQIndex:
+    """Load the persisted ANN index, rebuilding it when missing or stale"""
+    index = IVFPQIndex(index_dir)
+    if IVFPQIndex.exists(index_dir):
+        index.load()
+    if not IVFPQIndex.exists(index_dir) or index.is_stale(dense_store):
+        print("Building ANN index...")
+        index.build(dense_store, nlist, pq_m, train_size)
+        index.save()
+        print("ANN index built and saved!")
+    index.nprobe = nprobe
+    index.refine = refine
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import load_config
+    from dense_store import DenseVectorStore, DENSE_STORE_DIR
+
+    parser = argparse.ArgumentParser(description="IVF-PQ index tools")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", default="1,4,8,16,32", help="comma separated nprobe values to benchmark")
+    args = parser.parse_args()
+
+    config = load_config()
+    store = DenseVectorStore(DENSE_STORE_DIR)
+    store.load()
+
+    if args.command == "build":
+        ann = IVFPQIndex()
+        ann.build(store, config.ann_nlist, config.ann_pq_m, config.ann_train_size)
+        ann.save()
+        print(f"Built IVF-PQ index: {ann.indexed_count} vectors, nlist={ann.nlist}, pq_m={ann.pq_m}")
+    else:
+        ann = load_or_build(store, config.ann_nlist, config.ann_pq_m, config.ann_nprobe, config.ann_refine, config.ann_train_size)
+        print(f"{store.count} vectors, nlist={ann.nlist}, pq_m={ann.pq_m}, refine={ann.refine}, k={args.k}")
+        print(f"{'mode':<8}{'nprobe':>8}{'recall@k':>10}{'mean ms':>10}{'p95 ms':>10}")
+        for row in evaluate(store, ann, args.k, args.queries, [int(n) for n in args.nprobe.split(",")]):
+            print(f"{row['mode']:<8}{str(row['nprobe'] or '-'):>8}{row['recall']:>10.3f}{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}")
@@ -0,0 +1,368 @@
+"""
+BM25 lexical retriever over the dense store nodes
+
+Terms are spaCy lemmas, so Russian word forms match ("договора" finds
+"договор"); without a spaCy model a lowercase word tokenizer is used.
+The index is an immutable CSR snapshot of NumPy arrays (memory-mapped on
+load) plus an append-only delta log of nodes added since the snapshot,
+merged back once the delta or the deleted docs exceed 10% of the snapshot.
+
+Layout (storage/bm25/):
+    meta.json     analyzer, doc count, total length, deleted docs
+    vocab.json    term -> term number
+    ids.txt       node id per doc
+    offsets.npy   posting list bounds per term
+    docs.npy      doc number per posting
+    tfs.npy       term frequency per posting
+    doc_len.npy   terms per doc
+    delta.jsonl   {"id", "tf"} per node added after the snapshot, tf null marks a removal
+
+Usage:
+    python bm25_index.py build
+    python bm25_index.py search "запрос" [--k 10]
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+import numpy as np
+from debug_logger import debug_logger
+
+BM25_INDEX_DIR = "./storage/bm25"
+FORMAT_VERSION = 1
+# Delta plus deleted docs share of the snapshot that triggers a merge
+MERGE_RATIO = 0.1
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+# Only tagging and lemmatization are needed for terms
+_DISABLED_PIPES = ("parser", "ner", "senter")
+
+
+class Analyzer:
+    """Text to term counts: spaCy lemmas without stop words and punctuation, lowercase words without a model"""
+
+    def __init__(self, nlp=None):
+        self.nlp = nlp
+        self.name = f"lemma:{nlp.meta.get('lang')}_{nlp.meta.get('name')}" if nlp is not None else "word"
+
+    def analyze_many(self, texts: list, batch_size: int = 64) -> list:
+        if self.nlp is None:
+            return [Counter(_WORD_PATTERN.findall(text.lower())) for text in texts]
+        disabled = [name for name in self.nlp.pipe_names if name in _DISABLED_PIPES]
+        return [
+            Counter(token.lemma_.lower() for token in doc
+                    if not (token.is_punct or token.is_space or token.is_stop))
+            for doc in self.nlp.pipe(texts, batch_size=batch_size, disable=disabled)
+        ]
+
+    def analyze(self, text: str) -> Counter:
+        return self.analyze_many([text])[0]
+
+
+class BM25Index:
+    def __init__(self, index_dir: str = BM25_INDEX_DIR, k1: float = 1.2, b: float = 0.75):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.analyzer_name = None
+        self.vocab = {}
+        self.doc_ids = []
+        self.id_to_doc = {}
+        self.deleted = set()
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.docs = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.total_len = 0.0
+        # Nodes added after the snapshot: node_id -> Counter, plus a small inverted index over them
+        self.delta = {}
+        self.delta_postings = {}
+        # Dense store version the index was last synced with
+        self.synced_version = None
+        self._lock = threading.RLock()
+        # One sync at a time; it holds _lock only to read and to apply, not while analyzing
+        self._sync_lock = threading.Lock()
+
+    @staticmethod
+    def exists(index_dir: str = BM25_INDEX_DIR) -> bool:
+        return os.path.exists(os.path.join(index_dir, "meta.json"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids) - len(self.deleted) + len(self.delta)
+
+    def load(self):
+        """Load the snapshot (memory-mapped) and replay the delta log"""
+        with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index format: {meta.get('version')}")
+        self.analyzer_name = meta["analyzer"]
+        self.total_len = meta["total_len"]
+        self.deleted = set(meta.get("deleted", []))
+        with open(self._path("vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(self._path("ids.txt"), "r", encoding="utf-8") as f:
+            self.doc_ids = f.read().split("\n") if meta["count"] else []
+        self.id_to_doc = {node_id: doc for doc, node_id in enumerate(self.doc_ids)}
+        for name in ("offsets", "docs", "tfs", "doc_len"):
+            setattr(self, name, np.load(self._path(f"{name}.npy"), mmap_mode="r"))
+        self.delta = {}
+        self.delta_postings = {}
+        if os.path.exists(self._path("delta.jsonl")):
+            with open(self._path("delta.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._apply_delta(record["id"], Counter(record["tf"]) if record["tf"] is not None else None)
+
+    def save(self):
+        """Write the snapshot and start an empty delta log"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        for name in ("offsets", "docs", "tfs", "doc_len"):
+            np.save(self._path(f"{name}.npy"), np.asarray(getattr(self, name)))
+        with open(self._path("vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(self._path("ids.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.doc_ids))
+        open(self._path("delta.jsonl"), "w").close()
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "version": FORMAT_VERSION,
+            "analyzer": self.analyzer_name,
+            "count": len(self.doc_ids),
+            "total_len": self.total_len,
+            "deleted": sorted(self.deleted)
+        }
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _apply_delta(self, node_id: str, counts):
+        """Add (counts) or remove (None) a node on top of the snapshot"""
+        previous = self.delta.pop(node_id, None)
+        if previous is not None:
+            for term in previous:
+                self.delta_postings[term].discard(node_id)
+        elif node_id in self.id_to_doc:
+            self.deleted.add(self.id_to_doc[node_id])
+        if counts is not None:
+            self.delta[node_id] = counts
+            for term in counts:
+                self.delta_postings.setdefault(term, set()).add(node_id)
+
+    def sync(self, dense_store, analyzer: Analyzer, batch_size: int = 64) -> str:
+        """Index nodes added to the dense store and drop removed ones, searches see the previous state meanwhile"""
+        with self._sync_lock:
+            with self._lock:
+                if self.analyzer_name != analyzer.name:
+                    # Terms from another analyzer do not match, start over
+                    sync_lock = self._sync_lock
+                    self.__init__(self.index_dir, self.k1, self.b)
+                    self._sync_lock = sync_lock
+                    self.analyzer_name = analyzer.name
+                with dense_store._lock:
+                    live_ids = list(dense_store.id_to_row)
+                    version = dense_store.version
+                live = set(live_ids)
+                removed = [node_id for node_id in self.delta if node_id not in live]
+                removed += [node_id for doc, node_id in enumerate(self.doc_ids)
+                            if doc not in self.deleted and node_id not in live]
+                added = [node_id for node_id in live_ids
+                         if node_id not in self.delta and (node_id not in self.id_to_doc or self.id_to_doc[node_id] in self.deleted)]
+
+            started = time.time()
+            analyzed = []
+            for start in range(0, len(added), 1024):
+                batch = added[start:start + 1024]
+                texts = [(dense_store.get_node_by_id(node_id) or {}).get("text", "") for node_id in batch]
+                analyzed.extend(zip(batch, analyzer.analyze_many(texts, batch_size)))
+
+            with self._lock:
+                records = [{"id": node_id, "tf": None} for node_id in removed]
+                for node_id in removed:
+                    self._apply_delta(node_id, None)
+                for node_id, counts in analyzed:
+                    self._apply_delta(node_id, counts)
+                    records.append({"id": node_id, "tf": counts})
+
+                if len(self.delta) + len(self.deleted) > MERGE_RATIO * len(self.doc_ids):
+                    self.merge()
+                    self.save()
+                elif records:
+                    with open(self._path("delta.jsonl"), "a", encoding="utf-8") as f:
+                        f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+                    self._write_meta()
+                self.synced_version = version
+
+        result = f"BM25 index synced: {len(added)} added, {len(removed)} removed in {time.time() - started:.1f}s ({len(self)} docs)"
+        if added or removed:
+            debug_logger.log_info(result)
+        return result
+
+    def merge(self):
+        """Fold the delta into a new CSR snapshot and purge deleted docs"""
+        with self._lock:
+            doc_count = len(self.doc_ids)
+            live = np.ones(doc_count, dtype=bool)
+            if self.deleted:
+                live[list(self.deleted)] = False
+            remap = np.cumsum(live) - 1
+            posting_terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(np.asarray(self.offsets)))
+            keep = live[np.asarray(self.docs)]
+            terms_parts = [posting_terms[keep]]
+            docs_parts = [remap[np.asarray(self.docs)[keep]]]
+            tfs_parts = [np.asarray(self.tfs)[keep]]
+            doc_ids = [node_id for doc, node_id in enumerate(self.doc_ids) if live[doc]]
+            doc_len = [np.asarray(self.doc_len)[live]]
+
+            vocab = dict(self.vocab)
+            delta_terms, delta_docs, delta_tfs, delta_len = [], [], [], []
+            for node_id, counts in self.delta.items():
+                doc = len(doc_ids)
+                doc_ids.append(node_id)
+                delta_len.append(sum(counts.values()))
+                for term, tf in counts.items():
+                    delta_terms.append(vocab.setdefault(term, len(vocab)))
+                    delta_docs.append(doc)
+                    delta_tfs.append(tf)
+            terms_parts.append(np.asarray(delta_terms, dtype=np.int64))
+            docs_parts.append(np.asarray(delta_docs, dtype=np.int64))
+            tfs_parts.append(np.asarray(delta_tfs, dtype=np.float32))
+            doc_len.append(np.asarray(delta_len, dtype=np.float32))
+
+            terms = np.concatenate(terms_parts)
+            docs = np.concatenate(docs_parts)
+            order = np.lexsort((docs, terms))
+            self.offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(vocab)))]).astype(np.int64)
+            self.docs = docs[order].astype(np.int32)
+            self.tfs = np.concatenate(tfs_parts)[order].astype(np.float32)
+            self.doc_len = np.concatenate(doc_len).astype(np.float32)
+            self.total_len = float(self.doc_len.sum())
+            self.vocab = vocab
+            self.doc_ids = doc_ids
+            self.id_to_doc = {node_id: doc for doc, node_id in enumerate(doc_ids)}
+            self.deleted = set()
+            self.delta = {}
+            self.delta_postings = {}
+
+    def search(self, query_terms: Counter, top_k: int = 10, exclude_ids=None) -> list:
+        """BM25 top-k over snapshot and delta, returns [(node_id, score), ...] with score > 0"""
+        with self._lock:
+            doc_count = len(self)
+            if doc_count == 0 or top_k <= 0:
+                return []
+            delta_len = sum(sum(counts.values()) for counts in self.delta.values()) if self.delta else 0
+            average_len = max((self.total_len + delta_len) / doc_count, 1.0)
+            scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+            delta_scores = Counter()
+            k1, b = self.k1, self.b
+            for term in query_terms:
+                term_no = self.vocab.get(term)
+                start, end = (int(self.offsets[term_no]), int(self.offsets[term_no + 1])) if term_no is not None else (0, 0)
+                delta_hits = self.delta_postings.get(term, ())
+                df = end - start + len(delta_hits)
+                if df == 0:
+                    continue
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                if end > start:
+                    docs = np.asarray(self.docs[start:end])
+                    tf = np.asarray(self.tfs[start:end])
+                    norm = k1 * (1 - b + b * np.asarray(self.doc_len)[docs] / average_len)
+                    scores[docs] += idf * tf * (k1 + 1) / (tf + norm)
+                for node_id in delta_hits:
+                    counts = self.delta[node_id]
+                    tf = counts[term]
+                    norm = k1 * (1 - b + b * sum(counts.values()) / average_len)
+                    delta_scores[node_id] += idf * tf * (k1 + 1) / (tf + norm)
+
+            masked = set(self.deleted)
+            if exclude_ids:
+                masked.update(self.id_to_doc[node_id] for node_id in exclude_ids if node_id in self.id_to_doc)
+                for node_id in exclude_ids:
+                    delta_scores.pop(node_id, None)
+            if masked:
+                scores[list(masked)] = 0.0
+
+            hits = list(delta_scores.items())
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            hits.extend((self.doc_ids[doc], float(scores[doc])) for doc in candidates)
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def stats(self) -> dict:
+        return {
+            "docs": len(self),
+            "terms": len(self.vocab),
+            "postings": int(len(self.docs)),
+            "delta": len(self.delta),
+            "deleted": len(self.deleted),
+            "analyzer": self.analyzer_name
+        }
+
+
+def load_or_build(dense_store, analyzer: Analyzer, index_dir: str = BM25_INDEX_DIR) -> BM25Index:
+    """Load the persisted BM25 index and bring it up to date with the dense store"""
+    index = BM25Index(index_dir)
+    if BM25Index.exists(index_dir):
+        try:
+            index.load()
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            debug_logger.log_error(f"BM25 index unreadable, rebuilding: {e}", e)
+            index = BM25Index(index_dir)
+    if not BM25Index.exists(index_dir) or index.analyzer_name != analyzer.name:
+        print("Building BM25 index...")
+    print(index.sync(dense_store, analyzer))
+    if not BM25Index.exists(index_dir):
+        index.save()
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    import spacy
+    from dense_store import DenseVectorStore, DENSE_STORE_DIR
+
+    parser = argparse.ArgumentParser(description="BM25 index tools")
+    parser.add_argument("command", choices=["build", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    store = DenseVectorStore(DENSE_STORE_DIR)
+    store.load()
+    try:
+        nlp = spacy.load("ru_core_news_sm")
+    except OSError:
+        print("spaCy model ru_core_news_sm not found, using plain word terms")
+        nlp = None
+    analyzer = Analyzer(nlp)
+
+    if args.command == "build":
+        index = BM25Index()
+        started = time.time()
+        index.sync(store, analyzer)
+        index.merge()
+        index.save()
+        print(f"Built BM25 index in {time.time() - started:.1f}s: {index.stats()}")
+    else:
+        index = load_or_build(store, analyzer)
+        started = time.perf_counter()
+        terms = analyzer.analyze(args.query)
+        analyzed = time.perf_counter()
+        hits = index.search(terms, args.k)
+        finished = time.perf_counter()
+        print(f"terms: {dict(terms)}; analyze {1000 * (analyzed - started):.1f} ms, search {1000 * (finished - analyzed):.1f} ms")
+        for node_id, score in hits:
+            text = store.get_node_by_id(node_id).get("text", "")
+            print(f"{score:7.3f}  {node_id}  {' '.join(text.split())[:100]}")
@@ -46,6 +46,10 @@ class Config:
         # Load context history size
         self.context_size = int(root.find('model_settings/context_history_size').text)
         
+        # Load context token budget (system prompt + history + retrieved context per request)
+        budget_elem = root.find('model_settings/context_token_budget')
+        self.context_token_budget = int(budget_elem.text) if budget_elem is not None else 6000
+        
         # Load embedding model
         self.embedding_model = root.find('model_settings/embedding_model').text
         
@@ -59,6 +63,102 @@ class Config:
         hybrid_elem = root.find('model_settings/hybrid_retrieval')
         self.hybrid_retrieval = hybrid_elem.text.lower() == 'true' if hybrid_elem is not None else True
         
+        # Load fusion weights per retriever (e.g. "vector:1.0,kg:1.0")
+        weights_elem = root.find('model_settings/fusion_weights')
+        self.fusion_weights = weights_elem.text.strip() if weights_elem is not None else 'vector:1.0,bm25:1.0,kg:1.0'
+        
+        # Load vector store backend (mmap = dense memory-mapped store, json = LlamaIndex SimpleVectorStore)
+        vector_store_elem = root.find('model_settings/vector_store')
+        self.vector_store = vector_store_elem.text.strip().lower() if vector_store_elem is not None else 'json'
+        vector_dtype_elem = root.find('model_settings/vector_dtype')
+        self.vector_dtype = vector_dtype_elem.text.strip().lower() if vector_dtype_elem is not None else 'float32'
+        vector_rescore_elem = root.find('model_settings/vector_rescore')
+        self.vector_rescore = vector_rescore_elem.text.lower() == 'true' if vector_rescore_elem is not None else False
+        
+        # Load incremental sync setting (re-embed only added/changed/removed documents on startup)
+        sync_elem = root.find('model_settings/incremental_sync')
+        self.incremental_sync = sync_elem.text.lower() == 'true' if sync_elem is not None else False
+        
+        # Load embedding cache size (entries kept in the process-wide LRU query embedding cache)
+        cache_elem = root.find('model_settings/embedding_cache_size')
+        self.embedding_cache_size = int(cache_elem.text) if cache_elem is not None else 2048
+        
+        # Load retrieval result cache settings
+        retrieval_cache_elem = root.find('model_settings/retrieval_cache_size')
+        self.retrieval_cache_size = int(retrieval_cache_elem.text) if retrieval_cache_elem is not None else 256
+        retrieval_ttl_elem = root.find('model_settings/retrieval_cache_ttl')
+        self.retrieval_cache_ttl = float(retrieval_ttl_elem.text) if retrieval_ttl_elem is not None else 600
+        
+        # Load attached document cache settings
+        doc_cache_size_elem = root.find('model_settings/document_cache_size_mb')
+        self.document_cache_size_mb = float(doc_cache_size_elem.text) if doc_cache_size_elem is not None else 500
+        doc_cache_days_elem = root.find('model_settings/document_cache_retention_days')
+        self.document_cache_retention_days = float(doc_cache_days_elem.text) if doc_cache_days_elem is not None else 30
+        
+        # Load uploaded document persistence mode: off, chat (visible in the uploading chat) or global
+        persist_uploads_elem = root.find('model_settings/persist_uploads')
+        self.persist_uploads = persist_uploads_elem.text.strip().lower() if persist_uploads_elem is not None else 'off'
+        
+        # Load BM25 settings (off, fuse = extra fused source, prefilter = dense scoring limited to BM25 candidates)
+        bm25_mode_elem = root.find('model_settings/bm25_mode')
+        self.bm25_mode = bm25_mode_elem.text.strip().lower() if bm25_mode_elem is not None else 'off'
+        bm25_candidates_elem = root.find('model_settings/bm25_candidates')
+        self.bm25_candidates = int(bm25_candidates_elem.text) if bm25_candidates_elem is not None else 200
+        
+        # Load shared embedding provider settings (embedding_socket empty = in-process model only)
+        embedding_socket_elem = root.find('model_settings/embedding_socket')
+        self.embedding_socket = (embedding_socket_elem.text or '').strip() if embedding_socket_elem is not None else ''
+        embedding_batch_elem = root.find('model_settings/embedding_batch_size')
+        self.embedding_batch_size = int(embedding_batch_elem.text) if embedding_batch_elem is not None else 64
+        embedding_wait_elem = root.find('model_settings/embedding_batch_wait_ms')
+        self.embedding_batch_wait_ms = float(embedding_wait_elem.text) if embedding_wait_elem is not None else 5
+        # Load embedding inference backend settings (huggingface, torch, torch_int8, torchscript, onnx, onnx_int8)
+        embedding_backend_elem = root.find('model_settings/embedding_backend')
+        self.embedding_backend = embedding_backend_elem.text.strip().lower() if embedding_backend_elem is not None and embedding_backend_elem.text else 'huggingface'
+        embedding_threads_elem = root.find('model_settings/embedding_threads')
+        self.embedding_threads = int(embedding_threads_elem.text) if embedding_threads_elem is not None else 0
+        embedding_pooling_elem = root.find('model_settings/embedding_pooling')
+        self.embedding_pooling = embedding_pooling_elem.text.strip().lower() if embedding_pooling_elem is not None and embedding_pooling_elem.text else 'auto'
+        embedding_max_length_elem = root.find('model_settings/embedding_max_length')
+        self.embedding_max_length = int(embedding_max_length_elem.text) if embedding_max_length_elem is not None else 512
+        
+        # Load knowledge graph query settings (local = entity index lookup, llm = LLM query engine)
+        kg_query_mode_elem = root.find('model_settings/kg_query_mode')
+        self.kg_query_mode = kg_query_mode_elem.text.strip().lower() if kg_query_mode_elem is not None and kg_query_mode_elem.text else 'local'
+        kg_query_hops_elem = root.find('model_settings/kg_query_hops')
+        self.kg_query_hops = int(kg_query_hops_elem.text) if kg_query_hops_elem is not None else 2
+        kg_query_limit_elem = root.find('model_settings/kg_query_limit')
+        self.kg_query_limit = int(kg_query_limit_elem.text) if kg_query_limit_elem is not None else 20
+        kg_fan_out_elem = root.find('model_settings/kg_query_fan_out')
+        self.kg_query_fan_out = [int(n) for n in kg_fan_out_elem.text.split(',')] if kg_fan_out_elem is not None else [32, 8]
+        # Load knowledge graph extraction settings (concurrent LLM relation prompts, chunks per spaCy batch)
+        kg_workers_elem = root.find('model_settings/kg_extract_workers')
+        self.kg_extract_workers = int(kg_workers_elem.text) if kg_workers_elem is not None else 4
+        kg_batch_elem = root.find('model_settings/kg_extract_batch_size')
+        self.kg_extract_batch_size = int(kg_batch_elem.text) if kg_batch_elem is not None else 32
+        # Load knowledge graph ingestion settings (background queue or inline with the reply, queue workers)
+        kg_ingest_mode_elem = root.find('model_settings/kg_ingest_mode')
+        self.kg_ingest_mode = kg_ingest_mode_elem.text.strip().lower() if kg_ingest_mode_elem is not None else 'inline'
+        kg_ingest_workers_elem = root.find('model_settings/kg_ingest_workers')
+        self.kg_ingest_workers = int(kg_ingest_workers_elem.text) if kg_ingest_workers_elem is not None else 1
+        # Load startup mode (lazy = poll Telegram immediately and load models in the background, eager = load first)
+        startup_mode_elem = root.find('model_settings/startup_mode')
+        self.startup_mode = startup_mode_elem.text.strip().lower() if startup_mode_elem is not None else 'eager'
+        
+        # Load ANN settings (exact = brute-force dense search, ivfpq = approximate IVF-PQ index)
+        ann_backend_elem = root.find('model_settings/ann_backend')
+        self.ann_backend = ann_backend_elem.text.strip().lower() if ann_backend_elem is not None else 'exact'
+        ann_nlist_elem = root.find('model_settings/ann_nlist')
+        self.ann_nlist = int(ann_nlist_elem.text) if ann_nlist_elem is not None else 0
+        ann_pq_m_elem = root.find('model_settings/ann_pq_m')
+        self.ann_pq_m = int(ann_pq_m_elem.text) if ann_pq_m_elem is not None else 48
+        ann_nprobe_elem = root.find('model_settings/ann_nprobe')
+        self.ann_nprobe = int(ann_nprobe_elem.text) if ann_nprobe_elem is not None else 8
+        ann_refine_elem = root.find('model_settings/ann_refine')
+        self.ann_refine = int(ann_refine_elem.text) if ann_refine_elem is not None else 4
+        ann_train_elem = root.find('model_settings/ann_train_size')
+        self.ann_train_size = int(ann_train_elem.text) if ann_train_elem is not None else 50000
+        
         # Load debug log file
         self.debug_log_file = root.find('logging/debug_log_file').text
         
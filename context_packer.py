@@ -0,0 +1,102 @@
+"""
+Context packer - assembles the model prompt within a token budget
+
+Sections are filled in priority order: user message, recent history,
+top retrieved chunks, attached document excerpts. Chunks that mostly
+repeat text already packed are dropped.
+"""
+
+import re
+from typing import Dict, List
+from debug_logger import debug_logger
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Share of a chunk's word trigrams already packed above which it counts as a duplicate
+DUPLICATE_OVERLAP = 0.6
+
+# Per-message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate subword token count: one per word or punctuation mark, plus one per 6 extra characters of long words"""
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        tokens += 1 + max(0, len(match.group()) - 6) // 6
+    return tokens
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < 3:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def split_document_context(document_context: str) -> List[str]:
+    """Split attached document context into paragraph excerpts"""
+    return [part.strip() for part in document_context.split("\n\n") if part.strip()]
+
+
+class ContextPacker:
+    def __init__(self, token_budget: int, count_tokens=estimate_tokens):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+
+    def pack(self, system_content: str, user_message: str, history: List[Dict],
+             retrieved_chunks: List[str], document_chunks: List[str]) -> Dict:
+        """Select history messages and context chunks that fit the budget"""
+        used = self.count_tokens(system_content) + self.count_tokens(user_message) + 2 * MESSAGE_OVERHEAD_TOKENS
+        usage = {"system": self.count_tokens(system_content), "user": self.count_tokens(user_message)}
+        seen_shingles = _shingles(user_message)
+
+        # Recent history, newest first, kept in chronological order
+        packed_history = []
+        history_tokens = 0
+        for message in reversed(history):
+            cost = self.count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > self.token_budget:
+                break
+            packed_history.insert(0, message)
+            history_tokens += cost
+            used += cost
+        usage["history"] = history_tokens
+
+        duplicates = 0
+        sections = {}
+        for name, chunks in (("retrieved", retrieved_chunks), ("document", document_chunks)):
+            packed = []
+            section_tokens = 0
+            for chunk in chunks:
+                shingles = _shingles(chunk)
+                if shingles and len(shingles & seen_shingles) >= DUPLICATE_OVERLAP * len(shingles):
+                    duplicates += 1
+                    continue
+                cost = self.count_tokens(chunk)
+                if used + cost > self.token_budget:
+                    # Keep scanning, a later, smaller chunk may still fit
+                    continue
+                packed.append(chunk)
+                seen_shingles |= shingles
+                section_tokens += cost
+                used += cost
+            sections[name] = packed
+            usage[name] = section_tokens
+
+        report = (f"Context budget: {used}/{self.token_budget} tokens "
+                  f"(system {usage['system']}, user {usage['user']}, "
+                  f"history {usage['history']} [{len(packed_history)}/{len(history)} msgs], "
+                  f"retrieved {usage['retrieved']} [{len(sections['retrieved'])}/{len(retrieved_chunks)} chunks], "
+                  f"document {usage['document']} [{len(sections['document'])}/{len(document_chunks)} excerpts], "
+                  f"{duplicates} duplicates dropped)")
+        debug_logger.log_info(report)
+        return {
+            "history": packed_history,
+            "retrieved": sections["retrieved"],
+            "document": sections["document"],
+            "tokens": used,
+            "usage": usage,
+            "report": report
+        }
@@ -0,0 +1,494 @@
+"""
+Dense vector store - contiguous memory-mapped embedding matrix for RAG retrieval
+
+Layout of the store directory:
+    meta.json     - version, dimension, dtype, committed row count, deleted rows
+    vectors.bin   - row-major matrix of L2-normalized embeddings (count x dim), float32, float16 or int8
+    scales.bin    - float32 dequantization scale per row (int8 only)
+    vectors_f32.bin - optional full-precision copy used to rescore the top candidates of quantized stores
+    ids.txt       - node id per row
+    nodes.jsonl   - node payload per row (text, metadata, ref_doc_id)
+    offsets.bin   - int64 (start, length) of every row inside nodes.jsonl
+
+Convert existing LlamaIndex storage once with:
+    python dense_store.py convert [--dtype float16]
+
+Requantize a store and measure the accuracy impact with:
+    python dense_store.py requantize --dtype int8 [--rescore]
+    python dense_store.py bench
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+import numpy as np
+from debug_logger import debug_logger
+
+DENSE_STORE_VERSION = 1
+DENSE_STORE_DIR = "./storage/dense"
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# Candidates per requested result rescored with full precision
+RESCORE_FACTOR = 4
+
+# Rows scored per block, keeps temporary buffers bounded for large mmaps
+SCORE_BLOCK_ROWS = 65536
+# Quantized rows are widened to float32 in small blocks that stay in CPU cache
+QUANTIZED_BLOCK_ROWS = 256
+
+
+class DenseVectorStore:
+    def __init__(self, store_dir: str = DENSE_STORE_DIR):
+        self.store_dir = store_dir
+        self.dim = 0
+        self.dtype = "float32"
+        self.full_precision = False
+        self.count = 0
+        self.generation = None
+        # In-memory change counter, bumped on every add/delete
+        self.version = 0
+        self.ids = []
+        self.id_to_row = {}
+        self.deleted = set()
+        self.vectors = None
+        self.scales = None
+        self.full_vectors = None
+        self.offsets = None
+        self._nodes_handle = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def exists(store_dir: str = DENSE_STORE_DIR) -> bool:
+        """Check if a committed dense store exists in directory"""
+        return os.path.exists(os.path.join(store_dir, "meta.json"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def create(self, dim: int, dtype: str = "float32", full_precision: bool = False):
+        """Create an empty store, replacing any existing files"""
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dense store dtype: {dtype}")
+        os.makedirs(self.store_dir, exist_ok=True)
+        for name in ("vectors.bin", "ids.txt", "nodes.jsonl", "offsets.bin", "scales.bin", "vectors_f32.bin"):
+            open(self._path(name), "wb").close()
+        self.dim = dim
+        self.dtype = dtype
+        # A full-precision copy only makes sense next to quantized rows
+        self.full_precision = full_precision and dtype != "float32"
+        self.count = 0
+        # New generation whenever rows are renumbered, lets derived indexes detect staleness
+        self.generation = uuid.uuid4().hex
+        self.ids = []
+        self.id_to_row = {}
+        self.deleted = set()
+        self._write_meta()
+        self._map_files()
+
+    def load(self):
+        """Load metadata and memory-map the vector matrix and offset table"""
+        with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != DENSE_STORE_VERSION:
+            raise ValueError(f"Unsupported dense store version: {meta.get('version')}")
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        self.full_precision = meta.get("full_precision", False)
+        self.count = meta["count"]
+        self.generation = meta.get("generation")
+        self.deleted = set(meta.get("deleted", []))
+
+        # Rows past the committed count are leftovers of an interrupted append
+        with open(self._path("ids.txt"), "r", encoding="utf-8") as f:
+            self.ids = f.read().split("\n")[:self.count]
+        self.id_to_row = {node_id: row for row, node_id in enumerate(self.ids) if row not in self.deleted}
+        self._map_files()
+        debug_logger.log_info(f"Dense store loaded: {len(self)} vectors, dim={self.dim}, dtype={self.dtype}")
+
+    def _write_meta(self):
+        """Atomically write store metadata - this is the commit point for appends"""
+        meta = {
+            "version": DENSE_STORE_VERSION,
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "full_precision": self.full_precision,
+            "count": self.count,
+            "generation": self.generation,
+            "deleted": sorted(self.deleted)
+        }
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _map_files(self):
+        """(Re)open memory maps for the committed rows"""
+        if self._nodes_handle is not None:
+            self._nodes_handle.close()
+            self._nodes_handle = None
+        if self.count == 0:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self.scales = np.zeros(0, dtype=np.float32) if self.dtype == "int8" else None
+            self.full_vectors = np.zeros((0, self.dim), dtype=np.float32) if self.full_precision else None
+            self.offsets = np.zeros((0, 2), dtype=np.int64)
+            return
+        self.vectors = np.memmap(self._path("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+        self.scales = None
+        if self.dtype == "int8":
+            self.scales = np.memmap(self._path("scales.bin"), dtype=np.float32, mode="r", shape=(self.count,))
+        self.full_vectors = None
+        if self.full_precision:
+            self.full_vectors = np.memmap(self._path("vectors_f32.bin"), dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        self.offsets = np.memmap(self._path("offsets.bin"), dtype=np.int64, mode="r", shape=(self.count, 2))
+        self._nodes_handle = open(self._path("nodes.jsonl"), "rb")
+
+    def close(self):
+        """Release memory maps and file handles"""
+        if self._nodes_handle is not None:
+            self._nodes_handle.close()
+            self._nodes_handle = None
+        self.vectors = self.scales = self.full_vectors = self.offsets = None
+
+    def __len__(self) -> int:
+        return self.count - len(self.deleted)
+
+    def _quantize(self, matrix: np.ndarray):
+        """Stored rows (and int8 scales) for normalized float32 rows"""
+        if self.dtype != "int8":
+            return matrix.astype(self.dtype), None
+        # Symmetric per-row calibration: the largest component maps to +-127
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def get_vectors(self, rows, full_precision: bool = True) -> np.ndarray:
+        """Float32 rows (index array or slice): the full-precision copy when kept, otherwise dequantized storage"""
+        with self._lock:
+            vectors, scales, full_vectors = self.vectors, self.scales, self.full_vectors
+        if full_precision and full_vectors is not None:
+            return np.asarray(full_vectors[rows], dtype=np.float32)
+        block = np.asarray(vectors[rows], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[rows])[..., None]
+        return block
+
+    def add(self, node_ids: list, embeddings, nodes: list):
+        """Append embeddings with their node payloads (dicts with text, metadata, ref_doc_id)"""
+        if len(node_ids) == 0:
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of shape (n, {self.dim}), got {matrix.shape}")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+        stored, scales = self._quantize(matrix)
+
+        with self._lock:
+            # Replacing an id tombstones its previous row
+            for node_id in node_ids:
+                if node_id in self.id_to_row:
+                    self.deleted.add(self.id_to_row.pop(node_id))
+
+            nodes_start = os.path.getsize(self._path("nodes.jsonl"))
+            offsets = np.zeros((len(node_ids), 2), dtype=np.int64)
+            lines = []
+            position = nodes_start
+            for i, node in enumerate(nodes):
+                line = (json.dumps(node, ensure_ascii=False) + "\n").encode("utf-8")
+                offsets[i] = (position, len(line) - 1)
+                position += len(line)
+                lines.append(line)
+
+            # Truncate uncommitted leftovers so rows stay aligned with the count
+            row_bytes = self.dim * np.dtype(self.dtype).itemsize
+            with open(self._path("vectors.bin"), "r+b") as f:
+                f.truncate(self.count * row_bytes)
+                f.seek(0, os.SEEK_END)
+                f.write(stored.tobytes())
+            if scales is not None:
+                with open(self._path("scales.bin"), "r+b") as f:
+                    f.truncate(self.count * 4)
+                    f.seek(0, os.SEEK_END)
+                    f.write(scales.tobytes())
+            if self.full_precision:
+                with open(self._path("vectors_f32.bin"), "r+b") as f:
+                    f.truncate(self.count * self.dim * 4)
+                    f.seek(0, os.SEEK_END)
+                    f.write(matrix.astype(np.float32).tobytes())
+            with open(self._path("offsets.bin"), "r+b") as f:
+                f.truncate(self.count * 16)
+                f.seek(0, os.SEEK_END)
+                f.write(offsets.tobytes())
+            with open(self._path("nodes.jsonl"), "ab") as f:
+                f.write(b"".join(lines))
+            with open(self._path("ids.txt"), "r+", encoding="utf-8") as f:
+                f.truncate(len("\n".join(self.ids).encode("utf-8")))
+                f.seek(0, os.SEEK_END)
+                f.write(("\n" if self.ids else "") + "\n".join(node_ids))
+
+            for node_id in node_ids:
+                self.id_to_row[node_id] = len(self.ids)
+                self.ids.append(node_id)
+            self.count = len(self.ids)
+            self.version += 1
+            self._write_meta()
+            self._map_files()
+
+    def delete(self, node_ids: list) -> int:
+        """Tombstone rows by node id, returns number of rows removed"""
+        removed = 0
+        with self._lock:
+            for node_id in node_ids:
+                row = self.id_to_row.pop(node_id, None)
+                if row is not None:
+                    self.deleted.add(row)
+                    removed += 1
+            if removed:
+                self.version += 1
+                self._write_meta()
+        return removed
+
+    def compact(self):
+        """Rewrite the store without tombstoned rows"""
+        with self._lock:
+            if not self.deleted:
+                return
+            self.rewrite(self.dtype, self.full_precision)
+            debug_logger.log_info(f"Dense store compacted to {self.count} rows")
+
+    def rewrite(self, dtype: str, full_precision: bool = False, batch_size: int = 4096):
+        """Copy live rows into a fresh store with the given precision, then swap it in place"""
+        with self._lock:
+            target = DenseVectorStore(self.store_dir.rstrip("/\\") + ".rewrite")
+            shutil.rmtree(target.store_dir, ignore_errors=True)
+            target.create(self.dim, dtype, full_precision)
+            live_rows = np.array([row for row in range(self.count) if row not in self.deleted], dtype=np.int64)
+            for start in range(0, len(live_rows), batch_size):
+                rows = live_rows[start:start + batch_size]
+                target.add([self.ids[row] for row in rows], self.get_vectors(rows), [self.get_node(row) for row in rows])
+            target.close()
+            self.close()
+            previous_dir = self.store_dir.rstrip("/\\") + ".old"
+            shutil.rmtree(previous_dir, ignore_errors=True)
+            os.replace(self.store_dir, previous_dir)
+            os.replace(target.store_dir, self.store_dir)
+            shutil.rmtree(previous_dir, ignore_errors=True)
+            self.load()
+            self.version += 1
+
+    def get_node(self, row: int) -> dict:
+        """Read node payload for a row through the offset table"""
+        start, length = self.offsets[row]
+        with self._lock:
+            self._nodes_handle.seek(int(start))
+            line = self._nodes_handle.read(int(length))
+        return json.loads(line.decode("utf-8"))
+
+    def search(self, query_embedding, top_k: int = 5, exclude_rows=None) -> list:
+        """Exact cosine top-k over all live rows (minus exclude_rows), returns [(node_id, score), ...]
+
+        Quantized rows are converted to float32 block by block so scoring runs as a BLAS
+        matrix-vector product; with a full-precision copy the best candidates are rescored.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        # Snapshot under lock so concurrent appends cannot remap mid-scan
+        with self._lock:
+            vectors = self.vectors
+            scales = self.scales
+            full_vectors = self.full_vectors
+            deleted = list(self.deleted)
+            ids = self.ids
+        if exclude_rows is not None:
+            deleted = list(set(deleted).union(int(row) for row in exclude_rows))
+
+        scores = np.empty(len(vectors), dtype=np.float32)
+        block_rows = SCORE_BLOCK_ROWS if vectors.dtype == np.float32 else QUANTIZED_BLOCK_ROWS
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        if scales is not None:
+            scores *= scales
+        if deleted:
+            scores[deleted] = -np.inf
+
+        live = len(ids) - len(deleted)
+        k = min(top_k, live)
+        if k <= 0:
+            return []
+        if full_vectors is not None:
+            pool = min(k * RESCORE_FACTOR, live)
+            candidates = np.sort(np.argpartition(-scores, pool - 1)[:pool])
+            exact = np.asarray(full_vectors[candidates], dtype=np.float32) @ query
+            best = np.argsort(-exact)[:k]
+            return [(ids[candidates[i]], float(exact[i])) for i in best]
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(ids[row], float(scores[row])) for row in candidates]
+
+    def search_rows(self, query_embedding, rows, top_k: int = 5) -> list:
+        """Exact cosine top-k restricted to candidate rows (e.g. from a lexical pre-filter)"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        with self._lock:
+            ids = self.ids
+            rows = np.array(sorted(set(int(row) for row in rows) - self.deleted), dtype=np.int64)
+        if len(rows) == 0 or top_k <= 0:
+            return []
+        scores = self.get_vectors(rows) @ query
+        best = np.argsort(-scores)[:top_k]
+        return [(ids[rows[i]], float(scores[i])) for i in best]
+
+    def get_node_by_id(self, node_id: str):
+        """Look up node payload by node id"""
+        row = self.id_to_row.get(node_id)
+        return self.get_node(row) if row is not None else None
+
+
+def _node_payload(node_data: dict, ref_doc_id: str = None) -> dict:
+    """Convert serialized LlamaIndex node data to a dense store payload"""
+    data = node_data.get("__data__", node_data)
+    return {
+        "text": data.get("text", ""),
+        "metadata": data.get("metadata", {}),
+        "ref_doc_id": ref_doc_id
+    }
+
+
+def import_embeddings(store: DenseVectorStore, embedding_dict: dict, node_lookup, ref_doc_ids: dict = None, batch_size: int = 4096) -> int:
+    """Append embeddings in batches, node_lookup(node_id) returns serialized node data or None"""
+    ref_doc_ids = ref_doc_ids or {}
+    node_ids = [node_id for node_id in embedding_dict if node_lookup(node_id) is not None]
+    for start in range(0, len(node_ids), batch_size):
+        batch_ids = node_ids[start:start + batch_size]
+        store.add(
+            batch_ids,
+            [embedding_dict[node_id] for node_id in batch_ids],
+            [_node_payload(node_lookup(node_id), ref_doc_ids.get(node_id)) for node_id in batch_ids]
+        )
+    return len(node_ids)
+
+
+def convert_llama_storage(persist_dir: str = "./storage", store_dir: str = DENSE_STORE_DIR, dtype: str = "float32",
+                          full_precision: bool = False) -> DenseVectorStore:
+    """One-shot conversion of LlamaIndex JSON storage into a dense store"""
+    with open(os.path.join(persist_dir, "default__vector_store.json"), "r", encoding="utf-8") as f:
+        vector_data = json.load(f)
+    with open(os.path.join(persist_dir, "docstore.json"), "r", encoding="utf-8") as f:
+        docstore_data = json.load(f).get("docstore/data", {})
+
+    embedding_dict = vector_data.get("embedding_dict", {})
+    if not embedding_dict:
+        raise ValueError(f"No embeddings found in {persist_dir}")
+    dim = len(next(iter(embedding_dict.values())))
+
+    store = DenseVectorStore(store_dir)
+    store.create(dim, dtype, full_precision)
+    imported = import_embeddings(store, embedding_dict, docstore_data.get, vector_data.get("text_id_to_ref_doc_id", {}))
+    debug_logger.log_info(f"Converted {imported} vectors from {persist_dir} to {store_dir}")
+    return store
+
+
+def benchmark(store: DenseVectorStore, k: int = 10, query_count: int = 200, seed: int = 0) -> list:
+    """Recall@k, score error, size, load and query time of every precision against float32 exact search"""
+    import tempfile
+    import time
+
+    rng = np.random.default_rng(seed)
+    live_rows = np.array(sorted(store.id_to_row.values()), dtype=np.int64)
+    vectors = store.get_vectors(live_rows)
+    ids = [store.ids[row] for row in live_rows]
+    nodes = [{"text": ""}] * len(ids)
+    # Perturbed stored vectors stand in for real queries
+    queries = vectors[rng.choice(len(vectors), min(query_count, len(vectors)), replace=False)]
+    queries = queries + rng.normal(0, 0.05, queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    exact_scores = queries @ vectors.T
+    truth = [set(np.argsort(-row)[:k]) for row in exact_scores]
+    id_to_index = {node_id: index for index, node_id in enumerate(ids)}
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for dtype, full_precision in (("float32", False), ("float16", False), ("int8", False), ("int8", True)):
+            bench_store = DenseVectorStore(os.path.join(tmp_dir, f"{dtype}_{full_precision}"))
+            bench_store.create(store.dim, dtype, full_precision)
+            for start in range(0, len(ids), 4096):
+                bench_store.add(ids[start:start + 4096], vectors[start:start + 4096], nodes[start:start + 4096])
+            bench_store.close()
+
+            started = time.perf_counter()
+            bench_store = DenseVectorStore(bench_store.store_dir)
+            bench_store.load()
+            bench_store.search(queries[0], k)
+            load_ms = (time.perf_counter() - started) * 1000
+
+            recalls, errors, latencies = [], [], []
+            for query_no, query in enumerate(queries):
+                started = time.perf_counter()
+                hits = bench_store.search(query, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                found = [id_to_index[node_id] for node_id, _ in hits]
+                recalls.append(len(truth[query_no] & set(found)) / k)
+                errors.extend(abs(score - exact_scores[query_no, index]) for (_, score), index in zip(hits, found))
+            # Rescore modes also keep the float32 copy (only candidate rows of it are paged in per query)
+            resident = sum(os.path.getsize(bench_store._path(name))
+                           for name in ("vectors.bin", "scales.bin", "vectors_f32.bin"))
+            bench_store.close()
+            report.append({
+                "mode": dtype + ("+rescore" if full_precision else ""),
+                "resident_mb": resident / 1024 / 1024,
+                "load_ms": load_ms,
+                "mean_ms": float(np.mean(latencies)),
+                "recall": float(np.mean(recalls)),
+                "score_error": float(np.mean(errors))
+            })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dense vector store tools")
+    parser.add_argument("command", choices=["convert", "compact", "requantize", "bench", "info"])
+    parser.add_argument("--persist-dir", default="./storage")
+    parser.add_argument("--store-dir", default=DENSE_STORE_DIR)
+    parser.add_argument("--dtype", default="float32", choices=SUPPORTED_DTYPES)
+    parser.add_argument("--rescore", action="store_true", help="keep a float32 copy to rescore quantized results")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        converted = convert_llama_storage(args.persist_dir, args.store_dir, args.dtype, args.rescore)
+        print(f"Converted {len(converted)} vectors (dim={converted.dim}, dtype={converted.dtype}) to {args.store_dir}")
+    else:
+        dense_store = DenseVectorStore(args.store_dir)
+        dense_store.load()
+        if args.command == "compact":
+            dense_store.compact()
+        elif args.command == "requantize":
+            dense_store.rewrite(args.dtype, args.rescore)
+        elif args.command == "bench":
+            print(f"{len(dense_store)} vectors, dim={dense_store.dim}, k={args.k}")
+            print(f"{'mode':<16}{'vectors MB':>11}{'load ms':>9}{'query ms':>10}{'recall@k':>10}{'score err':>11}")
+            for row in benchmark(dense_store, args.k):
+                print(f"{row['mode']:<16}{row['resident_mb']:>11.1f}{row['load_ms']:>9.1f}{row['mean_ms']:>10.2f}"
+                      f"{row['recall']:>10.3f}{row['score_error']:>11.5f}")
+            json_path = os.path.join(args.persist_dir, "default__vector_store.json")
+            if os.path.exists(json_path):
+                import time
+                started = time.perf_counter()
+                with open(json_path, "r", encoding="utf-8") as f:
+                    json.load(f)
+                print(f"{'json (llama)':<16}{os.path.getsize(json_path) / 1024 / 1024:>11.1f}{(time.perf_counter() - started) * 1000:>9.1f}")
+        print(f"{args.store_dir}: {len(dense_store)} live vectors, {dense_store.count} rows, dim={dense_store.dim}, "
+              f"dtype={dense_store.dtype}, rescore={dense_store.full_precision}")
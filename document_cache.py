@@ -0,0 +1,172 @@
+"""
+On-disk cache of chunk embeddings for documents attached in chats
+
+Entries are keyed by Telegram file_unique_id or content hash, so follow-up
+questions about the same document only embed the query. Entries older than
+the retention period are dropped, then least recently used entries are
+evicted until the cache fits its size limit.
+
+Entries are written incrementally while a document is streamed, so the
+chunk texts of a large upload are never all held in memory.
+
+Layout: <cache_dir>/<key>/meta.json + chunks.jsonl + embeddings.f32
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
+from debug_logger import debug_logger
+from index_manifest import file_sha256
+
+DOCUMENT_CACHE_DIR = "./storage/doc_cache"
+
+
+class DocumentCache:
+    def __init__(self, cache_dir: str = DOCUMENT_CACHE_DIR, max_size_mb: float = 500, retention_days: float = 30):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.retention_seconds = retention_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(file_path: str = None, file_unique_id: str = None) -> str:
+        """Cache key from Telegram file_unique_id, falling back to content hash"""
+        if file_unique_id:
+            return "tg_" + re.sub(r"[^A-Za-z0-9_-]", "_", file_unique_id)
+        return "sha_" + file_sha256(file_path)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str):
+        """Return cached entry (dict with embeddings memmap, count, preview, metadata) or None"""
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json"), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["count"]:
+                entry["embeddings"] = np.memmap(os.path.join(entry_dir, "embeddings.f32"), dtype=np.float32,
+                                                mode="r", shape=(entry["count"], entry["dim"]))
+            else:
+                entry["embeddings"] = np.zeros((0, 0), dtype=np.float32)
+        except (FileNotFoundError, ValueError, KeyError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        entry["key"] = key
+        # Directory mtime doubles as last-used time for LRU eviction
+        os.utime(entry_dir, None)
+        self.hits += 1
+        return entry
+
+    def read_chunks(self, key: str, rows) -> list:
+        """Chunk texts for the given rows, in the order requested"""
+        wanted = {int(row) for row in rows}
+        found = {}
+        with open(os.path.join(self._entry_dir(key), "chunks.jsonl"), "r", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                if row in wanted:
+                    found[row] = json.loads(line)
+                    if len(found) == len(wanted):
+                        break
+        return [found[int(row)] for row in rows if int(row) in found]
+
+    def iter_chunks(self, key: str):
+        """Stream chunk texts of an entry in row order"""
+        with open(os.path.join(self._entry_dir(key), "chunks.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def open_writer(self, key: str) -> "DocumentCacheWriter":
+        """Start writing an entry, chunks are appended as they are embedded"""
+        return DocumentCacheWriter(self, key)
+
+    def save(self, key: str, chunks: list, embeddings, preview: str = "", metadata: dict = None):
+        """Store chunk texts and embeddings in one go"""
+        writer = self.open_writer(key)
+        writer.add(chunks, embeddings)
+        writer.commit(preview, metadata)
+
+    def _entries(self) -> list:
+        """List (last_used, size_bytes, key) of all entries"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if key.endswith(".tmp") or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, key))
+        return sorted(entries)
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under the size limit"""
+        removed = 0
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for last_used, size, key in entries:
+            if now - last_used > self.retention_seconds or total > self.max_size_bytes:
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                removed += 1
+        if removed:
+            debug_logger.log_info(f"Document cache evicted {removed} entries, {total / 1024 / 1024:.1f} MB kept")
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        total = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "size_mb": sum(size for _, size, _ in entries) / 1024 / 1024,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class DocumentCacheWriter:
+    """Appends chunks and embeddings to a temporary entry, published atomically on commit"""
+
+    def __init__(self, cache: DocumentCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.count = 0
+        self.dim = 0
+        self.entry_dir = cache._entry_dir(key)
+        self.tmp_dir = self.entry_dir + ".tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self._chunks_file = open(os.path.join(self.tmp_dir, "chunks.jsonl"), "w", encoding="utf-8")
+        self._vectors_file = open(os.path.join(self.tmp_dir, "embeddings.f32"), "wb")
+
+    def add(self, chunks: list, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"{len(chunks)} chunks but {len(embeddings)} embeddings")
+        if not len(chunks):
+            return
+        for chunk in chunks:
+            self._chunks_file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        self._vectors_file.write(embeddings.tobytes())
+        self.dim = embeddings.shape[1]
+        self.count += len(chunks)
+
+    def commit(self, preview: str = "", metadata: dict = None):
+        self._chunks_file.close()
+        self._vectors_file.close()
+        with open(os.path.join(self.tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"count": self.count, "dim": self.dim, "preview": preview, "metadata": metadata or {},
+                       "created": time.time()}, f, ensure_ascii=False)
+        shutil.rmtree(self.entry_dir, ignore_errors=True)
+        os.replace(self.tmp_dir, self.entry_dir)
+        self.cache.evict()
+
+    def abort(self):
+        self._chunks_file.close()
+        self._vectors_file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
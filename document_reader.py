@@ -0,0 +1,180 @@
+"""
+Streaming document reader for uploaded files (plain text, EPUB, HTML)
+
+Text is read in fixed-size blocks and split into chunks through a bounded
+window, so peak memory depends on the chunk window, not on the file size.
+EPUB chapters are streamed one by one straight from the zip archive in
+spine order; HTML is parsed incrementally.
+
+Usage:
+    python document_reader.py book.epub [--chunk-size 1024]
+"""
+
+import codecs
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import Callable, Iterator, List
+from urllib.parse import unquote
+
+READ_BLOCK_CHARS = 64 * 1024
+# Text buffered before it is handed to the splitter
+CHUNK_WINDOW_CHARS = 32 * 1024
+
+HTML_EXTENSIONS = (".html", ".htm", ".xhtml")
+_SKIP_TAGS = {"script", "style", "head", "title"}
+_BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "section", "pre"}
+_CONTAINER_NS = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+_OPF_NS = "{http://www.idpf.org/2007/opf}"
+
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML to text converter, paragraph breaks kept as newlines"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+    def drain(self) -> str:
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+
+def _iter_html_stream(stream) -> Iterator[str]:
+    """Yield text of an HTML byte stream block by block"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    parser = _TextExtractor()
+    while True:
+        data = stream.read(READ_BLOCK_CHARS)
+        parser.feed(decoder.decode(data, final=not data))
+        text = parser.drain()
+        if text:
+            yield text
+        if not data:
+            break
+    parser.close()
+    text = parser.drain()
+    if text:
+        yield text
+
+
+def _iter_plain(file_path: str) -> Iterator[str]:
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(READ_BLOCK_CHARS)
+            if not block:
+                break
+            yield block
+
+
+def _iter_html_file(file_path: str) -> Iterator[str]:
+    with open(file_path, "rb") as f:
+        yield from _iter_html_stream(f)
+
+
+def _epub_chapters(archive: zipfile.ZipFile) -> List[str]:
+    """Archive member names of the EPUB content documents in reading order"""
+    try:
+        container = ET.fromstring(archive.read("META-INF/container.xml"))
+        opf_path = container.find(f".//{_CONTAINER_NS}rootfile").get("full-path")
+        opf = ET.fromstring(archive.read(opf_path))
+        base = posixpath.dirname(opf_path)
+        manifest = {item.get("id"): item for item in opf.iter(f"{_OPF_NS}item")}
+        chapters = []
+        for itemref in opf.iter(f"{_OPF_NS}itemref"):
+            item = manifest.get(itemref.get("idref"))
+            if item is not None and "html" in (item.get("media-type") or ""):
+                chapters.append(posixpath.normpath(posixpath.join(base, unquote(item.get("href")))))
+        if chapters:
+            return chapters
+    except (KeyError, AttributeError, ET.ParseError):
+        pass
+    # Broken package document, fall back to every HTML member in archive order
+    return [name for name in archive.namelist() if name.lower().endswith(HTML_EXTENSIONS)]
+
+
+def _iter_epub(file_path: str) -> Iterator[str]:
+    with zipfile.ZipFile(file_path) as archive:
+        for name in _epub_chapters(archive):
+            try:
+                with archive.open(name) as chapter:
+                    yield from _iter_html_stream(chapter)
+            except KeyError:
+                continue
+            yield "\n"
+
+
+def iter_text_blocks(file_path: str) -> Iterator[str]:
+    """Yield the text of a document in blocks, choosing the reader by extension"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".epub":
+        return _iter_epub(file_path)
+    if extension in HTML_EXTENSIONS:
+        return _iter_html_file(file_path)
+    return _iter_plain(file_path)
+
+
+def iter_chunks(file_path: str, split_text: Callable[[str], List[str]],
+                window_chars: int = CHUNK_WINDOW_CHARS) -> Iterator[str]:
+    """Lazily yield chunks of a document, split_text is e.g. SentenceSplitter.split_text"""
+    buffer = ""
+    for block in iter_text_blocks(file_path):
+        buffer += block
+        if len(buffer) < window_chars:
+            continue
+        chunks = split_text(buffer)
+        # The last chunk may end mid-sentence, carry it into the next window
+        for chunk in chunks[:-1]:
+            yield chunk
+        buffer = chunks[-1] if chunks else ""
+    if buffer.strip():
+        yield from split_text(buffer)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import tracemalloc
+    from llama_index.core.node_parser import SentenceSplitter
+
+    parser = argparse.ArgumentParser(description="Stream a document into chunks and report memory use")
+    parser.add_argument("file")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--chunk-overlap", type=int, default=20)
+    args = parser.parse_args()
+
+    splitter = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    tracemalloc.start()
+    start = time.time()
+    count = chars = 0
+    for chunk in iter_chunks(args.file, splitter.split_text):
+        count += 1
+        chars += len(chunk)
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    print(f"{count} chunks, {chars} chars in {elapsed:.2f}s, "
+          f"file {os.path.getsize(args.file) / 1024 / 1024:.1f} MB, peak traced memory {peak / 1024 / 1024:.1f} MB")
@@ -0,0 +1,309 @@
+"""
+CPU inference backends for the embedding model
+
+    huggingface  - LlamaIndex HuggingFaceEmbedding, the original path (default)
+    torch        - transformers model in eager mode with length-bucketed batches
+    torch_int8   - same with dynamic int8 quantization of all Linear layers
+    torchscript  - traced and frozen TorchScript graph
+    onnx         - ONNX Runtime session over an exported graph (needs onnxruntime)
+    onnx_int8    - ONNX graph with dynamically quantized int8 weights
+
+Exported graphs are cached in storage/models/<model>/. Texts are sorted by
+token length and batched so each batch is padded only to its own longest
+text, which keeps padding waste low for mixed query/document traffic.
+
+Benchmark (throughput and cosine agreement with the huggingface path):
+    python embedding_backends.py bench --backends huggingface,torch,torch_int8,onnx
+"""
+
+import json
+import os
+import warnings
+from abc import ABC, abstractmethod
+import numpy as np
+from debug_logger import debug_logger
+
+BACKENDS = ("huggingface", "torch", "torch_int8", "torchscript", "onnx", "onnx_int8")
+EXPORT_DIR = "./storage/models"
+
+
+def resolve_pooling(model_name: str, pooling: str = "auto") -> str:
+    """Pooling mode of a sentence-transformers model (mean or cls), read from its 1_Pooling config"""
+    if pooling != "auto":
+        return pooling
+    try:
+        if os.path.isdir(model_name):
+            config_path = os.path.join(model_name, "1_Pooling", "config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+            config_path = hf_hub_download(model_name, "1_Pooling/config.json")
+        with open(config_path, "r", encoding="utf-8") as f:
+            pooling_config = json.load(f)
+        return "cls" if pooling_config.get("pooling_mode_cls_token") else "mean"
+    except Exception as e:
+        debug_logger.log_info(f"No sentence-transformers pooling config for {model_name} ({e}), using mean pooling")
+        return "mean"
+
+
+def with_instructions(texts: list, model_name: str, query: bool = False) -> list:
+    """Texts with the query or text instruction LlamaIndex's HuggingFaceEmbedding prepends for the model (bge, e5, ...)"""
+    from llama_index.embeddings.huggingface.utils import format_query, format_text
+    format_instruction = format_query if query else format_text
+    return [format_instruction(text, model_name) for text in texts]
+
+
+class HuggingFaceEncoder:
+    """The original LlamaIndex HuggingFaceEmbedding path"""
+
+    def __init__(self, model_name: str, batch_size: int = 64, **_):
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.model = HuggingFaceEmbedding(model_name=model_name, embed_batch_size=batch_size)
+        # Unset instructions fall back to the model's defaults inside HuggingFaceEmbedding, compare those
+        self.distinct_query = with_instructions([""], model_name, True) != with_instructions([""], model_name)
+
+    def encode(self, texts: list, query: bool = False) -> np.ndarray:
+        model = self.model
+        if query and self.distinct_query:
+            # Instruction-tuned models embed queries differently, no shared batch
+            return np.asarray([model.get_query_embedding(text) for text in texts], dtype=np.float32)
+        return np.asarray(model.get_text_embedding_batch(texts), dtype=np.float32)
+
+
+class TransformerEncoder(ABC):
+    """Tokenizer, instructions, length-bucketed batching and pooling shared by the transformers-based backends"""
+
+    def __init__(self, model_name: str, batch_size: int = 64, pooling: str = "auto", max_length: int = 512,
+                 threads: int = 0):
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.threads = threads
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_length = min(max_length, self.tokenizer.model_max_length)
+        self.pooling = resolve_pooling(model_name, pooling)
+        self.export_dir = os.path.join(EXPORT_DIR, model_name.replace("/", "__"))
+
+    def _load_model(self, **kwargs):
+        from transformers import AutoModel
+        model = AutoModel.from_pretrained(self.model_name, **kwargs)
+        model.eval()
+        return model
+
+    @abstractmethod
+    def _forward(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        """Last hidden states (batch x tokens x dim)"""
+
+    def encode(self, texts: list, query: bool = False) -> np.ndarray:
+        # Same instruction prefixes as the huggingface path, or vectors would not match an index built with it
+        texts = with_instructions(texts, self.model_name, query)
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length, padding=False)
+        lengths = np.array([len(ids) for ids in encoded["input_ids"]])
+        order = np.argsort(lengths, kind="stable")
+        result = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            padded = self.tokenizer.pad({"input_ids": [encoded["input_ids"][i] for i in batch]}, return_tensors="np")
+            input_ids = padded["input_ids"].astype(np.int64)
+            attention_mask = padded["attention_mask"].astype(np.int64)
+            hidden = self._forward(input_ids, attention_mask)
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = attention_mask[..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if result is None:
+                result = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            result[batch] = pooled
+        return result
+
+    def _example_inputs(self):
+        example = self.tokenizer(["пример текста для трассировки", "example"], padding=True, return_tensors="pt")
+        return example["input_ids"], example["attention_mask"]
+
+
+class TorchEncoder(TransformerEncoder):
+    def __init__(self, model_name: str, quantize: bool = False, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import torch
+        self.torch = torch
+        self.model = self._load_model()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _forward(self, input_ids, attention_mask):
+        with self.torch.inference_mode():
+            output = self.model(input_ids=self.torch.from_numpy(input_ids),
+                                attention_mask=self.torch.from_numpy(attention_mask))
+        return output[0].float().numpy()
+
+
+class TorchScriptEncoder(TransformerEncoder):
+    def __init__(self, model_name: str, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import torch
+        self.torch = torch
+        path = os.path.join(self.export_dir, "model.torchscript.pt")
+        if not os.path.exists(path):
+            os.makedirs(self.export_dir, exist_ok=True)
+            model = self._load_model(torchscript=True)
+            with torch.inference_mode():
+                traced = torch.jit.trace(model, self._example_inputs(), strict=False)
+            torch.jit.save(traced, path)
+            debug_logger.log_info(f"Exported TorchScript embedding model to {path}")
+        self.model = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.load(path).eval()))
+
+    def _forward(self, input_ids, attention_mask):
+        with self.torch.inference_mode():
+            output = self.model(self.torch.from_numpy(input_ids), self.torch.from_numpy(attention_mask))
+        return output[0].float().numpy()
+
+
+class OnnxEncoder(TransformerEncoder):
+    def __init__(self, model_name: str, quantize: bool = False, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import onnxruntime
+        path = self._export()
+        if quantize:
+            path = self._quantize(path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def _export(self) -> str:
+        path = os.path.join(self.export_dir, "model.onnx")
+        if os.path.exists(path):
+            return path
+        import torch
+        os.makedirs(self.export_dir, exist_ok=True)
+        model = self._load_model()
+        with torch.inference_mode():
+            torch.onnx.export(
+                model, self._example_inputs(), path,
+                input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "tokens"}, "attention_mask": {0: "batch", 1: "tokens"},
+                              "last_hidden_state": {0: "batch", 1: "tokens"}},
+                opset_version=14
+            )
+        debug_logger.log_info(f"Exported ONNX embedding model to {path}")
+        return path
+
+    def _quantize(self, path: str) -> str:
+        quantized_path = os.path.join(self.export_dir, "model.int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            debug_logger.log_info(f"Quantized ONNX embedding model to {quantized_path}")
+        return quantized_path
+
+    def _forward(self, input_ids, attention_mask):
+        return self.session.run(["last_hidden_state"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+
+def create_encoder(backend: str, model_name: str, batch_size: int = 64, pooling: str = "auto",
+                   max_length: int = 512, threads: int = 0):
+    """Encoder for the configured backend, falling back to the huggingface path if it cannot be built"""
+    options = {"batch_size": batch_size, "pooling": pooling, "max_length": max_length, "threads": threads}
+    if threads > 0:
+        # Intra-op threads for every torch-based backend, onnx sets its own per session
+        import torch
+        torch.set_num_threads(threads)
+    try:
+        if backend == "torch":
+            return TorchEncoder(model_name, **options)
+        if backend == "torch_int8":
+            return TorchEncoder(model_name, quantize=True, **options)
+        if backend == "torchscript":
+            return TorchScriptEncoder(model_name, **options)
+        if backend in ("onnx", "onnx_int8"):
+            return OnnxEncoder(model_name, quantize=backend == "onnx_int8", **options)
+        if backend != "huggingface":
+            debug_logger.log_info(f"Unknown embedding backend {backend}, using huggingface")
+    except (ImportError, OSError, RuntimeError) as e:
+        # Missing package, missing or corrupt model file, or a failed session/model init
+        print(f"Embedding backend {backend} unavailable ({e}), using huggingface")
+        debug_logger.log_error(f"Embedding backend {backend} unavailable ({e}), using huggingface", e)
+    return HuggingFaceEncoder(model_name, batch_size)
+
+
+def benchmark(texts: list, backends: list, model_name: str, batch_size: int = 64, pooling: str = "auto",
+              max_length: int = 512, threads: int = 0, repeats: int = 1, queries: list = None) -> list:
+    """Throughput of each backend and cosine agreement of its text and query embeddings with the huggingface path"""
+    import time
+
+    def normalized(matrix):
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    queries = queries or [text[:80] for text in texts[:max(1, len(texts) // 4)]]
+    reference = None
+    query_reference = None
+    report = []
+    for backend in ["huggingface"] + [b for b in backends if b != "huggingface"]:
+        started = time.perf_counter()
+        encoder = create_encoder(backend, model_name, batch_size, pooling, max_length, threads)
+        load_seconds = time.perf_counter() - started
+        if backend != "huggingface" and isinstance(encoder, HuggingFaceEncoder):
+            print(f"{backend}: unavailable, skipped")
+            continue
+        encoder.encode(texts[:min(8, len(texts))])
+        started = time.perf_counter()
+        for _ in range(repeats):
+            embeddings = normalized(encoder.encode(texts))
+        seconds = (time.perf_counter() - started) / repeats
+        # Queries are embedded with the query instruction, compared separately
+        query_embeddings = normalized(encoder.encode(queries, query=True))
+        if reference is None:
+            reference = embeddings
+            query_reference = query_embeddings
+        agreement = np.einsum("ij,ij->i", embeddings, reference)
+        query_agreement = np.einsum("ij,ij->i", query_embeddings, query_reference)
+        report.append({
+            "backend": backend,
+            "load_s": load_seconds,
+            "texts_per_s": len(texts) / seconds,
+            "cosine_mean": float(agreement.mean()),
+            "cosine_min": float(agreement.min()),
+            "query_cosine_mean": float(query_agreement.mean()),
+            "query_cosine_min": float(query_agreement.min())
+        })
+        del encoder
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import load_config
+
+    parser = argparse.ArgumentParser(description="Embedding backend benchmark")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--texts", type=int, default=256, help="corpus chunks to embed")
+    parser.add_argument("--repeats", type=int, default=1)
+    args = parser.parse_args()
+
+    config = load_config()
+    from dense_store import DenseVectorStore, DENSE_STORE_DIR
+    corpus = []
+    if DenseVectorStore.exists(DENSE_STORE_DIR):
+        store = DenseVectorStore(DENSE_STORE_DIR)
+        store.load()
+        rows = sorted(store.id_to_row.values())
+        step = max(1, len(rows) // args.texts)
+        corpus = [store.get_node(row).get("text", "") for row in rows[::step][:args.texts]]
+    if not corpus:
+        print("Dense store not found, benchmarking on synthetic sentences")
+        corpus = [f"Предложение номер {i} о промышленности и сельском хозяйстве СССР." * (1 + i % 8) for i in range(args.texts)]
+    # Short query-like texts, embedded as queries
+    queries = [text[:80] for text in corpus[:max(1, len(corpus) // 4)]]
+
+    print(f"{len(corpus)} texts, {len(queries)} queries, model={config.embedding_model}, batch={config.embedding_batch_size}, "
+          f"threads={config.embedding_threads or 'default'}")
+    print(f"{'backend':<14}{'load s':>8}{'texts/s':>10}{'cos mean':>10}{'cos min':>10}{'query mean':>12}{'query min':>11}")
+    for row in benchmark(corpus, args.backends.split(","), config.embedding_model, config.embedding_batch_size,
+                         config.embedding_pooling, config.embedding_max_length, config.embedding_threads, args.repeats,
+                         queries):
+        print(f"{row['backend']:<14}{row['load_s']:>8.1f}{row['texts_per_s']:>10.1f}{row['cosine_mean']:>10.4f}"
+              f"{row['cosine_min']:>10.4f}{row['query_cosine_mean']:>12.4f}{row['query_cosine_min']:>11.4f}")
@@ -0,0 +1,96 @@
+"""
+Process-wide LRU cache of text embeddings shared by RAG retrieval and web search ranking
+
+Entries are keyed by model, embedding kind (embedding_service.KIND_QUERY or
+KIND_TEXT, instruction models encode the two differently) and normalized text.
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict
+from config_loader import load_config
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache keys: unicode NFC and collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def _store(self, key, embedding):
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, text: str, model_name: str, compute, kind: str = "text"):
+        """Return cached embedding of text, computing it with compute(text) on a miss"""
+        key = (model_name, kind, normalize_text(text))
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = compute(text)
+            self._store(key, embedding)
+        return embedding
+
+    def get_many(self, texts: list, model_name: str, compute_batch, kind: str = "text") -> list:
+        """Return embeddings for texts, computing all misses in one compute_batch(texts) call"""
+        keys = [(model_name, kind, normalize_text(text)) for text in texts]
+        embeddings = [None] * len(texts)
+        missing = {}
+        found = {}
+        for i, key in enumerate(keys):
+            if key in missing:
+                missing[key].append(i)
+                continue
+            if key not in found:
+                found[key] = self._lookup(key)
+            if found[key] is None:
+                missing[key] = [i]
+            else:
+                embeddings[i] = found[key]
+        if missing:
+            computed = compute_batch([texts[positions[0]] for positions in missing.values()])
+            for (key, positions), embedding in zip(missing.items(), computed):
+                self._store(key, embedding)
+                for i in positions:
+                    embeddings[i] = embedding
+        return embeddings
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Cache statistics for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache(load_config().embedding_cache_size)
@@ -0,0 +1,352 @@
+"""
+Shared embedding provider - one copy of the embedding model per process (or per machine)
+
+All callers (RAG retrieval and ingestion, web search ranking, the Moltbook
+heartbeat) go through the `embedding_provider` singleton. Concurrent requests
+are queued and coalesced by a worker thread into single batched forward passes.
+
+With `embedding_socket` set in config.xml the first process that starts also
+serves its model on that Unix socket and later processes become thin clients,
+so the weights are loaded once per machine. Where Unix sockets are not
+available (Windows) every process keeps its own in-process provider.
+
+The inference backend (eager PyTorch, int8, TorchScript, ONNX Runtime) is
+selected with `embedding_backend`, see embedding_backends.py.
+
+Standalone service:
+    python embedding_service.py serve
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+import numpy as np
+from config_loader import load_config
+from debug_logger import debug_logger
+from embedding_backends import create_encoder
+
+KIND_QUERY = "query"
+KIND_TEXT = "text"
+# Seconds a client waits on connect, send or each receive before falling back to an in-process model
+SERVICE_TIMEOUT = 60
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(model_name: str):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+def count_tokens(model_name: str, texts: list) -> int:
+    """Tokens in texts under the embedding model's tokenizer (without special tokens or truncation)"""
+    if not texts:
+        return 0
+    return sum(len(ids) for ids in _load_tokenizer(model_name)(list(texts), add_special_tokens=False)["input_ids"])
+
+
+class EmbeddingProvider:
+    """In-process embedding model behind a batching queue"""
+
+    def __init__(self, model_name: str, max_batch: int = 64, max_wait_ms: float = 5, backend: str = "huggingface",
+                 backend_options: dict = None):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.backend = backend
+        self.backend_options = backend_options or {}
+        self.max_wait = max_wait_ms / 1000
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self.stats_counters = {"requests": 0, "texts": 0, "batches": 0, "seconds": 0.0}
+
+    def _load_model(self):
+        with self._load_lock:
+            if self._model is None:
+                self._model = create_encoder(self.backend, self.model_name, self.max_batch, **self.backend_options)
+                debug_logger.log_info(f"Loaded shared embedding model: {self.model_name} ({type(self._model).__name__})")
+        return self._model
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._load_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._worker.start()
+
+    def embed(self, texts: list, kind: str = KIND_TEXT) -> np.ndarray:
+        """Normalized float32 embeddings (len(texts) x dim), coalesced with concurrent callers"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((list(texts), kind, future))
+        return future.result()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed([text], KIND_QUERY)[0].tolist()
+
+    def count_tokens(self, texts: list) -> int:
+        return count_tokens(self.model_name, texts)
+
+    def _collect(self) -> list:
+        """Block for one request, then gather what else arrives within max_wait up to max_batch texts"""
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _forward(self, texts: list, kind: str) -> np.ndarray:
+        return _normalize(self._load_model().encode(texts, query=kind == KIND_QUERY))
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            for kind in {request[1] for request in requests}:
+                group = [request for request in requests if request[1] == kind]
+                texts = [text for request in group for text in request[0]]
+                started = time.perf_counter()
+                try:
+                    embeddings = self._forward(texts, kind)
+                except Exception as e:
+                    debug_logger.log_error(f"Embedding batch failed: {e}", e)
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+                self.stats_counters["seconds"] += time.perf_counter() - started
+                self.stats_counters["batches"] += 1
+                self.stats_counters["requests"] += len(group)
+                self.stats_counters["texts"] += len(texts)
+                position = 0
+                for request_texts, _, future in group:
+                    future.set_result(embeddings[position:position + len(request_texts)])
+                    position += len(request_texts)
+
+    def stats(self) -> dict:
+        counters = dict(self.stats_counters)
+        batches = counters["batches"]
+        counters["mean_batch_size"] = counters["texts"] / batches if batches else 0.0
+        counters["texts_per_second"] = counters["texts"] / counters["seconds"] if counters["seconds"] else 0.0
+        counters["mode"] = "local"
+        counters["backend"] = self.backend
+        return counters
+
+
+def _send(sock, header: dict, payload: bytes = b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack("!II", len(data), len(payload)) + data + payload)
+
+
+def _recv_exact(sock, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Embedding service closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock):
+    header_size, payload_size = struct.unpack("!II", _recv_exact(sock, 8))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    return header, _recv_exact(sock, payload_size)
+
+
+class RemoteEmbeddingProvider:
+    """Client of an embedding service on a Unix socket, same interface as EmbeddingProvider"""
+
+    def __init__(self, socket_path: str, model_name: str, max_batch: int = 64, max_wait_ms: float = 5,
+                 backend: str = "huggingface", backend_options: dict = None):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.backend = backend
+        self.backend_options = backend_options
+        self.requests = 0
+        # Local model loaded only if the service goes away
+        self._fallback = None
+
+    def embed(self, texts: list, kind: str = KIND_TEXT) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._fallback is not None:
+            return self._fallback.embed(texts, kind)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(SERVICE_TIMEOUT)
+                sock.connect(self.socket_path)
+                _send(sock, {"texts": list(texts), "kind": kind, "model": self.model_name})
+                header, payload = _recv(sock)
+        except (socket.timeout, OSError) as e:
+            # A hung service counts as gone
+            debug_logger.log_error(f"Embedding service at {self.socket_path} unavailable, loading model in-process: {e}", e)
+            self._fallback = EmbeddingProvider(self.model_name, self.max_batch, self.max_wait_ms, self.backend,
+                                               self.backend_options)
+            return self._fallback.embed(texts, kind)
+        if header.get("error"):
+            raise RuntimeError(f"Embedding service error: {header['error']}")
+        self.requests += 1
+        return np.frombuffer(payload, dtype=np.float32).reshape(header["shape"])
+
+    def embed_query(self, text: str) -> list:
+        return self.embed([text], KIND_QUERY)[0].tolist()
+
+    def count_tokens(self, texts: list) -> int:
+        # Only the tokenizer is loaded here, the model stays in the service
+        return count_tokens(self.model_name, texts)
+
+    def stats(self) -> dict:
+        if self._fallback is not None:
+            return self._fallback.stats()
+        return {"mode": f"remote:{self.socket_path}", "requests": self.requests}
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        provider = self.server.provider
+        try:
+            request, _ = _recv(self.request)
+            if request.get("model") != provider.model_name:
+                raise ValueError(f"Service runs {provider.model_name}, client expects {request.get('model')}")
+            embeddings = provider.embed(request["texts"], request.get("kind", KIND_TEXT))
+            _send(self.request, {"shape": list(embeddings.shape)}, embeddings.astype(np.float32).tobytes())
+        except Exception as e:
+            debug_logger.log_error(f"Embedding service request failed: {e}", e)
+            try:
+                _send(self.request, {"error": str(e)})
+            except OSError:
+                pass
+
+
+def _socket_alive(socket_path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1)
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(provider: EmbeddingProvider, socket_path: str):
+    """Serve provider on a Unix socket (blocking), unless a live service already owns it"""
+    if os.path.exists(socket_path):
+        if _socket_alive(socket_path):
+            debug_logger.log_info(f"Embedding service already running on {socket_path}, not serving")
+            return
+        # Left over from a process that exited without cleaning up
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _EmbeddingRequestHandler)
+    # Only processes of the same user may use the model
+    os.chmod(socket_path, 0o600)
+    server.daemon_threads = True
+    server.provider = provider
+    debug_logger.log_info(f"Embedding service listening on {socket_path}")
+    server.serve_forever()
+
+
+def create_provider(config):
+    """Remote client when a service already runs on embedding_socket, otherwise a local provider (hosting the socket if configured)"""
+    socket_path = config.embedding_socket
+    backend_options = {"pooling": config.embedding_pooling, "max_length": config.embedding_max_length,
+                       "threads": config.embedding_threads}
+    if socket_path and not hasattr(socket, "AF_UNIX"):
+        debug_logger.log_info("Unix sockets unavailable, embedding model is loaded in-process")
+        socket_path = ""
+    if socket_path and _socket_alive(socket_path):
+        debug_logger.log_info(f"Using embedding service at {socket_path}")
+        return RemoteEmbeddingProvider(socket_path, config.embedding_model, config.embedding_batch_size,
+                                       config.embedding_batch_wait_ms, config.embedding_backend, backend_options)
+    provider = EmbeddingProvider(config.embedding_model, config.embedding_batch_size, config.embedding_batch_wait_ms,
+                                 config.embedding_backend, backend_options)
+    if socket_path:
+        threading.Thread(target=serve, args=(provider, socket_path), name="embedding-service", daemon=True).start()
+    return provider
+
+
+def make_llama_embedding(provider):
+    """LlamaIndex BaseEmbedding adapter routing Settings.embed_model through the provider"""
+    from llama_index.core.embeddings import BaseEmbedding
+    from llama_index.core.bridge.pydantic import PrivateAttr
+
+    class ProviderEmbedding(BaseEmbedding):
+        _provider = PrivateAttr()
+
+        def __init__(self, provider, **kwargs):
+            super().__init__(model_name=provider.model_name, **kwargs)
+            self._provider = provider
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "SharedProviderEmbedding"
+
+        def count_tokens(self, texts: list) -> int:
+            return self._provider.count_tokens(texts)
+
+        def _get_query_embedding(self, query: str) -> list:
+            return self._provider.embed_query(query)
+
+        def _get_text_embedding(self, text: str) -> list:
+            return self._provider.embed([text])[0].tolist()
+
+        def _get_text_embeddings(self, texts: list) -> list:
+            return self._provider.embed(texts).tolist()
+
+        async def _aget_query_embedding(self, query: str) -> list:
+            return self._get_query_embedding(query)
+
+        async def _aget_text_embedding(self, text: str) -> list:
+            return self._get_text_embedding(text)
+
+    return ProviderEmbedding(provider, embed_batch_size=getattr(provider, "max_batch", 64))
+
+
+# Global embedding provider instance, the model itself loads on first use
+embedding_provider = create_provider(load_config())
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    socket_path = load_config().embedding_socket
+    if command != "serve":
+        print("Usage: python embedding_service.py serve")
+    elif not socket_path:
+        print("Set embedding_socket in config.xml first")
+    elif isinstance(embedding_provider, RemoteEmbeddingProvider):
+        print(f"Embedding service already running on {socket_path}")
+    else:
+        # create_provider above already started serving on the socket
+        embedding_provider.embed(["warm-up"])
+        print(f"Serving {embedding_provider.model_name} on {socket_path}, Ctrl+C to stop")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,244 @@
+"""
+Entity alias resolution for the knowledge graph
+
+Surface forms ("Сталин", "Сталина", "И. В. Сталин") are mapped to one
+canonical entity at ingest time, in order of cost:
+
+    alias    surface key seen before (lowercase, ё -> е, no punctuation or initials)
+    lemma    same spaCy lemma key as a known entity
+    fuzzy    character trigram Dice similarity >= INGEST_SIMILARITY with a known entity
+    new      first canonical name for the entity
+
+Query mentions are resolved without spaCy (alias table, then trigram index),
+which keeps lookups well under a millisecond. Aliases are appended to
+storage/kg/aliases.jsonl; the tables built from it are kept in the warm-start
+snapshot (warm_start.py), so a restart only replays aliases added since.
+
+Usage:
+    python entity_resolver.py stats
+    python entity_resolver.py canonicalize    merge existing graph nodes through the resolver
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from debug_logger import debug_logger
+
+ALIASES_PATH = "./storage/kg/aliases.jsonl"
+INGEST_SIMILARITY = 0.85
+QUERY_SIMILARITY = 0.6
+# Trigrams shared by more entities than this are skipped when generating candidates
+MAX_POSTING = 5000
+
+_INITIAL = re.compile(r"^\w\.?$", re.UNICODE)
+_PUNCT = re.compile(r"[^\w\s.-]", re.UNICODE)
+
+
+def _words(name: str) -> list:
+    """Name tokens without punctuation and initials, case preserved"""
+    text = _PUNCT.sub(" ", str(name).replace("ё", "е").replace("Ё", "Е"))
+    tokens = [t.strip(".-") for t in text.replace(".", ". ").split()]
+    words = [t for t in tokens if t and not (len(t) == 1 and _INITIAL.match(t))]
+    return words or [t for t in tokens if t]
+
+
+def surface_key(name: str) -> str:
+    """Lowercase name without punctuation and initials ("И. В. Сталин" -> "сталин")"""
+    return " ".join(_words(name)).lower()
+
+
+def display_name(name: str, lemma: str) -> str:
+    """Canonical name: lemma words cased like the surface form ("Германии" -> "Германия")"""
+    words, lemmas = _words(name), lemma.split()
+    if len(words) != len(lemmas):
+        return " ".join(str(name).split())
+    return " ".join(w if w.lower() == l else l[:1].upper() + l[1:] if w[:1].isupper() else l
+                    for w, l in zip(words, lemmas))
+
+
+def trigrams(key: str) -> set:
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class EntityResolver:
+    def __init__(self, nlp=None, path: str = ALIASES_PATH, snapshot=None):
+        self.nlp = nlp
+        self.path = path
+        self.names = []
+        self.name_ids = {}
+        self.aliases = {}
+        self.lemma_ids = {}
+        self.postings = {}
+        self.gram_counts = []
+        self.entity_words = []
+        self.counters = Counter()
+        self._pending = []
+        self._lock = threading.Lock()
+        # Alias records read from aliases.jsonl (the ones after the snapshot when starting from one)
+        self.replayed = 0
+        state = snapshot.resolver_state(path) if snapshot is not None else None
+        if state is not None:
+            self.restore_state(state)
+        if os.path.exists(path):
+            self._load(state["offset"] if state is not None else 0)
+
+    def _load(self, offset: int = 0):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entity_id = self._entity(record["canonical"], record["lemma"])
+                self.aliases[record["alias"]] = entity_id
+                self.replayed += 1
+        debug_logger.log_info(f"Loaded entity aliases: {len(self.aliases)} aliases, {len(self.names)} entities "
+                              f"({self.replayed} read from {self.path})")
+
+    def export_state(self) -> dict:
+        """Copy of the lookup tables for the warm-start snapshot"""
+        with self._lock:
+            return {
+                "names": list(self.names),
+                "gram_counts": list(self.gram_counts),
+                "entity_words": list(self.entity_words),
+                "aliases": dict(self.aliases),
+                "lemma_ids": dict(self.lemma_ids),
+                "postings": {gram: list(ids) for gram, ids in self.postings.items()}
+            }
+
+    def restore_state(self, state: dict):
+        self.names = state["names"]
+        self.name_ids = {name: entity_id for entity_id, name in enumerate(self.names)}
+        self.gram_counts = state["gram_counts"]
+        self.entity_words = state["entity_words"]
+        self.aliases = state["aliases"]
+        self.lemma_ids = state["lemma_ids"]
+        self.postings = state["postings"]
+
+    def _entity(self, name: str, lemma: str) -> int:
+        """Id of a canonical entity, registering it in the lemma and trigram indexes if new"""
+        entity_id = self.name_ids.get(name)
+        if entity_id is None:
+            entity_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = entity_id
+            grams = trigrams(lemma)
+            self.gram_counts.append(len(grams))
+            self.entity_words.append(len(lemma.split()))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(entity_id)
+        self.lemma_ids.setdefault(lemma, entity_id)
+        return entity_id
+
+    def _lemma_keys(self, keys: list) -> list:
+        if self.nlp is None:
+            return keys
+        disabled = [name for name in self.nlp.pipe_names if name in ("parser", "ner", "senter")]
+        return [" ".join(token.lemma_.lower().replace("ё", "е") for token in doc if not (token.is_punct or token.is_space))
+                or key for key, doc in zip(keys, self.nlp.pipe(keys, disable=disabled))]
+
+    def _fuzzy(self, key: str, threshold: float):
+        """Best (entity id, similarity) by trigram Dice coefficient, None below threshold"""
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            posting = self.postings.get(gram, ())
+            if len(posting) <= MAX_POSTING:
+                shared.update(posting)
+        best = None
+        for entity_id, common in shared.most_common(20):
+            similarity = 2 * common / (len(grams) + self.gram_counts[entity_id])
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (entity_id, similarity)
+        return best
+
+    def canonicalize_many(self, names: list) -> list:
+        """Canonical name per surface name, learning new aliases (ingest time)"""
+        with self._lock:
+            keys = [surface_key(name) for name in names]
+            unknown = list(dict.fromkeys(key for key in keys if key and key not in self.aliases))
+            for key, lemma in zip(unknown, self._lemma_keys(unknown)):
+                name = names[keys.index(key)]
+                if lemma in self.lemma_ids:
+                    entity_id, stage = self.lemma_ids[lemma], "lemma"
+                else:
+                    match = self._fuzzy(lemma, INGEST_SIMILARITY)
+                    if match is not None and len(lemma.split()) == self.entity_words[match[0]]:
+                        entity_id, stage = match[0], "fuzzy"
+                    else:
+                        entity_id, stage = self._entity(display_name(name, lemma), lemma), "new"
+                self.lemma_ids.setdefault(lemma, entity_id)
+                self.aliases[key] = entity_id
+                self.counters[stage] += 1
+                self._pending.append({"alias": key, "lemma": lemma, "canonical": self.names[entity_id]})
+            self.counters["alias"] += len([key for key in keys if key]) - len(unknown)
+            return [self.names[self.aliases[key]] if key else name for key, name in zip(keys, names)]
+
+    def canonicalize(self, name: str) -> str:
+        return self.canonicalize_many([name])[0]
+
+    def resolve(self, mention: str):
+        """Canonical name of a query mention, None if unknown (no spaCy call)"""
+        key = surface_key(mention)
+        if not key:
+            return None
+        entity_id = self.aliases.get(key)
+        if entity_id is None:
+            match = self._fuzzy(key, QUERY_SIMILARITY)
+            if match is None:
+                return None
+            entity_id = match[0]
+        return self.names[entity_id]
+
+    def persist(self):
+        with self._lock:
+            if not self._pending:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for record in self._pending:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._pending = []
+
+    def stats(self) -> dict:
+        surfaces = len(self.aliases)
+        return {
+            "aliases": surfaces,
+            "entities": len(self.names),
+            "deduplication": 1 - len(self.names) / surfaces if surfaces else 0.0,
+            "resolved_by": dict(self.counters)
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    from kg_store import load_or_migrate
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "canonicalize":
+        import spacy
+        try:
+            nlp = spacy.load("ru_core_news_sm")
+        except OSError:
+            nlp = None
+        resolver = EntityResolver(nlp)
+        store = load_or_migrate()
+        before = store.stats()["entities"]
+        for subj, rel, obj in store.triplets():
+            canonical_subj, canonical_obj = resolver.canonicalize_many([subj, obj])
+            if (canonical_subj, canonical_obj) != (subj, obj):
+                store.delete(subj, rel, obj)
+                store.upsert_triplet(canonical_subj, rel, canonical_obj)
+        resolver.persist()
+        store.compact()
+        print(f"Entities in use: {before} -> {len({name for s, _, o in store.triplets() for name in (s, o)})}")
+        print(json.dumps(resolver.stats(), indent=2, ensure_ascii=False))
+    elif command == "stats":
+        print(json.dumps(EntityResolver().stats(), indent=2, ensure_ascii=False))
+    else:
+        print("Usage: python entity_resolver.py stats|canonicalize")
@@ -0,0 +1,160 @@
+"""
+Index manifest - tracks content hash and mtime of every file under documents_path
+so the vector index can be updated incrementally instead of rebuilt
+
+Usage:
+    python index_manifest.py status   # show added/changed/removed files
+    python index_manifest.py sync     # re-embed only what changed
+"""
+
+import hashlib
+import json
+import os
+from debug_logger import debug_logger
+
+MANIFEST_PATH = "./storage/manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Hash file content without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_document_files(documents_path: str) -> list:
+    """List all files under documents path (skipping hidden files, like SimpleDirectoryReader)"""
+    files = []
+    for root, dirs, names in os.walk(documents_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if not name.startswith('.'):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+class ManifestDiff:
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.unchanged = []
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def __str__(self):
+        return (f"{len(self.added)} added, {len(self.changed)} changed, "
+                f"{len(self.removed)} removed, {len(self.unchanged)} unchanged")
+
+
+class IndexManifest:
+    def __init__(self, documents_path: str, manifest_path: str = MANIFEST_PATH):
+        self.documents_path = documents_path
+        self.manifest_path = manifest_path
+        self.files = {}
+
+    def _key(self, file_path: str) -> str:
+        """Manifest key: path relative to documents_path with forward slashes"""
+        return os.path.relpath(os.path.abspath(file_path), os.path.abspath(self.documents_path)).replace(os.sep, '/')
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.documents_path, key)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def load(self):
+        """Load manifest from disk"""
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version: {data.get('version')}")
+        self.files = data.get("files", {})
+
+    def save(self):
+        """Atomically write manifest to disk"""
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def diff(self) -> ManifestDiff:
+        """Compare documents_path against the manifest (hashing only files whose size or mtime moved)"""
+        result = ManifestDiff()
+        seen = set()
+        for file_path in list_document_files(self.documents_path):
+            key = self._key(file_path)
+            seen.add(key)
+            entry = self.files.get(key)
+            if entry is None:
+                result.added.append(key)
+                continue
+            stat = os.stat(file_path)
+            if stat.st_size == entry.get("size") and stat.st_mtime == entry.get("mtime"):
+                result.unchanged.append(key)
+            elif file_sha256(file_path) == entry.get("sha256"):
+                # Touched but identical content, only refresh stat info
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime
+                result.unchanged.append(key)
+            else:
+                result.changed.append(key)
+        result.removed = sorted(key for key in self.files if key not in seen)
+        return result
+
+    def record(self, key: str, node_ids: list):
+        """Record current content hash, stat info and node ids of a file"""
+        file_path = self.path_for(key)
+        stat = os.stat(file_path)
+        self.files[key] = {
+            "sha256": file_sha256(file_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "node_ids": list(node_ids)
+        }
+
+    def forget(self, key: str) -> list:
+        """Remove file from manifest, returns node ids that belonged to it"""
+        entry = self.files.pop(key, None)
+        return entry.get("node_ids", []) if entry else []
+
+    def node_ids(self, key: str) -> list:
+        entry = self.files.get(key)
+        return entry.get("node_ids", []) if entry else []
+
+    def bootstrap(self, nodes) -> int:
+        """Build manifest from an existing index, nodes is an iterable of (node_id, metadata)"""
+        by_file = {}
+        for node_id, metadata in nodes:
+            file_path = (metadata or {}).get("file_path")
+            if file_path:
+                by_file.setdefault(self._key(file_path), []).append(node_id)
+        for key, node_ids in by_file.items():
+            if os.path.exists(self.path_for(key)):
+                self.record(key, node_ids)
+        debug_logger.log_info(f"Index manifest bootstrapped with {len(self.files)} files")
+        return len(self.files)
+
+
+if __name__ == "__main__":
+    import sys
+    from config_loader import load_config
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "status":
+        manifest = IndexManifest(load_config().documents_path)
+        if manifest.exists():
+            manifest.load()
+        print(f"Documents: {manifest.diff()}")
+    elif command == "sync":
+        from rag_embeddings import RAGEmbeddings
+        rag = RAGEmbeddings()
+        print(f"Sync: {rag.sync_documents()}")
+    else:
+        print("Usage: python index_manifest.py [status|sync]")
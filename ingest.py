@@ -0,0 +1,245 @@
+"""
+Bulk ingestion pipeline for the RAG corpus
+
+Files are parsed and chunked in a process pool, chunks are embedded in large
+batches, and every embedded batch is checkpointed under storage/ingest_checkpoint
+so an interrupted build resumes where it stopped.
+
+Usage:
+    python ingest.py [--workers 4] [--batch-size 256] [--rebuild]
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from debug_logger import debug_logger
+from index_manifest import IndexManifest, file_sha256
+
+CHECKPOINT_DIR = "./storage/ingest_checkpoint"
+
+
+def _parse_file(file_path: str, chunk_size: int, chunk_overlap: int) -> list:
+    """Load and chunk one file (runs in worker processes)"""
+    from llama_index.core import SimpleDirectoryReader
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import MetadataMode
+
+    documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [
+        {
+            "text": node.get_content(),
+            "embed_text": node.get_content(metadata_mode=MetadataMode.EMBED),
+            "metadata": node.metadata,
+            "ref_doc_id": node.ref_doc_id
+        }
+        for node in splitter.get_nodes_from_documents(documents)
+    ]
+
+
+def chunk_node_id(key: str, sha256: str, index: int) -> str:
+    """Deterministic node id so resumed and repeated runs produce the same ids"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}#{sha256}#{index}"))
+
+
+class IngestionPipeline:
+    def __init__(self, dense_store, embed_model, dtype: str = "float32", workers: int = 0,
+                 batch_size: int = 256, chunk_size: int = 1024, chunk_overlap: int = 200,
+                 checkpoint_dir: str = CHECKPOINT_DIR, full_precision: bool = False):
+        self.dense_store = dense_store
+        self.embed_model = embed_model
+        self.dtype = dtype
+        self.full_precision = full_precision
+        self.workers = workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.checkpoint_dir = checkpoint_dir
+        self.stats = {"chunks": 0, "tokens": 0, "resumed_chunks": 0, "seconds": 0.0}
+        # Embedding tokenizer when the model exposes one, whitespace words otherwise
+        self.token_unit = "tokens" if hasattr(embed_model, "count_tokens") else "words"
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.checkpoint_dir, name)
+
+    def _prepare_checkpoint(self, fingerprint: str):
+        """Reuse checkpoint of the same file set, otherwise start a clean one"""
+        state_path = self._checkpoint_path("state.json")
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("fingerprint") == fingerprint:
+                    print("Resuming ingestion from checkpoint...")
+                    return
+            shutil.rmtree(self.checkpoint_dir)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({"fingerprint": fingerprint}, f)
+
+    def _parse(self, files: list):
+        """Yield (key, chunks) in file order, parsing in a process pool when workers > 0"""
+        if self.workers > 0:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                paths = [path for _, path in files]
+                parsed = executor.map(_parse_file, paths, [self.chunk_size] * len(paths), [self.chunk_overlap] * len(paths))
+                for (key, _), chunks in zip(files, parsed):
+                    yield key, chunks
+        else:
+            for key, path in files:
+                yield key, _parse_file(path, self.chunk_size, self.chunk_overlap)
+
+    def _count_tokens(self, texts: list) -> int:
+        """Count tokens with the embedding tokenizer, falling back to whitespace words (reported as words/s)"""
+        if self.token_unit == "tokens":
+            try:
+                return self.embed_model.count_tokens(texts)
+            except Exception as e:
+                debug_logger.log_error(f"Embedding tokenizer unavailable, counting words instead: {e}", e)
+                self.token_unit = "words"
+                self.stats["tokens"] = 0
+        return sum(len(text.split()) for text in texts)
+
+    def _embed_batch(self, batch_no: int, batch: list):
+        """Embed one batch and checkpoint it, skipping batches already on disk"""
+        vectors_path = self._checkpoint_path(f"batch_{batch_no:06d}.npy")
+        nodes_path = self._checkpoint_path(f"batch_{batch_no:06d}.json")
+        if os.path.exists(vectors_path) and os.path.exists(nodes_path):
+            self.stats["resumed_chunks"] += len(batch)
+            return
+
+        texts = [chunk["embed_text"] for chunk in batch]
+        started = time.time()
+        embeddings = np.asarray(self.embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+        self.stats["seconds"] += time.time() - started
+        self.stats["chunks"] += len(batch)
+        self.stats["tokens"] += self._count_tokens(texts)
+
+        with open(nodes_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump([{"id": chunk["id"], "node": {"text": chunk["text"], "metadata": chunk["metadata"],
+                                                   "ref_doc_id": chunk["ref_doc_id"]}} for chunk in batch], f, ensure_ascii=False)
+        os.replace(nodes_path + ".tmp", nodes_path)
+        # Vectors are written last and mark the batch as complete
+        with open(vectors_path + ".tmp", 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(vectors_path + ".tmp", vectors_path)
+        print(f"Batch {batch_no}: {self.throughput()}")
+
+    def throughput(self) -> str:
+        seconds = max(self.stats["seconds"], 1e-9)
+        return (f"{self.stats['chunks']} chunks embedded "
+                f"({self.stats['chunks'] / seconds:.1f} chunks/s, {self.stats['tokens'] / seconds:.0f} {self.token_unit}/s), "
+                f"{self.stats['resumed_chunks']} resumed from checkpoint")
+
+    def _finalize(self, batch_count: int):
+        """Append checkpointed batches to the dense store"""
+        for batch_no in range(batch_count):
+            with open(self._checkpoint_path(f"batch_{batch_no:06d}.json"), 'r', encoding='utf-8') as f:
+                nodes = json.load(f)
+            embeddings = np.load(self._checkpoint_path(f"batch_{batch_no:06d}.npy"))
+            if self.dense_store.dim == 0:
+                self.dense_store.create(embeddings.shape[1], self.dtype, self.full_precision)
+            # Re-adding an id replaces its row, so a crash during finalize is safe to repeat
+            self.dense_store.add([n["id"] for n in nodes], embeddings, [n["node"] for n in nodes])
+
+    def run(self, manifest: IndexManifest, keys: list) -> int:
+        """Ingest files by manifest key and record them in the manifest, returns number of chunks"""
+        if not keys:
+            return 0
+        files = [(key, manifest.path_for(key)) for key in sorted(keys)]
+        hashes = {key: file_sha256(path) for key, path in files}
+        fingerprint = hashlib.sha256(json.dumps(
+            [hashes, self.batch_size, self.chunk_size, self.chunk_overlap], sort_keys=True).encode()).hexdigest()
+        self._prepare_checkpoint(fingerprint)
+
+        file_node_ids = {}
+        batch = []
+        batch_no = 0
+        for key, chunks in self._parse(files):
+            file_node_ids[key] = []
+            for i, chunk in enumerate(chunks):
+                chunk["id"] = chunk_node_id(key, hashes[key], i)
+                file_node_ids[key].append(chunk["id"])
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    self._embed_batch(batch_no, batch)
+                    batch_no += 1
+                    batch = []
+        if batch:
+            self._embed_batch(batch_no, batch)
+            batch_no += 1
+
+        self._finalize(batch_no)
+        for key, node_ids in file_node_ids.items():
+            manifest.record(key, node_ids)
+        manifest.save()
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+        total = sum(len(ids) for ids in file_node_ids.values())
+        debug_logger.log_info(f"Ingested {len(files)} files, {total} chunks: {self.throughput()}")
+        return total
+
+
+def sync_dense_store(dense_store, embed_model, manifest: IndexManifest, dtype: str = "float32", workers: int = 0,
+                     batch_size: int = 256, chunk_size: int = 1024, chunk_overlap: int = 200,
+                     full_precision: bool = False) -> str:
+    """Bring the dense store in line with documents_path using the manifest diff"""
+    diff = manifest.diff()
+    if not diff.has_changes:
+        manifest.save()
+        return f"Index up to date ({diff})"
+    print(f"Syncing documents: {diff}")
+
+    # Drop nodes of changed and removed files first
+    stale_ids = []
+    for key in diff.changed + diff.removed:
+        stale_ids.extend(manifest.forget(key))
+    if stale_ids:
+        dense_store.delete(stale_ids)
+    manifest.save()
+
+    pipeline = IngestionPipeline(dense_store, embed_model, dtype, workers, batch_size, chunk_size, chunk_overlap,
+                                 full_precision=full_precision)
+    indexed = pipeline.run(manifest, diff.added + diff.changed)
+    if len(dense_store.deleted) > dense_store.count // 4:
+        dense_store.compact()
+
+    result = f"Synced documents ({diff}): {indexed} nodes embedded, {len(stale_ids)} nodes removed; {pipeline.throughput()}"
+    debug_logger.log_info(result)
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    from config_loader import load_config
+    from dense_store import DenseVectorStore, DENSE_STORE_DIR
+
+    parser = argparse.ArgumentParser(description="Parallel, resumable ingestion of documents_path into the dense store")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="parser processes")
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per embedding batch")
+    parser.add_argument("--rebuild", action="store_true", help="discard the existing store and re-embed everything")
+    args = parser.parse_args()
+
+    config = load_config()
+    from llama_index.core import Settings
+    # Same provider as the bot: reuses a running embedding service when embedding_socket is set
+    from embedding_service import embedding_provider, make_llama_embedding
+    embed_model = make_llama_embedding(embedding_provider)
+
+    store = DenseVectorStore(DENSE_STORE_DIR)
+    manifest = IndexManifest(config.documents_path)
+    if args.rebuild:
+        if os.path.exists(manifest.manifest_path):
+            os.remove(manifest.manifest_path)
+    elif DenseVectorStore.exists(DENSE_STORE_DIR):
+        store.load()
+        if manifest.exists():
+            manifest.load()
+        else:
+            manifest.bootstrap((node_id, store.get_node(row).get("metadata", {})) for node_id, row in store.id_to_row.items())
+
+    print(sync_dense_store(store, embed_model, manifest, config.vector_dtype, args.workers, args.batch_size,
+                           Settings.chunk_size, Settings.chunk_overlap, config.vector_rescore))
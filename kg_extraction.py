@@ -0,0 +1,178 @@
+"""
+Chunked entity and relation extraction for knowledge graph ingestion
+
+Whole documents are processed chunk by chunk: spaCy NER runs over windows of
+chunks with nlp.pipe, and relation prompts go to the LLM from a bounded
+thread pool (Ollama serves them in parallel up to OLLAMA_NUM_PARALLEL).
+Results are cached per chunk hash in storage/kg_extract_cache.jsonl, so
+re-ingesting a document costs no spaCy or LLM work for unchanged chunks. The
+cache file is only read when the first document is ingested, not on startup.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from debug_logger import debug_logger
+
+EXTRACTION_CACHE_PATH = "./storage/kg_extract_cache.jsonl"
+# Bump when the prompt or parsing changes, old cache entries are then ignored
+PROMPT_VERSION = 1
+MAX_ENTITIES_PER_PROMPT = 15
+MAX_TRIPLETS_PER_CHUNK = 20
+MAX_PROMPT_CHARS = 6000
+# NER needs neither the parser nor the lemmatizer
+_DISABLED_PIPES = ("parser", "lemmatizer")
+
+
+def relation_prompt(entities: list, text: str) -> str:
+    entity_list = ", ".join([f"{e[0]} ({e[1]})" for e in entities[:MAX_ENTITIES_PER_PROMPT]])
+    return f"""Из текста извлеките связи между сущностями в формате: субъект|отношение|объект
+
+Сущности: {entity_list}
+
+Текст: {text[:MAX_PROMPT_CHARS]}
+
+Верните только связи, по одной на строку. Пример:
+Сталин|родился_в|Гори
+Гори|находится_в|Грузия"""
+
+
+def parse_triplets(response: str) -> list:
+    triplets = []
+    for line in str(response).strip().split('\n'):
+        if '|' in line:
+            parts = [p.strip() for p in line.split('|')]
+            if len(parts) == 3 and all(parts):
+                triplets.append(tuple(parts))
+    return triplets[:MAX_TRIPLETS_PER_CHUNK]
+
+
+class ExtractionCache:
+    """Append-only chunk hash -> (entities, triplets) cache"""
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH):
+        self.path = path
+        self.entries = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self.entries is None:
+                entries = {}
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                record = json.loads(line)
+                            except json.JSONDecodeError:
+                                # Torn last line of an interrupted run
+                                continue
+                            entries[record["key"]] = (record["entities"], record["triplets"])
+                self.entries = entries
+        return self.entries
+
+    def get(self, key: str):
+        return self._load().get(key)
+
+    def put(self, key: str, entities: list, triplets: list):
+        entries = self._load()
+        with self._lock:
+            entries[key] = (entities, triplets)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "entities": entities, "triplets": triplets}, ensure_ascii=False) + "\n")
+
+
+class RelationExtractor:
+    def __init__(self, nlp, complete, model_name: str, workers: int = 4, batch_size: int = 32,
+                 cache: ExtractionCache = None):
+        self.nlp = nlp
+        self.complete = complete
+        self.model_name = model_name
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.cache = cache if cache is not None else ExtractionCache()
+
+    def chunk_key(self, text: str) -> str:
+        return hashlib.sha1(f"{PROMPT_VERSION}:{self.model_name}:{text}".encode("utf-8")).hexdigest()
+
+    def _entities(self, texts: list) -> list:
+        """Named entities per text, spaCy over the whole batch"""
+        if self.nlp is None:
+            return [[] for _ in texts]
+        disabled = [name for name in self.nlp.pipe_names if name in _DISABLED_PIPES]
+        return [
+            [(ent.text.strip(), ent.label_) for ent in doc.ents if len(ent.text.strip()) > 1]
+            for doc in self.nlp.pipe(texts, batch_size=self.batch_size, disable=disabled)
+        ]
+
+    def _relations(self, key: str, entities: list, text: str):
+        """Triplets of a chunk, None if the LLM call failed"""
+        triplets = []
+        if len(entities) >= 2:
+            try:
+                triplets = parse_triplets(self.complete(relation_prompt(entities, text)))
+            except Exception as e:
+                # Not cached, the chunk is retried on the next ingestion
+                debug_logger.log_error(f"LLM relation extraction error: {e}", e)
+                return None
+        self.cache.put(key, [list(e) for e in entities], [list(t) for t in triplets])
+        return triplets
+
+    def extract(self, chunks, progress: dict = None):
+        """Yield (chunk key, chunk, triplets) in input order, LLM calls overlapping across chunks"""
+        progress = progress if progress is not None else {}
+        progress.update({"chunks": 0, "cached": 0, "llm_calls": 0, "triplets": 0, "errors": 0,
+                         "started": time.perf_counter()})
+        pending = deque()
+
+        def finished():
+            key, chunk, result = pending.popleft()
+            extracted = result.result()
+            if extracted is None:
+                progress["errors"] += 1
+            triplets = [tuple(t) for t in extracted or []]
+            progress["chunks"] += 1
+            progress["triplets"] += len(triplets)
+            return key, chunk, triplets
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kg-extract") as executor:
+            window = []
+            for chunk in chunks:
+                window.append(chunk)
+                if len(window) < self.batch_size:
+                    continue
+                self._submit(window, executor, pending, progress)
+                window = []
+                # Keep at most one window of results waiting
+                while len(pending) > self.batch_size:
+                    yield finished()
+            if window:
+                self._submit(window, executor, pending, progress)
+            while pending:
+                yield finished()
+
+    def _submit(self, window: list, executor, pending: deque, progress: dict):
+        keys = [self.chunk_key(chunk) for chunk in window]
+        misses = [i for i, key in enumerate(keys) if self.cache.get(key) is None]
+        entities = dict(zip(misses, self._entities([window[i] for i in misses])))
+        for i, (key, chunk) in enumerate(zip(keys, window)):
+            if i in entities:
+                if len(entities[i]) >= 2:
+                    progress["llm_calls"] += 1
+                result = executor.submit(self._relations, key, entities[i], chunk)
+            else:
+                progress["cached"] += 1
+                result = Future()
+                result.set_result(self.cache.get(key)[1])
+            pending.append((key, chunk, result))
+
+
+def throughput(progress: dict) -> float:
+    """Chunks per minute so far"""
+    elapsed = time.perf_counter() - progress.get("started", time.perf_counter())
+    return progress.get("chunks", 0) * 60 / elapsed if elapsed > 0 else 0.0
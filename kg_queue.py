@@ -0,0 +1,197 @@
+"""
+Background knowledge graph ingestion queue
+
+Uploaded documents are spooled chunk by chunk to storage/kg/queue/<hash>.jsonl
+while they are embedded, and the reply is produced from vector context without
+waiting for relation extraction. A fixed number of worker threads then feeds
+the spooled chunks to KnowledgeGraphBuilder.add_document_chunks.
+
+Jobs are keyed by the SHA-256 of their chunk texts: a document that is queued,
+running or already ingested is not queued again, a failed one (spool kept) is. Job states are appended to
+storage/kg/ingest_queue.jsonl; on startup jobs that never finished (including
+ones interrupted mid-run, whose finished chunks come back from the extraction
+cache) are queued again.
+
+Usage:
+    python kg_queue.py status
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from debug_logger import debug_logger
+
+QUEUE_DIR = "./storage/kg/queue"
+JOURNAL_PATH = "./storage/kg/ingest_queue.jsonl"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def load_jobs(path: str = JOURNAL_PATH) -> dict:
+    """Latest record per job key from the journal, in submission order"""
+    jobs = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                jobs[record["key"]] = {**jobs.get(record["key"], {}), **record}
+    return jobs
+
+
+class ChunkSpool:
+    """Writes a document's chunks to a temporary spool file while hashing them"""
+
+    def __init__(self, ingest_queue: "IngestQueue", doc_name: str):
+        self.ingest_queue = ingest_queue
+        self.doc_name = doc_name
+        self.count = 0
+        self._hash = hashlib.sha256()
+        self.tmp_path = os.path.join(ingest_queue.queue_dir, f"{threading.get_ident()}-{time.time_ns()}.tmp")
+        self._file = open(self.tmp_path, "w", encoding="utf-8")
+
+    def add(self, chunk: str):
+        self._file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        self._hash.update(chunk.encode("utf-8"))
+        self._hash.update(b"\0")
+        self.count += 1
+
+    def commit(self) -> dict:
+        """Queue the spooled document, returns its job (the existing one for known content)"""
+        self._file.close()
+        if self.count == 0:
+            os.remove(self.tmp_path)
+            return None
+        return self.ingest_queue._submit_spool(self._hash.hexdigest(), self.tmp_path, self.doc_name, self.count)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class IngestQueue:
+    def __init__(self, kg_builder, workers: int = 1, queue_dir: str = QUEUE_DIR, journal_path: str = JOURNAL_PATH):
+        self.kg_builder = kg_builder
+        self.queue_dir = queue_dir
+        self.journal_path = journal_path
+        self._pending = queue.Queue()
+        self._lock = threading.RLock()
+        os.makedirs(queue_dir, exist_ok=True)
+        self.jobs = load_jobs(journal_path)
+        for name in os.listdir(queue_dir):
+            if name.endswith(".tmp"):
+                # Spool of an upload interrupted before it was queued
+                os.remove(os.path.join(queue_dir, name))
+        resumed = 0
+        for key, job in self.jobs.items():
+            if job["state"] in (QUEUED, RUNNING):
+                if os.path.exists(self._spool_path(key)):
+                    job["state"] = QUEUED
+                    self._pending.put(key)
+                    resumed += 1
+                else:
+                    self._record(key, state=FAILED, error="spool file missing")
+        if resumed:
+            print(f"Resuming {resumed} queued knowledge graph ingestion jobs")
+        self.workers = [threading.Thread(target=self._worker, name=f"kg-ingest-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+
+    def _spool_path(self, key: str) -> str:
+        return os.path.join(self.queue_dir, f"{key}.jsonl")
+
+    def _record(self, key: str, **fields):
+        """Update a job and append the change to the journal"""
+        with self._lock:
+            job = self.jobs.setdefault(key, {"key": key})
+            job.update(fields, updated=time.time())
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, **fields, "updated": job["updated"]}, ensure_ascii=False) + "\n")
+            return dict(job)
+
+    def open_spool(self, doc_name: str) -> ChunkSpool:
+        return ChunkSpool(self, doc_name)
+
+    def submit(self, chunks, doc_name: str = "document") -> dict:
+        """Queue an iterable of text chunks, returns the job"""
+        spool = self.open_spool(doc_name)
+        try:
+            for chunk in chunks:
+                spool.add(chunk)
+        except Exception:
+            spool.abort()
+            raise
+        return spool.commit()
+
+    def _submit_spool(self, key: str, tmp_path: str, doc_name: str, count: int) -> dict:
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is not None and job["state"] != FAILED:
+                os.remove(tmp_path)
+                debug_logger.log_info(f"KG ingestion of {doc_name} skipped, same content is {job['state']} as {job['name']}")
+                return dict(job)
+            os.replace(tmp_path, self._spool_path(key))
+            job = self._record(key, state=QUEUED, name=doc_name, chunks=count, submitted=time.time())
+        self._pending.put(key)
+        return job
+
+    def _worker(self):
+        while True:
+            key = self._pending.get()
+            name = self.jobs[key]["name"]
+            self._record(key, state=RUNNING, started=time.time())
+            try:
+                with open(self._spool_path(key), "r", encoding="utf-8") as f:
+                    result = self.kg_builder.add_document_chunks((json.loads(line) for line in f), name,
+                                                                 raise_errors=True)
+                self._record(key, state=DONE, result=result)
+                os.remove(self._spool_path(key))
+            except Exception as e:
+                # The spool stays, uploading the same document again retries the job
+                debug_logger.log_error(f"KG ingestion of {name} failed: {e}", e)
+                self._record(key, state=FAILED, error=str(e))
+            finally:
+                self._pending.task_done()
+
+    def join(self):
+        """Block until every queued job has finished"""
+        self._pending.join()
+
+    def status(self, key: str = None) -> dict:
+        """Job counts by state and the unfinished jobs, or a single job"""
+        with self._lock:
+            if key is not None:
+                return dict(self.jobs.get(key) or {"key": key, "state": "unknown"})
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self.jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            active = [{k: job.get(k) for k in ("key", "name", "state", "chunks", "submitted")}
+                      for job in self.jobs.values() if job["state"] in (QUEUED, RUNNING)]
+            return {**counts, "active": active}
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "status":
+        jobs = load_jobs()
+        counts = {}
+        for job in jobs.values():
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        print(json.dumps(counts, indent=2))
+        for job in jobs.values():
+            if job["state"] != DONE:
+                print(f"{job['state']:8} {job['key'][:12]} {job.get('name')} ({job.get('chunks')} chunks) {job.get('error', '')}")
+    else:
+        print("Usage: python kg_queue.py status")
@@ -0,0 +1,429 @@
+"""
+Compact knowledge graph store: interned strings, CSR adjacency, append-only log
+
+Entity and relation names are interned to integer ids. The graph as of the
+last compaction is a CSR snapshot of NumPy arrays, memory-mapped on load;
+triplets added since then live in small in-memory delta maps and in an
+append-only log, so adding a document writes only its new triplets. The log
+is folded into a new snapshot once it exceeds COMPACT_RATIO of it.
+
+Layout (storage/kg/):
+    meta.json            format version, current snapshot directory, counts
+    triplets.log         ["+" | "-", subject, relation, object] per change since the snapshot
+    snapshot-<n>/
+        entities.txt     entity name per id, one per line
+        relations.txt    relation name per id
+        out_offsets.npy  edge range per subject id (edges sorted by subject)
+        edge_subj.npy    subject id per edge
+        edge_rel.npy     relation id per edge
+        edge_obj.npy     object id per edge
+        in_offsets.npy   in_edges range per object id
+        in_edges.npy     edge numbers sorted by object
+
+Usage:
+    python kg_store.py stats
+    python kg_store.py compact
+"""
+
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from debug_logger import debug_logger
+
+KG_STORE_DIR = "./storage/kg"
+LEGACY_GRAPH_STORE = "./storage/graph_store.json"
+FORMAT_VERSION = 2
+# Log records relative to the snapshot that trigger compaction
+COMPACT_RATIO = 0.25
+COMPACT_MIN_RECORDS = 10000
+_ARRAYS = ("out_offsets", "edge_subj", "edge_rel", "edge_obj", "in_offsets", "in_edges")
+
+
+def _clean(name: str) -> str:
+    """Names are stored one per line"""
+    return " ".join(str(name).split())
+
+
+class TripletStore:
+    """LlamaIndex GraphStore over interned ids and CSR arrays"""
+
+    schema = ""
+
+    def __init__(self, store_dir: str = KG_STORE_DIR):
+        self.store_dir = store_dir
+        self.snapshot_name = None
+        self.entities = []
+        self.entity_ids = {}
+        self.relations = []
+        self.relation_ids = {}
+        self._set_snapshot({
+            "out_offsets": np.zeros(1, dtype=np.int64),
+            "edge_subj": np.zeros(0, dtype=np.int32),
+            "edge_rel": np.zeros(0, dtype=np.int32),
+            "edge_obj": np.zeros(0, dtype=np.int32),
+            "in_offsets": np.zeros(1, dtype=np.int64),
+            "in_edges": np.zeros(0, dtype=np.int64)
+        })
+        # Snapshot edges removed since the snapshot, as (subject, relation, object) ids
+        self.deleted = set()
+        # Triplets added since the snapshot
+        self.delta_out = {}
+        self.delta_in = {}
+        self.delta_set = set()
+        self.delta_order = []
+        self.log_records = 0
+        self._pending = []
+        # Triplets present at load followed by those upserted in this process, see changes()
+        self._loaded_count = 0
+        self._added = []
+        # Change counter, lets neighbourhood caches detect updates
+        self.version = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def exists(store_dir: str = KG_STORE_DIR) -> bool:
+        return os.path.exists(os.path.join(store_dir, "meta.json"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _set_snapshot(self, arrays: dict):
+        self.out_offsets = arrays["out_offsets"]
+        self.edge_subj = arrays["edge_subj"]
+        self.edge_rel = arrays["edge_rel"]
+        self.edge_obj = arrays["edge_obj"]
+        self.in_offsets = arrays["in_offsets"]
+        self.in_edges = arrays["in_edges"]
+        self.snapshot_edges = len(self.edge_subj)
+        self.snapshot_entities = len(self.out_offsets) - 1
+
+    @property
+    def client(self):
+        return None
+
+    def _intern(self, names: list, ids: dict, name: str) -> int:
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = len(names)
+            names.append(name)
+            ids[name] = name_id
+        return name_id
+
+    def _ids(self, subj: str, rel: str, obj: str) -> tuple:
+        return (self._intern(self.entities, self.entity_ids, _clean(subj)),
+                self._intern(self.relations, self.relation_ids, _clean(rel)),
+                self._intern(self.entities, self.entity_ids, _clean(obj)))
+
+    def _lookup(self, subj: str, rel: str, obj: str):
+        """Ids of an existing triplet's names, None if any name is unknown"""
+        ids = (self.entity_ids.get(_clean(subj)), self.relation_ids.get(_clean(rel)), self.entity_ids.get(_clean(obj)))
+        return None if None in ids else ids
+
+    def _snapshot_edge(self, s: int, r: int, o: int) -> bool:
+        if s >= self.snapshot_entities:
+            return False
+        lo, hi = self.out_offsets[s], self.out_offsets[s + 1]
+        return bool(np.any((self.edge_rel[lo:hi] == r) & (self.edge_obj[lo:hi] == o)))
+
+    def _contains(self, triplet: tuple) -> bool:
+        if triplet in self.delta_set:
+            return True
+        return triplet not in self.deleted and self._snapshot_edge(*triplet)
+
+    def _out_edges(self, s: int) -> list:
+        """(relation id, object id) of live edges leaving s"""
+        edges = []
+        if s < self.snapshot_entities:
+            lo, hi = self.out_offsets[s], self.out_offsets[s + 1]
+            edges = list(zip(self.edge_rel[lo:hi].tolist(), self.edge_obj[lo:hi].tolist()))
+            if self.deleted:
+                edges = [(r, o) for r, o in edges if (s, r, o) not in self.deleted]
+        return edges + self.delta_out.get(s, [])
+
+    def _in_edges(self, o: int) -> list:
+        """(subject id, relation id) of live edges entering o"""
+        edges = []
+        if o < self.snapshot_entities:
+            numbers = self.in_edges[self.in_offsets[o]:self.in_offsets[o + 1]]
+            edges = list(zip(self.edge_subj[numbers].tolist(), self.edge_rel[numbers].tolist()))
+            if self.deleted:
+                edges = [(s, r) for s, r in edges if (s, r, o) not in self.deleted]
+        return edges + self.delta_in.get(o, [])
+
+    def _apply(self, op: str, subj: str, rel: str, obj: str) -> bool:
+        self.version += 1
+        if op == "+":
+            triplet = self._ids(subj, rel, obj)
+            if self._contains(triplet):
+                return False
+            if triplet in self.deleted:
+                self.deleted.discard(triplet)
+            else:
+                s, r, o = triplet
+                self.delta_out.setdefault(s, []).append((r, o))
+                self.delta_in.setdefault(o, []).append((s, r))
+                self.delta_set.add(triplet)
+                self.delta_order.append(triplet)
+            return True
+        triplet = self._lookup(subj, rel, obj)
+        if triplet is None or not self._contains(triplet):
+            return False
+        if triplet in self.delta_set:
+            s, r, o = triplet
+            self.delta_set.discard(triplet)
+            self.delta_order.remove(triplet)
+            self.delta_out[s].remove((r, o))
+            self.delta_in[o].remove((s, r))
+        else:
+            self.deleted.add(triplet)
+        return True
+
+    def entity_id(self, name: str):
+        return self.entity_ids.get(_clean(name))
+
+    def relation_id(self, name: str):
+        return self.relation_ids.get(_clean(name))
+
+    def degree(self, entity_id: int) -> int:
+        """Edges touching an entity (deletions since the snapshot not subtracted)"""
+        degree = len(self.delta_out.get(entity_id, ())) + len(self.delta_in.get(entity_id, ()))
+        if entity_id < self.snapshot_entities:
+            degree += int(self.out_offsets[entity_id + 1] - self.out_offsets[entity_id])
+            degree += int(self.in_offsets[entity_id + 1] - self.in_offsets[entity_id])
+        return degree
+
+    def neighbours(self, entity_id: int) -> list:
+        """(neighbour id, relation id, outgoing) for every live edge touching an entity"""
+        with self._lock:
+            return ([(o, r, True) for r, o in self._out_edges(entity_id)] +
+                    [(s, r, False) for s, r in self._in_edges(entity_id)])
+
+    def get(self, subj: str) -> list:
+        """[[relation, object], ...] of a subject"""
+        with self._lock:
+            s = self.entity_ids.get(_clean(subj))
+            if s is None:
+                return []
+            return [[self.relations[r], self.entities[o]] for r, o in self._out_edges(s)]
+
+    def get_incoming(self, obj: str) -> list:
+        """[[subject, relation], ...] pointing at an object"""
+        with self._lock:
+            o = self.entity_ids.get(_clean(obj))
+            if o is None:
+                return []
+            return [[self.entities[s], self.relations[r]] for s, r in self._in_edges(o)]
+
+    def _get_rel_map(self, subj: str, depth: int = 2, limit: int = 30) -> list:
+        if depth == 0:
+            return []
+        rel_map = []
+        for rel, obj in self.get(subj)[:limit]:
+            rel_map.append([subj, rel, obj])
+            rel_map += self._get_rel_map(obj, depth=depth - 1)
+        return rel_map
+
+    def get_rel_map(self, subjs: list = None, depth: int = 2, limit: int = 30) -> dict:
+        """Subjects' rel map in max depth, truncated like SimpleGraphStore"""
+        if subjs is None:
+            subjs = [name for s, name in enumerate(self.entities) if self._out_edges(s)]
+        return_map = {}
+        rel_count = 0
+        for subj in subjs:
+            rel_map = self._get_rel_map(subj, depth=depth, limit=limit)
+            if rel_count + len(rel_map) > limit:
+                return_map[subj] = rel_map[:limit - rel_count]
+                break
+            return_map[subj] = rel_map
+            rel_count += len(rel_map)
+        return return_map
+
+    def upsert_triplet(self, subj: str, rel: str, obj: str) -> None:
+        with self._lock:
+            if self._apply("+", subj, rel, obj):
+                self._pending.append(["+", subj, rel, obj])
+                self._added.append(self._ids(subj, rel, obj))
+
+    def delete(self, subj: str, rel: str, obj: str) -> None:
+        with self._lock:
+            if self._apply("-", subj, rel, obj):
+                self._pending.append(["-", subj, rel, obj])
+
+    def get_schema(self, refresh: bool = False) -> str:
+        raise NotImplementedError("TripletStore does not support get_schema")
+
+    def query(self, query: str, param_map: dict = None):
+        raise NotImplementedError("TripletStore does not support query")
+
+    def _names(self, triplet: tuple) -> tuple:
+        s, r, o = triplet
+        return self.entities[s], self.relations[r], self.entities[o]
+
+    def triplets(self) -> list:
+        """All live (subject, relation, object) triplets"""
+        with self._lock:
+            live = list(zip(self.edge_subj.tolist(), self.edge_rel.tolist(), self.edge_obj.tolist()))
+            if self.deleted:
+                live = [t for t in live if t not in self.deleted]
+            live += self.delta_order
+            return [self._names(t) for t in live]
+
+    def changes(self, start: int = 0):
+        """(triplets added after position start and still present, next start); 0 means everything"""
+        with self._lock:
+            end = self._loaded_count + len(self._added)
+            if start < self._loaded_count:
+                return self.triplets(), end
+            added = self._added[start - self._loaded_count:]
+            return [self._names(t) for t in added if self._contains(t)], end
+
+    def triplet_count(self) -> int:
+        return self.snapshot_edges - len(self.deleted) + len(self.delta_order)
+
+    def load(self):
+        with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") == 1:
+            # Previous format, converted to a CSR snapshot on the next persist
+            with open(self._path("snapshot.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    self._apply("+", *json.loads(line))
+        elif meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported knowledge graph store version {meta.get('version')}")
+        else:
+            self.snapshot_name = meta["snapshot"]
+            snapshot_dir = self._path(self.snapshot_name)
+            with open(os.path.join(snapshot_dir, "entities.txt"), "r", encoding="utf-8") as f:
+                self.entities = f.read().split("\n")[:meta["entities"]]
+            with open(os.path.join(snapshot_dir, "relations.txt"), "r", encoding="utf-8") as f:
+                self.relations = f.read().split("\n")[:meta["relations"]]
+            self.entity_ids = {name: i for i, name in enumerate(self.entities)}
+            self.relation_ids = {name: i for i, name in enumerate(self.relations)}
+            self._set_snapshot({name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r")
+                                for name in _ARRAYS})
+        self._replay_log()
+        self._loaded_count = self.triplet_count()
+        debug_logger.log_info(f"Loaded knowledge graph store: {self.stats()}")
+
+    def _replay_log(self):
+        if not os.path.exists(self._path("triplets.log")):
+            return
+        with open(self._path("triplets.log"), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op, subj, rel, obj = json.loads(line)
+                except ValueError:
+                    # Torn last record of an interrupted write
+                    continue
+                self._apply(op, subj, rel, obj)
+                self.log_records += 1
+
+    def persist(self, persist_path: str = None, fs=None) -> None:
+        """Append pending changes to the log (persist_path is ignored), compacting when the log is large"""
+        with self._lock:
+            if self.snapshot_name is None:
+                self.compact()
+                return
+            if self._pending:
+                with open(self._path("triplets.log"), "a", encoding="utf-8") as f:
+                    for record in self._pending:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.log_records += len(self._pending)
+                self._pending = []
+            if self.log_records >= max(COMPACT_MIN_RECORDS, COMPACT_RATIO * self.snapshot_edges):
+                self.compact()
+
+    def compact(self):
+        """Fold snapshot, delta and deletions into a new CSR snapshot and start an empty log"""
+        with self._lock:
+            os.makedirs(self.store_dir, exist_ok=True)
+            edges = np.stack([self.edge_subj, self.edge_rel, self.edge_obj], axis=1).astype(np.int32)
+            if self.deleted:
+                keep = [tuple(edge) not in self.deleted for edge in edges.tolist()]
+                edges = edges[np.array(keep, dtype=bool)]
+            if self.delta_order:
+                edges = np.concatenate([edges, np.array(self.delta_order, dtype=np.int32)])
+            edges = edges[np.argsort(edges[:, 0], kind="stable")]
+            entity_count = len(self.entities)
+            arrays = {
+                "out_offsets": np.concatenate([[0], np.cumsum(np.bincount(edges[:, 0], minlength=entity_count))]).astype(np.int64),
+                "edge_subj": np.ascontiguousarray(edges[:, 0]),
+                "edge_rel": np.ascontiguousarray(edges[:, 1]),
+                "edge_obj": np.ascontiguousarray(edges[:, 2]),
+                "in_offsets": np.concatenate([[0], np.cumsum(np.bincount(edges[:, 2], minlength=entity_count))]).astype(np.int64),
+                "in_edges": np.argsort(edges[:, 2], kind="stable").astype(np.int64)
+            }
+
+            number = int(self.snapshot_name.rsplit("-", 1)[1]) + 1 if self.snapshot_name else 1
+            snapshot_name = f"snapshot-{number}"
+            snapshot_dir = self._path(snapshot_name)
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            os.makedirs(snapshot_dir)
+            with open(os.path.join(snapshot_dir, "entities.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(self.entities))
+            with open(os.path.join(snapshot_dir, "relations.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(self.relations))
+            for name, array in arrays.items():
+                np.save(os.path.join(snapshot_dir, f"{name}.npy"), array)
+
+            # Switching meta.json commits the snapshot; a crash before the log is cleared only replays duplicates
+            tmp_path = self._path("meta.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": FORMAT_VERSION, "snapshot": snapshot_name, "entities": len(self.entities),
+                           "relations": len(self.relations), "triplets": len(edges)}, f)
+            os.replace(tmp_path, self._path("meta.json"))
+            with open(self._path("triplets.log"), "w", encoding="utf-8"):
+                pass
+
+            self.snapshot_name = snapshot_name
+            self._set_snapshot(arrays)
+            self.deleted = set()
+            self.delta_out, self.delta_in = {}, {}
+            self.delta_set, self.delta_order = set(), []
+            self.log_records = 0
+            self._pending = []
+            for name in os.listdir(self.store_dir):
+                path = self._path(name)
+                if name.startswith("snapshot") and name != snapshot_name:
+                    # A snapshot still memory-mapped on Windows is removed by a later compaction
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            debug_logger.log_info(f"Compacted knowledge graph store into {snapshot_name}: {len(edges)} triplets")
+
+    def stats(self) -> dict:
+        return {"triplets": self.triplet_count(), "entities": len(self.entities), "relations": len(self.relations),
+                "snapshot": self.snapshot_edges, "log_records": self.log_records, "pending": len(self._pending)}
+
+
+def load_or_migrate(store_dir: str = KG_STORE_DIR, legacy_path: str = LEGACY_GRAPH_STORE) -> TripletStore:
+    """Open the store, importing a legacy graph_store.json on first use"""
+    store = TripletStore(store_dir)
+    if TripletStore.exists(store_dir):
+        store.load()
+    elif os.path.exists(legacy_path):
+        print("Migrating knowledge graph from graph_store.json...")
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            graph_dict = json.load(f).get("graph_dict", {})
+        for subj, relations in graph_dict.items():
+            for rel, obj in relations:
+                store.upsert_triplet(subj, rel, obj)
+        store.compact()
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    store = load_or_migrate()
+    if command == "compact":
+        store.compact()
+    elif command != "stats":
+        print("Usage: python kg_store.py stats|compact")
+    print(json.dumps(store.stats(), indent=2))
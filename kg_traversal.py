@@ -0,0 +1,92 @@
+"""
+Bounded multi-hop traversal over the knowledge graph store
+
+Breadth-first from seed entities up to `hops` edges, following edges in both
+directions. At hop h each frontier entity expands at most fan_out[h] of its
+neighbours (the most specific, i.e. lowest degree, first), optionally only
+over the given relation types, and the next frontier keeps the MAX_FRONTIER
+best entities. A path is scored
+
+    weight(seed) * prod over steps i of  HOP_DECAY^i / log2(2 + degree(entity left at step i))
+
+so paths through hub entities count less. Sorted neighbour lists of hubs
+(degree >= hub_degree) are kept in an LRU cache until the graph changes.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+HOP_DECAY = 0.5
+DEFAULT_FAN_OUT = (32, 8)
+MAX_FRONTIER = 64
+
+
+class GraphTraversal:
+    def __init__(self, store, hub_degree: int = 64, cache_size: int = 512):
+        self.store = store
+        self.hub_degree = hub_degree
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _ranked_neighbours(self, entity_id: int) -> list:
+        """(neighbour, relation, outgoing) touching an entity, lowest neighbour degree first"""
+        with self._lock:
+            if self._cache_version != self.store.version:
+                self._cache.clear()
+                self._cache_version = self.store.version
+            cached = self._cache.get(entity_id)
+            if cached is not None:
+                self._cache.move_to_end(entity_id)
+                self.cache_hits += 1
+                return cached
+        neighbours = self.store.neighbours(entity_id)
+        ranked = sorted(neighbours, key=lambda edge: (self.store.degree(edge[0]), edge[0], edge[1]))
+        if len(ranked) >= self.hub_degree:
+            with self._lock:
+                self.cache_misses += 1
+                self._cache[entity_id] = ranked
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return ranked
+
+    def paths(self, seeds: dict, hops: int = 2, fan_out=None, relations=None, limit: int = 20) -> list:
+        """(score, path) best first; a path is a tuple of (subject, relation, object) id triplets"""
+        fan_out = list(fan_out or DEFAULT_FAN_OUT)
+        fan_out += [fan_out[-1]] * max(0, hops - len(fan_out))
+        frontier = {entity_id: (weight, ()) for entity_id, weight in seeds.items()}
+        visited = set(frontier)
+        results = []
+        for hop in range(hops):
+            next_frontier = {}
+            for entity_id, (weight, path) in frontier.items():
+                step = weight * HOP_DECAY ** hop / math.log2(2 + self.store.degree(entity_id))
+                expanded = 0
+                for neighbour, relation, outgoing in self._ranked_neighbours(entity_id):
+                    if expanded >= fan_out[hop]:
+                        break
+                    if neighbour in visited or (relations is not None and relation not in relations):
+                        continue
+                    expanded += 1
+                    triplet = (entity_id, relation, neighbour) if outgoing else (neighbour, relation, entity_id)
+                    extended = path + (triplet,)
+                    results.append((step, extended))
+                    if step > next_frontier.get(neighbour, (0.0,))[0]:
+                        next_frontier[neighbour] = (step, extended)
+            frontier = dict(sorted(next_frontier.items(), key=lambda item: -item[1][0])[:MAX_FRONTIER])
+            visited.update(frontier)
+            if not frontier:
+                break
+        results.sort(key=lambda result: -result[0])
+        return results[:limit]
+
+    def describe(self, path: tuple) -> list:
+        """Path with names instead of ids"""
+        return [[self.store.entities[s], self.store.relations[r], self.store.entities[o]] for s, r, o in path]
+
+    def stats(self) -> dict:
+        return {"cached_hubs": len(self._cache), "cache_hits": self.cache_hits, "cache_misses": self.cache_misses}
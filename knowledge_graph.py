@@ -1,23 +1,58 @@
-from llama_index.core import KnowledgeGraphIndex, StorageContext, load_index_from_storage, Settings
-from llama_index.core.graph_stores import SimpleGraphStore
-from llama_index.core import Document
+from llama_index.core import KnowledgeGraphIndex, StorageContext, Settings
 from llama_index.llms.ollama import Ollama
 from config_loader import load_config
 from debug_logger import debug_logger
+from triplet_index import TripletIndex, format_fact
+from kg_traversal import GraphTraversal
+from kg_queue import IngestQueue
+from kg_extraction import RelationExtractor, throughput
+from kg_store import TripletStore, load_or_migrate
+from entity_resolver import EntityResolver
+from warm_start import WarmStartSnapshot, write_snapshot
 import os
 import json
+import time
 import spacy
 
+# Seconds between extraction progress reports
+PROGRESS_INTERVAL = 10
+
 
 class KnowledgeGraphBuilder:
     def __init__(self):
+        # Change counter, lets retrieval caches detect graph updates
+        self.version = 0
+        self.triplet_index = None
+        self.ingest_queue = None
+        self.kg_index = None
+        # Config defaults, so queries degrade instead of failing when initialization stops early
+        self.query_mode = 'local'
+        self.query_hops = 2
+        self.query_limit = 20
+        self.query_fan_out = [32, 8]
         try:
-            # Configure local Ollama model for knowledge graph
             config = load_config()
+            self.query_mode = config.kg_query_mode
+            self.query_hops = config.kg_query_hops
+            self.query_limit = config.kg_query_limit
+            self.query_fan_out = config.kg_query_fan_out
+            # Configure local Ollama model for knowledge graph
             Settings.llm = Ollama(model=config.model_name, request_timeout=config.request_timeout)
-            self.kg_index = None
             self.nlp = self._load_spacy_model()
             self._load_or_create_kg()
+            self.extractor = RelationExtractor(self.nlp, Settings.llm.complete, config.model_name,
+                                               config.kg_extract_workers, config.kg_extract_batch_size)
+            # Alias tables and entity keys start from the warm-start snapshot when it is current
+            snapshot = WarmStartSnapshot.open()
+            self.resolver = EntityResolver(self.nlp, snapshot=snapshot)
+            self.triplet_index = TripletIndex(self.nlp, self.resolver, snapshot)
+            self.triplet_index.sync(self.graph_store)
+            self.traversal = GraphTraversal(self.graph_store)
+            debug_logger.log_info(f"Indexed knowledge graph entities: {self.triplet_index.stats()}")
+            if snapshot.stale or self.resolver.replayed or self.triplet_index.analyzed:
+                self.save_warm_start()
+            if config.kg_ingest_mode == 'background':
+                self.ingest_queue = IngestQueue(self, config.kg_ingest_workers)
         except Exception as e:
             debug_logger.log_error(f"Knowledge graph initialization failed: {e}", e)
             self.kg_index = None
@@ -42,100 +77,83 @@ class KnowledgeGraphBuilder:
     def _load_or_create_kg(self):
         """Load existing knowledge graph or create new one"""
         try:
-            if os.path.exists("./storage") and os.path.exists("./storage/graph_store.json"):
-                print("Loading existing knowledge graph...")
-                storage_context = StorageContext.from_defaults(persist_dir="./storage")
-                self.kg_index = load_index_from_storage(storage_context, index_id="knowledge_graph")
-            else:
-                raise FileNotFoundError("No existing knowledge graph found")
+            print("Loading knowledge graph...")
+            self.graph_store = load_or_migrate()
         except Exception as e:
             debug_logger.log_error(f"Failed to load knowledge graph: {e}", e)
             print("Creating new knowledge graph...")
-            try:
-                graph_store = SimpleGraphStore()
-                storage_context = StorageContext.from_defaults(graph_store=graph_store)
-                self.kg_index = KnowledgeGraphIndex([], storage_context=storage_context)
-                self.kg_index.set_index_id("knowledge_graph")
-                # Persist immediately after creation
-                self.kg_index.storage_context.persist(persist_dir="./storage")
-                debug_logger.log_info("New knowledge graph created and persisted successfully")
-            except Exception as create_error:
-                debug_logger.log_error(f"Failed to create knowledge graph: {create_error}", create_error)
-                raise
-    
-    def _extract_entities(self, text: str):
-        """Extract named entities using spaCy"""
-        if self.nlp is None:
-            return []
-        doc = self.nlp(text[:10000])
-        entities = [(ent.text.strip(), ent.label_) for ent in doc.ents if len(ent.text.strip()) > 1]
-        return entities
-    
-    def _extract_relations_with_llm(self, entities: list, text_context: str):
-        """Use LLM to infer semantic relationships between entities"""
-        if len(entities) < 2:
-            return []
-        
-        entity_list = ", ".join([f"{e[0]} ({e[1]})" for e in entities[:15]])
-        prompt = f"""Из текста извлеките связи между сущностями в формате: субъект|отношение|объект
-
-Сущности: {entity_list}
-
-Текст: {text_context[:1500]}
-
-Верните только связи, по одной на строку. Пример:
-Сталин|родился_в|Гори
-Гори|находится_в|Грузия"""
-        
+            self.graph_store = TripletStore()
         try:
-            response = Settings.llm.complete(prompt)
-            triplets = []
-            for line in str(response).strip().split('\n'):
-                if '|' in line:
-                    parts = [p.strip() for p in line.split('|')]
-                    if len(parts) == 3 and all(parts):
-                        triplets.append(tuple(parts))
-            return triplets[:20]
-        except Exception as e:
-            debug_logger.log_error(f"LLM relation extraction error: {e}", e)
-            return []
+            # Triplets persist through the store's log, the index itself is rebuilt in memory
+            storage_context = StorageContext.from_defaults(graph_store=self.graph_store)
+            self.kg_index = KnowledgeGraphIndex([], storage_context=storage_context)
+            self.kg_index.set_index_id("knowledge_graph")
+            self.graph_store.persist()
+            debug_logger.log_info(f"Knowledge graph ready: {self.graph_store.stats()}")
+        except Exception as create_error:
+            debug_logger.log_error(f"Failed to create knowledge graph: {create_error}", create_error)
+            raise
     
     def add_document_to_kg(self, content: str, doc_name: str = "document"):
         """Add document content to knowledge graph with semantic extraction"""
+        return self.add_document_chunks(Settings.node_parser.split_text(content), doc_name)
+    
+    def add_document_chunks(self, chunks, doc_name: str = "document", raise_errors: bool = False):
+        """Add a document streamed as an iterable of text chunks to the knowledge graph
+
+        raise_errors: raise instead of returning a message when the graph is unavailable, adding fails
+        or chunks could not be extracted (the ingestion queue keeps such jobs for a retry)
+        """
         if self.kg_index is None:
+            if raise_errors:
+                raise RuntimeError("Knowledge graph not available")
             return "Knowledge graph not available"
         try:
-            # Extract entities with spaCy
-            entities = self._extract_entities(content)
-            debug_logger.log_info(f"Extracted {len(entities)} entities from {doc_name}")
-            
-            # Extract relationships with LLM
-            triplets = self._extract_relations_with_llm(entities, content)
-            debug_logger.log_info(f"Extracted {len(triplets)} relationships from {doc_name}")
-            
-            # Add triplets to graph store
-            for subj, rel, obj in triplets:
-                try:
-                    self.kg_index.graph_store.upsert_triplet(subj, rel, obj)
-                except AttributeError:
-                    # Fallback for older LlamaIndex versions
-                    self.kg_index.graph_store.add_triplet(subj, rel, obj)
+            # Entities and relations come from every chunk, LLM prompts run concurrently
+            progress = {}
+            reported = time.perf_counter()
+            for key, chunk, triplets in self.extractor.extract(chunks, progress):
+                # Surface forms of one entity collapse into a single node
+                names = self.resolver.canonicalize_many([name for subj, _, obj in triplets for name in (subj, obj)])
+                for i, (_, rel, _) in enumerate(triplets):
+                    if names[2 * i] != names[2 * i + 1]:
+                        self.graph_store.upsert_triplet(names[2 * i], rel, names[2 * i + 1])
+                if time.perf_counter() - reported >= PROGRESS_INTERVAL:
+                    reported = time.perf_counter()
+                    self._report_progress(doc_name, progress)
+            self._report_progress(doc_name, progress)
+            self.triplet_index.sync(self.graph_store)
+            # Only now: a retrieval cached under the new version must see the synced index
+            self.version += 1
             
-            # Also add document for fallback querying
-            document = Document(text=content, metadata={"source": doc_name})
-            self.kg_index.insert(document)
-            
-            self.kg_index.storage_context.persist(persist_dir="./storage")
-            return f"Added {doc_name} to knowledge graph ({len(triplets)} relationships)"
+            # Appends only the new triplets and aliases
+            self.graph_store.persist()
+            self.resolver.persist()
         except Exception as e:
             debug_logger.log_error(f"Knowledge graph add error: {e}", e)
             print(f"Knowledge graph add error: {e}")
+            if raise_errors:
+                raise
             return f"Document processed (knowledge graph unavailable)"
+        if raise_errors and progress["errors"]:
+            # Extracted chunks are cached, a retry only repeats the failed ones
+            raise RuntimeError(f"relation extraction failed for {progress['errors']} of {progress['chunks']} chunks")
+        return (f"Added {doc_name} to knowledge graph ({progress['triplets']} relationships "
+                f"from {progress['chunks']} chunks)")
+    
+    def _report_progress(self, doc_name: str, progress: dict):
+        message = (f"KG extraction {doc_name}: {progress['chunks']} chunks ({progress['cached']} cached, "
+                   f"{progress['llm_calls']} LLM calls), {progress['triplets']} relationships, "
+                   f"{throughput(progress):.1f} chunks/min")
+        print(message)
+        debug_logger.log_info(message)
     
     def query_kg(self, query: str) -> str:
-        """Query the knowledge graph"""
+        """Query the knowledge graph: ranked facts about the query entities, or an LLM answer in llm mode"""
         if self.kg_index is None:
             return "Knowledge graph not available"
+        if self.query_mode != 'llm':
+            return "\n".join(self.query_facts(query))
         try:
             query_engine = self.kg_index.as_query_engine()
             response = query_engine.query(query)
@@ -145,12 +163,75 @@ class KnowledgeGraphBuilder:
             print(f"Knowledge graph query error: {e}")
             return "Knowledge graph temporarily unavailable"
     
+    def traverse(self, entities, hops: int = None, fan_out=None, relations=None, limit: int = None) -> list:
+        """Scored paths from the given entities (names or name -> weight): [{"score", "path": [[subj, rel, obj], ...]}]"""
+        if self.triplet_index is None:
+            return []
+        weights = entities if isinstance(entities, dict) else {name: 1.0 for name in entities}
+        seeds = {}
+        for name, weight in weights.items():
+            entity_id = self.graph_store.entity_id(name)
+            if entity_id is None:
+                canonical = self.resolver.resolve(name)
+                entity_id = self.graph_store.entity_id(canonical) if canonical else None
+            if entity_id is not None:
+                seeds[entity_id] = max(seeds.get(entity_id, 0.0), weight)
+        relation_ids = None
+        if relations:
+            relation_ids = {self.graph_store.relation_id(relation) for relation in relations} - {None}
+        paths = self.traversal.paths(seeds, hops or self.query_hops, fan_out or self.query_fan_out,
+                                     relation_ids, limit or self.query_limit)
+        return [{"score": round(score, 4), "path": self.traversal.describe(path)} for score, path in paths]
+    
+    def query_paths(self, query: str, **kwargs) -> list:
+        """Scored paths around the entities mentioned in the query"""
+        if self.triplet_index is None:
+            return []
+        try:
+            return self.traverse(self.triplet_index.seed_entities(query), **kwargs)
+        except Exception as e:
+            debug_logger.log_error(f"Knowledge graph local query error: {e}", e)
+            return []
+    
+    def query_facts(self, query: str) -> list:
+        """Distinct facts of the best paths around the query entities, no LLM involved"""
+        facts = []
+        for result in self.query_paths(query):
+            for triplet in result["path"]:
+                fact = format_fact(triplet)
+                if fact not in facts:
+                    facts.append(fact)
+        return facts[:self.query_limit]
+    
+    def query_kg_chunks(self, query: str, facts_per_chunk: int = 5) -> list:
+        """Knowledge graph result split into rankable text chunks for fusion"""
+        if self.query_mode != 'llm':
+            facts = self.query_facts(query)
+            return ["\n".join(facts[i:i + facts_per_chunk]) for i in range(0, len(facts), facts_per_chunk)]
+        return [s.strip() for s in self.query_kg(query).split('.') if len(s.strip()) > 20]
+    
+    def save_warm_start(self):
+        """Rewrite the warm-start snapshot from the loaded resolver and entity index"""
+        try:
+            write_snapshot(self.resolver, self.triplet_index)
+        except Exception as e:
+            debug_logger.log_error(f"Warm-start snapshot failed: {e}", e)
+    
+    def ingest_status(self, key: str = None) -> dict:
+        """Background ingestion queue status, or a single job by content hash"""
+        if self.ingest_queue is None:
+            return {"mode": "inline"}
+        return self.ingest_queue.status(key)
+    
     def get_graph_summary(self) -> str:
         """Get summary of knowledge graph contents"""
         try:
-            if hasattr(self.kg_index, 'graph_store') and hasattr(self.kg_index.graph_store, 'get_triplets'):
-                triplets = self.kg_index.graph_store.get_triplets()
-                return f"Knowledge graph contains {len(triplets)} relationships"
+            if self.kg_index is not None:
+                resolver = self.resolver.stats()
+                traversal = self.traversal.stats()
+                return (f"Knowledge graph contains {self.graph_store.triplet_count()} relationships, "
+                        f"{resolver['entities']} entities ({resolver['aliases']} surface forms), "
+                        f"{traversal['cached_hubs']} hub neighbourhoods cached")
             return "Knowledge graph initialized"
         except:
             return "Knowledge graph status unknown"
@@ -168,4 +249,16 @@ class KnowledgeGraphBuilder:
             
             return result
         except Exception as e:
-            return f"Error building knowledge graph: {str(e)}"
\ No newline at end of file
+            return f"Error building knowledge graph: {str(e)}"
+
+if __name__ == "__main__":
+    import argparse
+    from document_reader import iter_chunks
+
+    parser = argparse.ArgumentParser(description="Add whole documents (txt, epub, html) to the knowledge graph")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    builder = KnowledgeGraphBuilder()
+    for path in args.paths:
+        print(builder.add_document_chunks(iter_chunks(path, Settings.node_parser.split_text), os.path.basename(path)))
@@ -2,6 +2,14 @@ import warnings
 warnings.filterwarnings("ignore", message=".*UNEXPECTED.*")
 warnings.filterwarnings("ignore", message=".*position_ids.*")
 
+import sys
+from startup import ImportProfiler, Warmup
+
+# Import-time profiling (python main.py --profile-imports), covers the warm-up thread's imports as well
+import_profiler = ImportProfiler() if "--profile-imports" in sys.argv else None
+if import_profiler is not None:
+    import_profiler.start()
+
 import telebot
 import model
 from context_manager import ContextManager
@@ -10,9 +18,7 @@ from summary_generator import fetch_and_summarize_chat, should_generate_summary,
 from config_loader import load_config
 from security_loader import load_security_config
 from message_logger import MessageLogger
-from rag_embeddings import RAGEmbeddings
 from debug_logger import debug_logger
-from web_search import web_searcher
 from acquaintances_db import AcquaintancesDB
 from datetime import datetime, timedelta
 import tempfile
@@ -28,30 +34,53 @@ bot = telebot.TeleBot(security_config.bot_token)
 context_manager = ContextManager()
 message_logger = MessageLogger()
 
-# Initialize RAG embeddings at startup
-print("Initializing RAG embeddings...")
-rag_embeddings = RAGEmbeddings()
-model.set_rag_embeddings(rag_embeddings)
-print("RAG embeddings ready!")
+# Heavy components (models, indexes, knowledge graph) are loaded by the warm-up stages
+rag_embeddings = None
+web_searcher = None
 
 # Initialize acquaintances database
 if config.agent_settings and config.agent_settings.enabled:
     acquaintances_db = AcquaintancesDB(config.agent_settings.acquaintances_db)
     print(f"Agent mode enabled: {config.agent_settings.agent_name}")
-    
-    # Start MCP server in background thread
-    if config.agent_settings.mcp_enabled:
-        from mcp_server import start_mcp_server
-        import time
-        print("Starting MCP server thread...")
-        mcp_thread = threading.Thread(target=start_mcp_server, args=(rag_embeddings,), daemon=True)
-        mcp_thread.start()
-        time.sleep(3)  # Give server more time to start
-        print(f"MCP server should be running on ws://{config.agent_settings.mcp_host}:{config.agent_settings.mcp_port}")
-        print("Test with: python test_mcp.py")
 else:
     acquaintances_db = None
 
+def load_web_search():
+    global web_searcher
+    from web_search import web_searcher as searcher
+    web_searcher = searcher
+
+def load_rag():
+    global rag_embeddings
+    from rag_embeddings import RAGEmbeddings
+    print("Initializing RAG embeddings...")
+    rag = RAGEmbeddings()
+    # Load the embedding model now rather than on the first question
+    rag.embed_query("прогрев")
+    rag_embeddings = rag
+    model.set_rag_embeddings(rag)
+    print("RAG embeddings ready!")
+
+def start_mcp():
+    from mcp_server import start_mcp_server
+    import time
+    print("Starting MCP server thread...")
+    mcp_thread = threading.Thread(target=start_mcp_server, args=(rag_embeddings,), daemon=True)
+    mcp_thread.start()
+    time.sleep(3)  # Give server more time to start
+    print(f"MCP server should be running on ws://{config.agent_settings.mcp_host}:{config.agent_settings.mcp_port}")
+    print("Test with: python test_mcp.py")
+
+def report_import_profile():
+    import_profiler.stop()
+    print(import_profiler.report())
+
+warmup = Warmup(report_import_profile if import_profiler is not None else None)
+warmup.add("web_search", load_web_search)
+warmup.add("rag", load_rag)
+if acquaintances_db is not None and config.agent_settings.mcp_enabled:
+    warmup.add("mcp", start_mcp, requires=("rag",))
+
 def is_reply_to_bot(message):
     """Check if the message is a reply to the bot's message"""
     return (
@@ -105,6 +134,12 @@ def process_document_message(message):
         should_respond = True
     
     if should_respond:
+        if not warmup.ready("rag"):
+            # Documents need the embedding model, hold the message until warm-up is done
+            safe_send_message(chat_id, "Ещё загружаюсь, документ разберу через минуту", message)
+            if not warmup.wait("rag"):
+                safe_send_message(chat_id, "Не могу обработать документ, братан", message)
+                return
         try:
             # Download document
             file_info = bot.get_file(message.document.file_id)
@@ -115,23 +150,14 @@ def process_document_message(message):
                 temp_file.write(downloaded_file)
                 temp_path = temp_file.name
             
-            # Analyze document and build knowledge graph
-            document_context = rag_embeddings.analyze_document(temp_path, text_content)
-            
-            # Build knowledge graph for this specific document
-            if hasattr(rag_embeddings, 'kg_builder'):
-                with open(temp_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                kg_result = rag_embeddings.kg_builder.build_kg_from_message_document(
-                    content, message.document.file_name, text_content
-                )
-                print(f"Knowledge graph built: {kg_result}")
+            # Analyze document; the same streaming pass also feeds the knowledge graph
+            document_context = rag_embeddings.analyze_document(temp_path, text_content, message.document.file_unique_id, chat_id)
             
             # Get conversation history
             conversation_history = context_manager.get_context(chat_id)
             
             # Generate response with document context
-            response = model.modelResponse(text_content, conversation_history, document_context)
+            response = model.modelResponse(text_content, conversation_history, document_context, chat_id=chat_id)
             
             # Log and save context
             author_name = message.from_user.first_name if message.from_user else "Unknown"
@@ -162,6 +188,8 @@ def process_message(message):
         
     chat_id = message.chat.id
     should_respond = False
+    # First warm-up stage, only takes the import of the web search module
+    web_search_ready = warmup.wait("web_search")
     
     # Check if message is in a group chat
     if message.chat.type in ['group', 'supergroup']:
@@ -177,7 +205,8 @@ def process_message(message):
             # Check for summary, image, and web search triggers even if main triggers not found
             if not should_respond:
                 if (should_generate_summary(text_content) or should_generate_file_summary(text_content) or 
-                    should_generate_image(text_content) or web_searcher.should_search_web(text_content)):
+                    should_generate_image(text_content) or
+                    (web_search_ready and web_searcher.should_search_web(text_content))):
                     should_respond = True
     else:
         # Handle private messages
@@ -193,7 +222,7 @@ def process_message(message):
         print(f"Chat {chat_id}: Found {len(conversation_history)} messages in history")
         
         # Check if user requests web search
-        if web_searcher.should_search_web(text_content):
+        if web_search_ready and web_searcher.should_search_web(text_content):
             try:
                 search_response = web_searcher.search_and_analyze(text_content, conversation_history)
                 safe_send_message(chat_id, search_response, message)
@@ -276,7 +305,7 @@ def process_message(message):
             
             # Check if smart auto-search is needed
             web_context = ""
-            if web_searcher.smart_search_enabled:
+            if web_search_ready and web_searcher.smart_search_enabled:
                 needs_search, search_query = web_searcher.should_auto_search(full_text)
                 if needs_search and search_query:
                     try:
@@ -290,7 +319,7 @@ def process_message(message):
             
             # Generate text response with context
             print(f"Sending to model: {full_text}")
-            response = model.modelResponse(full_text + web_context, conversation_history)
+            response = model.modelResponse(full_text + web_context, conversation_history, chat_id=chat_id)
             
             # Log bot response
             message_logger.log_message(chat_id, "Bot", response)
@@ -354,4 +383,12 @@ def run_bot():
         run_bot()
 
 if __name__ == "__main__":
+    if config.startup_mode == 'lazy':
+        # Poll right away, replies go without RAG context until the "rag" stage is ready
+        warmup.start()
+    else:
+        warmup.run()
+        if warmup.errors:
+            # Eager start keeps failing fast like loading at import time did
+            sys.exit(f"Startup failed: {warmup.errors}")
     run_bot()
@@ -89,6 +89,10 @@ class MCPServer:
                 result = self.handle_ideology_query_sync(params, agent_id)
             elif method == "introduce":
                 result = self.handle_introduction_sync(params, agent_id)
+            elif method == "kg_ingest_status":
+                result = self.rag.kg_builder.ingest_status(params.get("job"))
+            elif method == "get_stats":
+                result = {**self.rag.get_retrieval_stats(), "model_retrieval": model.get_retrieval_counters()}
             else:
                 result = {"error": f"Unknown method: {method}"}
             
@@ -121,8 +125,8 @@ class MCPServer:
         moltbook_prompt = self.agent_settings.moltbook_prompt
         full_prompt = f"{moltbook_prompt}\n\nЗапрос от агента: {query}\n\nКонтекст: {context}"
         
-        # Generate response
-        response = model.modelResponse(full_prompt, [], rag_context)
+        # Generate response (RAG context is already supplied)
+        response = model.modelResponse(full_prompt, [], rag_context, retrieval=model.RETRIEVAL_SKIP)
         
         # Record interaction
         self.acquaintances.record_interaction(
@@ -159,8 +163,19 @@ class MCPServer:
     def handle_kg_query_sync(self, params: Dict, agent_id: str) -> Dict:
         """Query knowledge graph - synchronous version"""
         query = params.get("query", "")
+        kg_builder = self.rag.kg_builder
         
-        kg_response = self.rag.kg_builder.query_kg(query)
+        # Optional traversal bounds: start entities, hop count, relation types, number of paths
+        options = {
+            "hops": params.get("hops"),
+            "relations": params.get("relations"),
+            "limit": params.get("limit")
+        }
+        if params.get("entities"):
+            paths = kg_builder.traverse(params["entities"], **options)
+        else:
+            paths = kg_builder.query_paths(query, **options)
+        kg_response = kg_builder.query_kg(query)
         
         self.acquaintances.record_interaction(
             agent_id=agent_id,
@@ -170,6 +185,7 @@ class MCPServer:
         
         return {
             "knowledge": kg_response,
+            "paths": paths,
             "type": "knowledge_graph"
         }
     
@@ -180,7 +196,7 @@ class MCPServer:
         prompt = f"{self.agent_settings.moltbook_prompt}\n\nДай идеологическую оценку следующей теме: {topic}"
         
         rag_context = self.rag.get_relevant_context(topic)
-        response = model.modelResponse(prompt, [], rag_context)
+        response = model.modelResponse(prompt, [], rag_context, retrieval=model.RETRIEVAL_SKIP)
         
         self.acquaintances.record_interaction(
             agent_id=agent_id,
@@ -224,7 +240,9 @@ class MCPServer:
                 "query_documents",
                 "query_knowledge_graph",
                 "get_ideology_perspective",
-                "introduce"
+                "introduce",
+                "kg_ingest_status",
+                "get_stats"
             ]
         }
     
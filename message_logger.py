@@ -88,6 +88,6 @@ class MessageLogger:
         
         # Generate summary
         summary_prompt = f"Сделай краткое резюме этого разговора на русском языке:\n\n{conversation_text}"
-        summary = model.modelResponse(summary_prompt, [])
+        summary = model.modelResponse(summary_prompt, [], retrieval=model.RETRIEVAL_SKIP)
         
         return f"📝 Резюме из логов ({len(messages)} сообщений):\n{summary}"
\ No newline at end of file
@@ -2,16 +2,31 @@ from ollama import chat
 from ollama import ChatResponse
 from typing import List, Dict
 from config_loader import load_config
-from rag_embeddings import RAGEmbeddings
+from context_packer import ContextPacker, split_document_context
+import threading
 
 # RAG embeddings instance
 rag_embeddings = None
 
+# Retrieval policies: AUTO adds RAG/KG context, SKIP is for internal utility prompts
+# (classifiers, compaction, summaries) and for callers that already supply their context
+RETRIEVAL_AUTO = "auto"
+RETRIEVAL_SKIP = "skip"
+
+retrieval_counters = {"performed": 0, "skipped": 0, "degraded": 0}
+_counters_lock = threading.Lock()
+
 def set_rag_embeddings(rag_instance):
     global rag_embeddings
     rag_embeddings = rag_instance
 
-def modelResponse(msg: str, conversation_history: List[Dict] = None, document_context: str = None):
+def get_retrieval_counters() -> Dict:
+    """Number of model calls with and without RAG retrieval"""
+    with _counters_lock:
+        return dict(retrieval_counters)
+
+def modelResponse(msg: str, conversation_history: List[Dict] = None, document_context: str = None,
+                  retrieval: str = RETRIEVAL_AUTO, chat_id=None):
     messages = []
     
     # Load config settings
@@ -21,28 +36,46 @@ def modelResponse(msg: str, conversation_history: List[Dict] = None, document_co
     temperature = config.temperature
     context_size = config.context_size
     
-    # Get relevant context from RAG
-    relevant_context = rag_embeddings.get_relevant_context(msg)
+    retrieved_chunks = []
+    if retrieval == RETRIEVAL_SKIP:
+        with _counters_lock:
+            retrieval_counters["skipped"] += 1
+    elif rag_embeddings is None:
+        # Still warming up (startup_mode=lazy): answer without retrieved context
+        with _counters_lock:
+            retrieval_counters["degraded"] += 1
+    else:
+        # Get relevant context from RAG
+        retrieved_chunks = rag_embeddings.get_relevant_chunks(msg, chat_id=chat_id)
+        with _counters_lock:
+            retrieval_counters["performed"] += 1
+    
+    document_chunks = split_document_context(document_context) if document_context else []
+    history = conversation_history[-context_size:] if conversation_history else []  # Last N messages for context
+    
+    # Fit history and context into the token budget (user message first, then history, retrieved chunks, document)
+    packer = ContextPacker(config.context_token_budget)
+    packed = packer.pack(system_content, msg, history, retrieved_chunks, document_chunks)
     
-    # Add document context if provided
-    context_parts = [f"Контекст из документов:\n{relevant_context}"]
-    if document_context:
-        context_parts.append(f"Контекст из прикрепленного документа:\n{document_context}")
+    context_parts = []
+    if packed["retrieved"]:
+        context_parts.append("Контекст из документов:\n" + "\n\n".join(packed["retrieved"]))
+    if packed["document"]:
+        context_parts.append("Контекст из прикрепленного документа:\n" + "\n\n".join(packed["document"]))
     
     # Add system prompt with RAG context
-    enhanced_system_content = f"{system_content}\n\n{chr(10).join(context_parts)}"
+    enhanced_system_content = f"{system_content}\n\n{chr(10).join(context_parts)}" if context_parts else system_content
     messages.append({
         'role': 'system',
         'content': enhanced_system_content
     })
     
     # Add conversation history if available
-    if conversation_history:
-        for hist_msg in conversation_history[-context_size:]:  # Last N messages for context
-            messages.append({
-                'role': hist_msg['role'],
-                'content': hist_msg['content']
-            })
+    for hist_msg in packed["history"]:
+        messages.append({
+            'role': hist_msg['role'],
+            'content': hist_msg['content']
+        })
     
     # Add current user message
     messages.append({
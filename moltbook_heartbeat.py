@@ -8,6 +8,12 @@ import model
 from context_manager import ContextManager
 from rag_embeddings import RAGEmbeddings
 
+def _ensure_rag():
+    """Build RAG once per process; it shares the embedding provider instead of loading another model copy"""
+    if model.rag_embeddings is None:
+        model.set_rag_embeddings(RAGEmbeddings())
+    return model.rag_embeddings
+
 def check_and_respond():
     client = MoltbookClient()
     
@@ -22,7 +28,7 @@ def check_and_respond():
     
     print("Checking Moltbook feed...")
     
-    rag = RAGEmbeddings()
+    _ensure_rag()
     context_mgr = ContextManager()
     mentions_found = 0
     
@@ -1,28 +1,91 @@
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings, StorageContext, load_index_from_storage, Document
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings, StorageContext, load_index_from_storage, QueryBundle
+from llama_index.core.schema import NodeWithScore, TextNode
 from config_loader import load_config
 from knowledge_graph import KnowledgeGraphBuilder
+from dense_store import DenseVectorStore, DENSE_STORE_DIR, convert_llama_storage
+from index_manifest import IndexManifest
+from ingest import sync_dense_store
+import ann_index
+import bm25_index
+from debug_logger import debug_logger
+from embedding_cache import embedding_cache
+from embedding_service import embedding_provider, make_llama_embedding, KIND_QUERY
+from retrieval_cache import RetrievalCache
+from retrieval_fusion import reciprocal_rank_fusion, parse_weights
+from document_cache import DocumentCache
+from document_reader import iter_chunks
 import os
-import tempfile
-import requests
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import threading
+import time
+import uuid
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore", message=".*UNEXPECTED.*")
 
+UPLOAD_ID_PREFIX = "upload:"
+UPLOAD_BATCH_SIZE = 256
+
+
+def upload_node_id(doc_key: str, index: int, chat_id=None) -> str:
+    """Node id of an uploaded document chunk, the scope is part of the id so searches can filter on ids alone"""
+    scope = "global" if chat_id is None else f"chat={chat_id}"
+    return f"{UPLOAD_ID_PREFIX}{scope}:{uuid.uuid5(uuid.NAMESPACE_URL, f'{doc_key}#{index}')}"
+
+
 class RAGEmbeddings:
     def __init__(self):
         config = load_config()
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            Settings.embed_model = HuggingFaceEmbedding(model_name=config.embedding_model)
+        # Shared provider: one copy of the model, concurrent callers batched together
+        Settings.embed_model = make_llama_embedding(embedding_provider)
         self.index = None
+        self.dense_store = None
+        self.ann_index = None
+        self.ann_build_settings = (config.ann_nlist, config.ann_pq_m, config.ann_train_size)
+        self._ann_rebuild_lock = threading.Lock()
+        self.bm25_index = None
+        self._bm25_sync_lock = threading.Lock()
         self.kg_builder = KnowledgeGraphBuilder()
         self.hybrid_retrieval = config.hybrid_retrieval
+        self.fusion_weights = parse_weights(config.fusion_weights)
+        self.embedding_model_name = config.embedding_model
+        self.retrieval_cache = RetrievalCache(config.retrieval_cache_size, config.retrieval_cache_ttl)
+        self.document_cache = DocumentCache(max_size_mb=config.document_cache_size_mb,
+                                            retention_days=config.document_cache_retention_days)
+        # Bumped on LlamaIndex (json backend) updates, the dense store keeps its own counter
+        self._vector_version = 0
+        self.vector_store_backend = config.vector_store
+        self.vector_dtype = config.vector_dtype
+        self.vector_rescore = config.vector_rescore
+        self.persist_uploads = config.persist_uploads
+        # Rows of chat-scoped uploads by scope, rebuilt when the dense store version changes
+        self._scoped_rows = {}
+        self._scoped_rows_version = None
         self._load_or_build_index()
+        if self.persist_uploads != 'off' and self.dense_store is None:
+            print("persist_uploads requires vector_store=mmap, uploaded documents will not be persisted")
+            self.persist_uploads = 'off'
+        if config.incremental_sync:
+            print(self.sync_documents())
+        if self.dense_store is not None and config.ann_backend == 'ivfpq' and len(self.dense_store) > 0:
+            self.ann_index = ann_index.load_or_build(self.dense_store, config.ann_nlist, config.ann_pq_m,
+                                                     config.ann_nprobe, config.ann_refine, config.ann_train_size)
+        
+        # Lexical BM25 retriever over the same nodes: fused as an extra source or used as a dense pre-filter
+        self.bm25_mode = config.bm25_mode
+        self.bm25_candidates = config.bm25_candidates
+        if self.bm25_mode != 'off' and self.dense_store is None:
+            print("BM25 retrieval requires vector_store=mmap, disabled")
+            self.bm25_mode = 'off'
+        if self.bm25_mode != 'off':
+            self.bm25_analyzer = bm25_index.Analyzer(getattr(self.kg_builder, 'nlp', None))
+            self.bm25_index = bm25_index.load_or_build(self.dense_store, self.bm25_analyzer)
+        # Cumulative per-stage retrieval latency: stage -> [calls, total ms]
+        self.stage_latency = {}
     
     def _load_or_build_index(self):
+        if self.vector_store_backend == 'mmap':
+            self._load_or_build_dense_store()
+            return
         if os.path.exists("./storage"):
             print("Loading saved index...")
             storage_context = StorageContext.from_defaults(persist_dir="./storage")
@@ -37,115 +100,408 @@ class RAGEmbeddings:
             self.index.storage_context.persist(persist_dir="./storage")
             print("Index built and saved!")
     
-    def _reciprocal_rank_fusion(self, vector_results: list, kg_results: list, k: int = 60) -> list:
-        """Merge results using reciprocal rank fusion"""
-        scores = {}
+    def _load_or_build_dense_store(self):
+        """Load memory-mapped dense store, converting or building it on first start"""
+        self.dense_store = DenseVectorStore(DENSE_STORE_DIR)
+        if DenseVectorStore.exists(DENSE_STORE_DIR):
+            print("Loading dense vector store...")
+            self.dense_store.load()
+            print(f"Dense vector store loaded ({len(self.dense_store)} vectors)")
+            wanted_precision = (self.vector_dtype, self.vector_rescore and self.vector_dtype != 'float32')
+            if (self.dense_store.dtype, self.dense_store.full_precision) != wanted_precision:
+                print(f"Requantizing dense vector store to {self.vector_dtype} (rescore={self.vector_rescore})...")
+                self.dense_store.rewrite(self.vector_dtype, self.vector_rescore)
+            return
+        try:
+            print("Converting saved index to dense vector store...")
+            self.dense_store = convert_llama_storage("./storage", DENSE_STORE_DIR, self.vector_dtype, self.vector_rescore)
+            print("Dense vector store ready!")
+        except (FileNotFoundError, ValueError) as e:
+            debug_logger.log_info(f"No convertible vector index ({e}), building from documents")
+            print("Building vector index...")
+            print(self.sync_documents())
+    
+    def _iter_indexed_nodes(self):
+        """Yield (node_id, metadata) for every node in the active vector backend"""
+        if self.dense_store is None:
+            for node_id, node in self.index.docstore.docs.items():
+                yield node_id, node.metadata
+        else:
+            for node_id, row in list(self.dense_store.id_to_row.items()):
+                yield node_id, self.dense_store.get_node(row).get("metadata", {})
+    
+    def _delete_nodes(self, node_ids: list):
+        """Delete nodes from the vector store and docstore"""
+        if not node_ids:
+            return
+        if self.dense_store is None:
+            self.index.delete_nodes(node_ids, delete_from_docstore=True)
+        else:
+            self.dense_store.delete(node_ids)
+    
+    def _index_file(self, file_path: str) -> list:
+        """Chunk and insert a single file into the LlamaIndex vector index, returns its node ids"""
+        documents = SimpleDirectoryReader(input_files=[file_path]).load_data()
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+        if nodes:
+            self.index.insert_nodes(nodes)
+        return [node.node_id for node in nodes]
+    
+    def sync_documents(self) -> str:
+        """Re-chunk and re-embed only files under documents_path that were added, changed or removed"""
+        config = load_config()
+        manifest = IndexManifest(config.documents_path)
+        if manifest.exists():
+            manifest.load()
+        else:
+            manifest.bootstrap(self._iter_indexed_nodes())
         
-        # Score vector results
-        for rank, node in enumerate(vector_results, 1):
-            doc_id = node.node_id
-            scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank)
+        if self.dense_store is not None:
+            # Parsing stays in-process here, use `python ingest.py` for process-pool bulk builds
+            result = sync_dense_store(self.dense_store, Settings.embed_model, manifest, self.vector_dtype,
+                                      chunk_size=Settings.chunk_size, chunk_overlap=Settings.chunk_overlap,
+                                      full_precision=self.vector_rescore)
+            self.refresh_ann_index()
+            self.refresh_bm25_index()
+            return result
         
-        # Score KG results (extract text from KG response)
-        for rank, kg_text in enumerate(kg_results, 1):
-            # Use text hash as ID for KG results
-            doc_id = f"kg_{hash(kg_text)}"
-            scores[doc_id] = scores.get(doc_id, 0) + 1 / (k + rank)
+        diff = manifest.diff()
+        if not diff.has_changes:
+            manifest.save()
+            return f"Index up to date ({diff})"
+        print(f"Syncing documents: {diff}")
         
-        # Sort by score
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return ranked
-    
-    def get_relevant_context(self, query: str, top_k: int = 3) -> str:
-        """Get relevant context using hybrid retrieval (vector + graph)"""
-        # Vector search
-        retriever = self.index.as_retriever(similarity_top_k=top_k * 2)
-        vector_nodes = retriever.retrieve(query)
+        # Drop nodes of changed and removed files first
+        stale_ids = []
+        for key in diff.changed + diff.removed:
+            stale_ids.extend(manifest.forget(key))
+        self._delete_nodes(stale_ids)
         
-        if not self.hybrid_retrieval:
-            # Simple concatenation (old behavior)
-            vector_context = "\n\n".join([node.text for node in vector_nodes[:top_k]])
-            kg_context = self.kg_builder.query_kg(query)
-            return f"Vector Context:\n{vector_context}\n\nKnowledge Graph:\n{kg_context}"
+        indexed = 0
+        for key in diff.added + diff.changed:
+            try:
+                node_ids = self._index_file(manifest.path_for(key))
+            except Exception as e:
+                debug_logger.log_error(f"Failed to index {key}: {e}", e)
+                print(f"Failed to index {key}: {e}")
+                continue
+            manifest.record(key, node_ids)
+            indexed += len(node_ids)
         
-        # Hybrid retrieval with reciprocal rank fusion
-        kg_response = self.kg_builder.query_kg(query)
+        self.index.storage_context.persist(persist_dir="./storage")
+        self._vector_version += 1
+        manifest.save()
+        
+        result = f"Synced documents ({diff}): {indexed} nodes embedded, {len(stale_ids)} nodes removed"
+        debug_logger.log_info(result)
+        return result
+    
+    def refresh_ann_index(self) -> bool:
+        """Rebuild the IVF-PQ index in the background once too many appended rows fall into its brute-force tail"""
+        if self.ann_index is None or not self.ann_index.is_stale(self.dense_store):
+            return False
+        if not self._ann_rebuild_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._rebuild_ann_index, name="ann-rebuild", daemon=True).start()
+        return True
+    
+    def _rebuild_ann_index(self):
+        try:
+            print("Rebuilding ANN index...")
+            index = ann_index.rebuild(self.ann_index, self.dense_store, *self.ann_build_settings)
+            # Searches keep using the old index until here; swapping first also releases its mapped files
+            self.ann_index = index
+            index.save()
+            print(f"ANN index rebuilt ({index.indexed_count} vectors)")
+        except Exception as e:
+            print(f"ANN index rebuild failed: {e}")
+            debug_logger.log_error(f"ANN index rebuild failed: {e}", e)
+        finally:
+            self._ann_rebuild_lock.release()
+    
+    def refresh_bm25_index(self) -> bool:
+        """Bring the BM25 index up to date with the dense store in the background, queries keep the last synced state"""
+        if self.bm25_index is None or self.dense_store.version == self.bm25_index.synced_version:
+            return False
+        if not self._bm25_sync_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._sync_bm25_index, name="bm25-sync", daemon=True).start()
+        return True
+    
+    def _sync_bm25_index(self):
+        try:
+            # Rows added while a sync runs are picked up by the next pass
+            while self.dense_store.version != self.bm25_index.synced_version:
+                self.bm25_index.sync(self.dense_store, self.bm25_analyzer)
+        except Exception as e:
+            print(f"BM25 index sync failed: {e}")
+            debug_logger.log_error(f"BM25 index sync failed: {e}", e)
+        finally:
+            self._bm25_sync_lock.release()
+    
+    def embed_query(self, query: str) -> list:
+        """Embed query text through the shared embedding cache"""
+        return embedding_cache.get(query, self.embedding_model_name, embedding_provider.embed_query, KIND_QUERY)
+    
+    def _retrieve_vector(self, query: str, top_k: int, exclude_rows=None, timings: dict = None,
+                         candidate_rows=None) -> list:
+        """Vector search on the active backend, returns NodeWithScore list"""
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        query_embedding = self.embed_query(query)
+        timings["embed"] = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        if self.dense_store is None:
+            retriever = self.index.as_retriever(similarity_top_k=top_k)
+            results = retriever.retrieve(QueryBundle(query_str=query, embedding=query_embedding))
+            timings["vector"] = (time.perf_counter() - started) * 1000
+            return results
         
-        # Extract KG text chunks (split by sentences)
-        kg_chunks = [s.strip() for s in kg_response.split('.') if len(s.strip()) > 20]
+        if candidate_rows is not None:
+            hits = self.dense_store.search_rows(query_embedding, candidate_rows, top_k)
+        elif self.ann_index is not None:
+            hits = self.ann_index.search(self.dense_store, query_embedding, top_k, exclude_rows=exclude_rows)
+        else:
+            hits = self.dense_store.search(query_embedding, top_k, exclude_rows=exclude_rows)
+        results = []
+        for node_id, score in hits:
+            payload = self.dense_store.get_node_by_id(node_id)
+            node = TextNode(id_=node_id, text=payload.get("text", ""), metadata=payload.get("metadata", {}))
+            results.append(NodeWithScore(node=node, score=score))
+        timings["vector"] = (time.perf_counter() - started) * 1000
+        return results
+    
+    def _retrieve_bm25(self, query: str, top_k: int, exclude_rows=None, timings: dict = None) -> list:
+        """BM25 search over the dense store nodes, returns [(node_id, score), ...]"""
+        timings = timings if timings is not None else {}
+        started = time.perf_counter()
+        terms = self.bm25_analyzer.analyze(query)
+        exclude_ids = {self.dense_store.ids[row] for row in exclude_rows} if exclude_rows else None
+        # Synced from the write paths (refresh_bm25_index); skip nodes deleted since the last sync
+        hits = [(node_id, score) for node_id, score in self.bm25_index.search(terms, top_k, exclude_ids)
+                if node_id in self.dense_store.id_to_row]
+        timings["bm25"] = (time.perf_counter() - started) * 1000
+        return hits
+    
+    def _record_latency(self, timings: dict):
+        """Log per-stage latency of one retrieval and add it to the running totals"""
+        for stage, ms in timings.items():
+            entry = self.stage_latency.setdefault(stage, [0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+        debug_logger.log_info("Retrieval latency: " + ", ".join(f"{stage} {ms:.1f}ms" for stage, ms in timings.items()))
+    
+    def index_version(self) -> tuple:
+        """Combined version of the vector index and knowledge graph"""
+        dense_version = self.dense_store.version if self.dense_store is not None else None
+        return (self._vector_version, dense_version, self.kg_builder.version)
+    
+    def get_retrieval_stats(self) -> dict:
+        """Cache statistics for monitoring"""
+        return {
+            "retrieval_cache": self.retrieval_cache.stats(),
+            "embedding_cache": embedding_cache.stats(),
+            "embedding_provider": embedding_provider.stats(),
+            "document_cache": self.document_cache.stats(),
+            "bm25_index": self.bm25_index.stats() if self.bm25_index is not None else None,
+            "kg_ingest": self.kg_builder.ingest_status(),
+            "stage_latency_ms": {stage: total / calls for stage, (calls, total) in self.stage_latency.items()}
+        }
+    
+    def _excluded_upload_rows(self, chat_id=None) -> list:
+        """Rows of documents uploaded with chat scope in other chats"""
+        if self.dense_store is None:
+            return []
+        with self.dense_store._lock:
+            if self._scoped_rows_version != self.dense_store.version:
+                scoped = {}
+                for node_id, row in self.dense_store.id_to_row.items():
+                    if node_id.startswith(UPLOAD_ID_PREFIX + "chat="):
+                        scoped.setdefault(node_id.split(":", 2)[1], []).append(row)
+                self._scoped_rows = scoped
+                self._scoped_rows_version = self.dense_store.version
+        own_scope = f"chat={chat_id}"
+        return [row for scope, rows in self._scoped_rows.items() if scope != own_scope for row in rows]
+    
+    def get_relevant_chunks(self, query: str, top_k: int = 3, chat_id=None) -> list:
+        """Get labelled context chunks in rank order, served from the result cache while indexes are unchanged"""
+        excluded = self._excluded_upload_rows(chat_id)
+        scope = chat_id if self._scoped_rows else None
+        key = RetrievalCache.make_key(query, top_k, self.hybrid_retrieval, scope)
+        version = self.index_version()
+        chunks = self.retrieval_cache.get(key, version)
+        if chunks is None:
+            chunks = self._compute_relevant_chunks(query, top_k, excluded)
+            self.retrieval_cache.put(key, version, chunks)
+        return list(chunks)
+    
+    def get_relevant_context(self, query: str, top_k: int = 3, chat_id=None) -> str:
+        """Get relevant context as a single string"""
+        return "\n\n".join(self.get_relevant_chunks(query, top_k, chat_id))
+    
+    def _compute_relevant_chunks(self, query: str, top_k: int = 3, exclude_rows=None) -> list:
+        """Get relevant context chunks using hybrid retrieval (vector + BM25 + graph)"""
+        timings = {}
+        lexical_hits = []
+        if self.bm25_index is not None:
+            pool = self.bm25_candidates if self.bm25_mode == 'prefilter' else top_k * 2
+            lexical_hits = self._retrieve_bm25(query, pool, exclude_rows, timings)
         
-        # Merge using reciprocal rank fusion
-        fused_results = self._reciprocal_rank_fusion(vector_nodes, kg_chunks)
+        # Vector search, limited to the lexical candidates in pre-filter mode when there are enough of them
+        if self.bm25_mode == 'prefilter' and len(lexical_hits) >= top_k:
+            candidate_rows = [self.dense_store.id_to_row[node_id] for node_id, _ in lexical_hits
+                              if node_id in self.dense_store.id_to_row]
+            vector_nodes = self._retrieve_vector(query, top_k * 2, exclude_rows, timings, candidate_rows)
+            lexical_hits = []
+        else:
+            vector_nodes = self._retrieve_vector(query, top_k * 2, exclude_rows, timings)
         
-        # Build context from top results
-        context_parts = []
-        seen_ids = set()
+        ranked_lists = {"vector": [(node.node_id, node.text) for node in vector_nodes]}
+        if lexical_hits:
+            ranked_lists["bm25"] = [(node_id, self.dense_store.get_node_by_id(node_id).get("text", ""))
+                                    for node_id, _ in lexical_hits]
         
-        for doc_id, score in fused_results[:top_k]:
-            if doc_id.startswith('kg_'):
-                # KG result
-                kg_idx = abs(hash(doc_id)) % len(kg_chunks)
-                if kg_idx not in seen_ids:
-                    context_parts.append(f"[KG] {kg_chunks[kg_idx]}")
-                    seen_ids.add(kg_idx)
+        if not self.hybrid_retrieval:
+            # Separate sections (old behavior)
+            started = time.perf_counter()
+            kg_response = self.kg_builder.query_kg(query)
+            timings["kg"] = (time.perf_counter() - started) * 1000
+            if lexical_hits:
+                chunks = [self._format_fused(result) for result in reciprocal_rank_fusion(ranked_lists, self.fusion_weights)[:top_k]]
             else:
-                # Vector result
-                for node in vector_nodes:
-                    if node.node_id == doc_id and doc_id not in seen_ids:
-                        context_parts.append(f"[Vector] {node.text[:500]}")
-                        seen_ids.add(doc_id)
-                        break
+                chunks = [f"[Vector] {node.text}" for node in vector_nodes[:top_k]]
+            self._record_latency(timings)
+            return chunks + [f"[KG] {kg_response}"] if kg_response else chunks
+        
+        # KG text chunks (groups of facts, or sentences of the LLM answer)
+        started = time.perf_counter()
+        kg_chunks = self.kg_builder.query_kg_chunks(query)
+        timings["kg"] = (time.perf_counter() - started) * 1000
+        ranked_lists["kg"] = [(f"kg_{i}", chunk) for i, chunk in enumerate(kg_chunks)]
+        
+        # Merge using weighted reciprocal rank fusion, payloads travel with the ranking
+        started = time.perf_counter()
+        fused_results = reciprocal_rank_fusion(ranked_lists, self.fusion_weights)
+        timings["fusion"] = (time.perf_counter() - started) * 1000
+        self._record_latency(timings)
         
-        return "\n\n".join(context_parts)
+        return [self._format_fused(result) for result in fused_results[:top_k]]
     
-    def _extract_epub_text(self, file_path: str) -> str:
-        """Extract text from EPUB file"""
-        try:
-            book = epub.read_epub(file_path)
-            text_content = []
-            
-            for item in book.get_items():
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
-                    soup = BeautifulSoup(item.get_content(), 'html.parser')
-                    text_content.append(soup.get_text())
-            
-            return '\n'.join(text_content)
-        except Exception as e:
-            print(f"EPUB extraction error: {e}")
-            return ""
+    def _format_fused(self, result) -> str:
+        """Label fused result by contributing retrievers"""
+        labels = {"vector": "Vector", "bm25": "BM25", "kg": "KG"}
+        label = "+".join(labels.get(source, source) for source in result.sources)
+        text = result.text[:500] if "vector" in result.sources or "bm25" in result.sources else result.text
+        return f"[{label}] {text}"
+    
+    def _embed_into_cache(self, chunks, writer, state: dict, batch_size: int = 32):
+        """Pass chunks through while embedding them in batches into a document cache writer"""
+        batch = []
+        for chunk in chunks:
+            if sum(map(len, state["preview"])) < 2000:
+                state["preview"].append(chunk)
+            batch.append(chunk)
+            yield chunk
+            if len(batch) >= batch_size:
+                writer.add(batch, Settings.embed_model.get_text_embedding_batch(batch))
+                batch = []
+        if batch:
+            writer.add(batch, Settings.embed_model.get_text_embedding_batch(batch))
+        state["complete"] = True
+    
+    def _top_document_chunks(self, entry: dict, query: str, top_k: int = 3) -> list:
+        """Cosine top-k over cached document chunk embeddings"""
+        embeddings = entry["embeddings"]
+        if len(embeddings) == 0:
+            return []
+        query_embedding = np.asarray(self.embed_query(query), dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1) * (np.linalg.norm(query_embedding) or 1.0)
+        scores = (embeddings @ query_embedding) / np.where(norms == 0, 1.0, norms)
+        return self.document_cache.read_chunks(entry["key"], np.argsort(-scores)[:top_k])
     
-    def analyze_document(self, file_path: str, query: str) -> str:
-        """Analyze a single document and return relevant context"""
+    def _persist_upload(self, entry: dict, chat_id=None) -> int:
+        """Append an uploaded document's cached chunks to the dense store, returns number of nodes added"""
+        if self.persist_uploads == 'chat' and chat_id is None:
+            return 0
+        scope_chat = chat_id if self.persist_uploads == 'chat' else None
+        key = entry["key"]
+        node_ids = [upload_node_id(key, row, scope_chat) for row in range(entry["count"])]
+        # Already persisted; checking the last id also repairs an interrupted earlier append
+        if not node_ids or node_ids[-1] in self.dense_store.id_to_row:
+            return 0
+        if self.dense_store.dim == 0:
+            self.dense_store.create(entry["dim"], self.vector_dtype, self.vector_rescore)
+        metadata = {"source": "upload", "file_name": entry["metadata"].get("file_name"),
+                    "scope": self.persist_uploads, "chat_id": scope_chat}
+        batch = []
+        for row, chunk in enumerate(self.document_cache.iter_chunks(key)):
+            batch.append({"text": chunk, "metadata": metadata, "ref_doc_id": key})
+            if len(batch) == UPLOAD_BATCH_SIZE or row == entry["count"] - 1:
+                start = row + 1 - len(batch)
+                # Append-only: new rows go to the end of the mmap files, nothing is rewritten
+                self.dense_store.add(node_ids[start:row + 1], entry["embeddings"][start:row + 1], batch)
+                batch = []
+        debug_logger.log_info(f"Persisted upload {key} ({len(node_ids)} nodes, scope {self.persist_uploads})")
+        return len(node_ids)
+    
+    def analyze_document(self, file_path: str, query: str, cache_key: str = None, chat_id=None) -> str:
+        """Analyze a single document and return relevant context (cache_key: Telegram file_unique_id)"""
         try:
-            # Handle different file types
-            if file_path.lower().endswith('.epub'):
-                content = self._extract_epub_text(file_path)
+            key = DocumentCache.key_for(file_path, cache_key)
+            entry = self.document_cache.load(key)
+            if entry is not None:
+                print(f"Document cache hit: {key}")
             else:
-                # Read as text file
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            
-            if not content.strip():
-                return "Документ пуст или не удалось извлечь текст"
+                # Single streaming pass: chunks are embedded into the cache and fed to the knowledge graph
+                doc_name = os.path.basename(file_path)
+                writer = self.document_cache.open_writer(key)
+                state = {"preview": [], "complete": False}
+                ingest_queue = self.kg_builder.ingest_queue
+                # Background mode only spools the chunks, relation extraction runs after the reply
+                spool = ingest_queue.open_spool(doc_name) if ingest_queue is not None else None
+                try:
+                    chunks = self._embed_into_cache(iter_chunks(file_path, Settings.node_parser.split_text), writer, state)
+                    if spool is not None:
+                        for chunk in chunks:
+                            spool.add(chunk)
+                        kg_result = "queued"
+                    else:
+                        kg_result = self.kg_builder.add_document_chunks(chunks, doc_name)
+                    # Drain what the knowledge graph did not consume (e.g. graph disabled)
+                    for _ in chunks:
+                        pass
+                    if not state["complete"]:
+                        raise RuntimeError("document stream was interrupted")
+                except Exception:
+                    writer.abort()
+                    if spool is not None:
+                        spool.abort()
+                    raise
+                
+                if writer.count == 0:
+                    writer.abort()
+                    if spool is not None:
+                        spool.abort()
+                    return "Документ пуст или не удалось извлечь текст"
+                writer.commit("".join(state["preview"])[:2000], {"file_name": doc_name})
+                if spool is not None:
+                    job = spool.commit()
+                    kg_result = f"ingestion {job['state']} (job {job['key'][:12]})"
+                print(f"Knowledge graph: {kg_result}")
+                entry = self.document_cache.load(key)
             
-            # Add to knowledge graph
-            doc_name = os.path.basename(file_path)
-            kg_result = self.kg_builder.add_document_to_kg(content, doc_name)
-            print(f"Knowledge graph: {kg_result}")
+            if self.persist_uploads != 'off' and self._persist_upload(entry, chat_id):
+                self.refresh_ann_index()
+                self.refresh_bm25_index()
             
-            # Create document manually for vector search
-            documents = [Document(text=content)]
-            temp_index = VectorStoreIndex.from_documents(documents)
-            retriever = temp_index.as_retriever(similarity_top_k=3)
-            nodes = retriever.retrieve(query)
+            # Vector search over the document chunks
+            vector_context = "\n\n".join(self._top_document_chunks(entry, query, 3))
             
             # Get knowledge graph insights
             kg_response = self.kg_builder.query_kg(query)
             
-            vector_context = "\n\n".join([node.text for node in nodes])
-            
             # Return both vector search results and full document content for LLM analysis
-            return f"Document Content:\n{content[:2000]}...\n\nVector Search:\n{vector_context}\n\nKnowledge Graph:\n{kg_response}"
+            return f"Document Content:\n{entry['preview']}...\n\nVector Search:\n{vector_context}\n\nKnowledge Graph:\n{kg_response}"
         except Exception as e:
             print(f"Document analysis error: {e}")
-            return f"Ошибка анализа документа: {str(e)}"
\ No newline at end of file
+            return f"Ошибка анализа документа: {str(e)}"
@@ -0,0 +1,69 @@
+"""
+Retrieval result cache - bounded, TTL-limited cache of get_relevant_context results
+that is dropped whenever the vector index or knowledge graph version changes
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from embedding_cache import normalize_text
+
+
+class RetrievalCache:
+    def __init__(self, max_size: int = 256, ttl_seconds: float = 600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: str, top_k: int, hybrid: bool, scope=None) -> tuple:
+        """Scope separates chats that see different chat-scoped uploads"""
+        return (normalize_text(query), top_k, hybrid, scope)
+
+    def _check_version(self, version):
+        """Drop every entry when the underlying indexes changed"""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key: tuple, version):
+        """Return cached result or None on miss or expiry"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, version, result):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.time(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Cache statistics for monitoring"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0
+        }
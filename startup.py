@@ -0,0 +1,130 @@
+"""
+Staged bot startup: import profiling and background warm-up
+
+With startup_mode=lazy the bot starts polling Telegram right away while a
+background thread runs the warm-up stages in order (web search, RAG index and
+embedding model, MCP server). Each stage has a readiness flag; until the RAG
+stage is ready text messages get replies without retrieved context and
+document messages wait for it. A stage whose required stages failed is skipped.
+
+ImportProfiler records the wall time of every module import (cumulative and
+self time, nested imports excluded from the latter), also for imports done
+by the warm-up thread.
+
+Usage:
+    python main.py --profile-imports
+    python startup.py [module ...]    profile importing modules (default: rag_embeddings web_search)
+"""
+
+import builtins
+import sys
+import threading
+import time
+from debug_logger import debug_logger
+
+
+class ImportProfiler:
+    def __init__(self):
+        # module -> (cumulative seconds, self seconds, import depth)
+        self.timings = {}
+        self._local = threading.local()
+        self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.timings.setdefault(name, (elapsed, elapsed - nested, len(stack)))
+
+    def start(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def report(self, top: int = 25) -> str:
+        """Direct imports by cumulative time, then the modules with the most self time"""
+        direct = sorted(((t[0], name) for name, t in self.timings.items() if t[2] == 0), reverse=True)
+        heaviest = sorted(((t[1], name) for name, t in self.timings.items()), reverse=True)[:top]
+        lines = [f"Import time: {sum(t for t, _ in direct) * 1000:.0f} ms in {len(self.timings)} modules",
+                 "  cumulative ms  direct import"]
+        lines += [f"  {t * 1000:13.1f}  {name}" for t, name in direct]
+        lines += ["        self ms  module"]
+        lines += [f"  {t * 1000:13.1f}  {name}" for t, name in heaviest]
+        return "\n".join(lines)
+
+
+class Warmup:
+    """Startup stages run in order, in the background or inline, with a readiness flag each"""
+
+    def __init__(self, on_complete=None):
+        self.stages = []
+        self.events = {}
+        self.timings = {}
+        self.errors = {}
+        self.on_complete = on_complete
+        self._thread = None
+
+    def add(self, name: str, func, requires: tuple = ()):
+        """Add a stage; it is skipped (and counts as failed) when a required stage failed"""
+        self.stages.append((name, func, tuple(requires)))
+        self.events[name] = threading.Event()
+
+    def run(self):
+        for name, func, requires in self.stages:
+            started = time.perf_counter()
+            try:
+                failed = [required for required in requires if required in self.errors]
+                if failed:
+                    raise RuntimeError(f"skipped, {', '.join(failed)} failed")
+                func()
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"Startup stage {name} failed: {e}")
+                debug_logger.log_error(f"Startup stage {name} failed: {e}", e)
+            finally:
+                self.timings[name] = time.perf_counter() - started
+                self.events[name].set()
+        summary = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.timings.items())
+        print(f"Warm-up complete: {summary}")
+        debug_logger.log_info(f"Warm-up complete: {summary}")
+        if self.on_complete is not None:
+            self.on_complete()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def ready(self, name: str) -> bool:
+        """Stage finished without error"""
+        return self.events[name].is_set() and name not in self.errors
+
+    def wait(self, name: str, timeout: float = None) -> bool:
+        """Block until a stage has finished, True if it succeeded"""
+        self.events[name].wait(timeout)
+        return self.ready(name)
+
+    def status(self) -> dict:
+        return {name: "failed" if name in self.errors else "ready" if event.is_set() else "loading"
+                for name, event in self.events.items()}
+
+
+if __name__ == "__main__":
+    profiler = ImportProfiler()
+    profiler.start()
+    for module in sys.argv[1:] or ["rag_embeddings", "web_search"]:
+        builtins.__import__(module)
+    profiler.stop()
+    print(profiler.report())
@@ -72,7 +72,7 @@ def fetch_and_summarize_chat(bot, chat_id: int, context_manager, from_time: Opti
         
         # Generate summary
         summary_prompt = f"Сделай краткое резюме этого разговора на русском языке:\n\n{conversation_text}"
-        summary = model.modelResponse(summary_prompt, [])
+        summary = model.modelResponse(summary_prompt, [], retrieval=model.RETRIEVAL_SKIP)
         
         return f"📝 Резюме разговора:\n{summary}"
         
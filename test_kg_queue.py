@@ -0,0 +1,74 @@
+"""
+Tests for the background knowledge graph ingestion queue
+
+    python -m unittest test_kg_queue
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from kg_queue import IngestQueue, DONE, FAILED, load_jobs
+
+
+class FakeBuilder:
+    """Stands in for KnowledgeGraphBuilder, fails the first `failures` documents"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = []
+
+    def add_document_chunks(self, chunks, doc_name: str = "document", raise_errors: bool = False):
+        chunks = list(chunks)
+        self.calls.append((doc_name, chunks, raise_errors))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("relation extraction failed for 1 of 2 chunks")
+        return f"Added {doc_name}"
+
+
+class IngestQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue_dir = os.path.join(self.dir, "queue")
+        self.journal = os.path.join(self.dir, "ingest_queue.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_queue(self, builder):
+        return IngestQueue(builder, 1, self.queue_dir, self.journal)
+
+    def test_failed_job_keeps_spool_and_is_retried(self):
+        builder = FakeBuilder(failures=1)
+        ingest_queue = self.make_queue(builder)
+        job = ingest_queue.submit(["первый", "второй"], "doc.txt")
+        ingest_queue.join()
+
+        failed = ingest_queue.status(job["key"])
+        self.assertEqual(failed["state"], FAILED)
+        self.assertIn("extraction failed", failed["error"])
+        self.assertTrue(os.path.exists(ingest_queue._spool_path(job["key"])))
+        self.assertTrue(builder.calls[0][2], "queue must ask the builder to raise")
+        self.assertEqual(load_jobs(self.journal)[job["key"]]["state"], FAILED)
+
+        # Same content again: the failed job is queued once more instead of being skipped
+        retried = ingest_queue.submit(["первый", "второй"], "doc.txt")
+        ingest_queue.join()
+        self.assertEqual(retried["key"], job["key"])
+        self.assertEqual(ingest_queue.status(job["key"])["state"], DONE)
+        self.assertFalse(os.path.exists(ingest_queue._spool_path(job["key"])))
+        self.assertEqual(len(builder.calls), 2)
+
+    def test_done_job_is_not_ingested_twice(self):
+        builder = FakeBuilder()
+        ingest_queue = self.make_queue(builder)
+        ingest_queue.submit(["текст"], "a.txt")
+        ingest_queue.join()
+        ingest_queue.submit(["текст"], "b.txt")
+        ingest_queue.join()
+        self.assertEqual([call[0] for call in builder.calls], ["a.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
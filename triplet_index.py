@@ -0,0 +1,135 @@
+"""
+Entity lookup index for deterministic knowledge graph queries
+
+Entity names of the graph's triplets are keyed by their lemmas
+(bm25_index.Analyzer), so "Сталина" in a question finds the node "Сталин".
+A query is matched against the keys through its spaCy entities (resolved via
+the alias table when a resolver is given) and its lemmas. The matched
+entities seed kg_traversal.GraphTraversal, which walks their neighbourhood;
+no LLM is involved and queries take milliseconds.
+
+Seed weight = number of key lemmas, doubled for spaCy entities and resolved mentions.
+
+Entity keys come from the warm-start snapshot (warm_start.py) when one was
+built with the same analyzer; only names added since are analyzed on startup.
+"""
+
+import threading
+from collections import defaultdict
+from bm25_index import Analyzer
+
+
+def format_fact(triplet) -> str:
+    subj, rel, obj = triplet
+    return f"{subj} — {rel.replace('_', ' ')} — {obj}"
+
+
+def graph_triplets(graph_store):
+    """All (subject, relation, object) triplets of a LlamaIndex SimpleGraphStore"""
+    graph_dict = getattr(getattr(graph_store, "_data", None), "graph_dict", None) or {}
+    for subj, relations in list(graph_dict.items()):
+        for rel, obj in list(relations):
+            yield subj, rel, obj
+
+
+class TripletIndex:
+    def __init__(self, nlp=None, resolver=None, snapshot=None):
+        self.nlp = nlp
+        self.resolver = resolver
+        self.analyzer = Analyzer(nlp)
+        self.key_names = defaultdict(set)
+        self.token_keys = defaultdict(set)
+        self._key_cache = (snapshot.entity_keys(self.analyzer.name) if snapshot is not None else None) or {}
+        # Names run through the analyzer, i.e. not covered by the snapshot
+        self.analyzed = 0
+        self._indexed = set()
+        self._synced = 0
+        self._lock = threading.Lock()
+
+    def _keys(self, names: list) -> list:
+        """Lemma key per entity name (sorted distinct lemmas, the lowercase name if none remain)"""
+        with self._lock:
+            missing = [name for name in dict.fromkeys(names) if name not in self._key_cache]
+            self.analyzed += len(missing)
+        # spaCy runs outside the lock, queries keep being answered meanwhile
+        computed = {name: " ".join(sorted(terms)) or " ".join(name.lower().split())
+                    for name, terms in zip(missing, self.analyzer.analyze_many(missing))}
+        with self._lock:
+            self._key_cache.update(computed)
+            return [self._key_cache[name] for name in names]
+
+    def add(self, triplets) -> int:
+        """Index the entities of triplets, returns how many names were new"""
+        with self._lock:
+            names = [name for subj, _, obj in triplets for name in (str(subj).strip(), str(obj).strip())
+                     if name and name not in self._indexed]
+        names = list(dict.fromkeys(names))
+        if not names:
+            return 0
+        keys = self._keys(names)
+        with self._lock:
+            for name, key in zip(names, keys):
+                self._indexed.add(name)
+                self.key_names[key].add(name)
+                for token in key.split():
+                    self.token_keys[token].add(key)
+        return len(names)
+
+    def sync(self, graph_store) -> int:
+        """Pick up entities added to the graph store since the last sync"""
+        if hasattr(graph_store, "changes"):
+            # Incremental store: only triplets appended after the last sync position
+            triplets, self._synced = graph_store.changes(self._synced)
+            return self.add(triplets)
+        return self.add(list(graph_triplets(graph_store)))
+
+    def _query_terms(self, query: str):
+        """Query lemmas, lemma keys of its spaCy entities and their surface texts"""
+        if self.nlp is None:
+            return set(self.analyzer.analyze(query)), set(), []
+        doc = self.nlp(query)
+        terms = {token.lemma_.lower() for token in doc if not (token.is_punct or token.is_space or token.is_stop)}
+        entity_keys = set()
+        for ent in doc.ents:
+            lemmas = {token.lemma_.lower() for token in ent if not (token.is_punct or token.is_space or token.is_stop)}
+            if lemmas:
+                entity_keys.add(" ".join(sorted(lemmas)))
+                terms |= lemmas
+        return terms, entity_keys, [ent.text for ent in doc.ents]
+
+    def seeds(self, query: str) -> dict:
+        """Indexed entity keys mentioned in the query with their weights"""
+        terms, entity_keys, mentions = self._query_terms(query)
+        seeds = {}
+        if self.resolver is not None:
+            # Mentions resolved through the alias table, catches spellings the lemmas miss
+            canonical = [name for name in (self.resolver.resolve(mention) for mention in mentions) if name]
+            resolved_keys = self._keys(canonical)
+        else:
+            resolved_keys = []
+        # Background ingestion adds entities concurrently
+        with self._lock:
+            for key in resolved_keys:
+                if key in self.key_names:
+                    seeds[key] = 2.0 * len(key.split())
+            for term in terms:
+                for key in self.token_keys.get(term, ()):
+                    tokens = key.split()
+                    if key not in seeds and all(token in terms for token in tokens):
+                        seeds[key] = len(tokens) * (2.0 if key in entity_keys else 1.0)
+        return seeds
+
+    def seed_entities(self, query: str) -> dict:
+        """Graph entity names mentioned in the query with their weights"""
+        seeds = self.seeds(query)
+        with self._lock:
+            return {name: weight for key, weight in seeds.items() for name in self.key_names.get(key, ())}
+
+    def export_keys(self):
+        """(names, keys) of the indexed entities for the warm-start snapshot"""
+        with self._lock:
+            names = list(self._indexed)
+            return names, [self._key_cache[name] for name in names]
+
+    def stats(self) -> dict:
+        return {"entities": len(self._indexed), "keys": len(self.key_names), "analyzed": self.analyzed}
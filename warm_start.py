@@ -0,0 +1,241 @@
+"""
+Warm-start snapshot of the derived knowledge graph lookup state
+
+Vectors, node texts (storage/dense) and knowledge graph adjacency (storage/kg)
+are memory-mapped already. What every restart still rebuilds from JSON is the
+lookup state derived from them: the lemma key of every graph entity (a spaCy
+pass over all entity names) and the entity resolver's alias, lemma and trigram
+tables (storage/kg/aliases.jsonl). The snapshot keeps that state in one file,
+storage/warm_start.bin:
+
+    magic, header length, JSON header (format version, sections with their source and array table)
+    arrays, 64-byte aligned, memory-mapped by the loader (strings as NUL-separated UTF-8)
+
+A section is only used while its source matches: entity keys need the same
+analyzer, resolver tables need aliases.jsonl to still start with the bytes the
+snapshot was built from (aliases appended since are replayed). Otherwise that
+state is rebuilt from the JSON sources as before. KnowledgeGraphBuilder
+rewrites the snapshot on startup whenever it had to rebuild anything.
+
+Usage:
+    python warm_start.py snapshot
+    python warm_start.py stats
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+from debug_logger import debug_logger
+
+WARM_START_PATH = "./storage/warm_start.bin"
+WARM_START_VERSION = 1
+MAGIC = b"SPKWARM\0"
+ALIGN = 64
+
+
+def _encode_strings(values: list) -> np.ndarray:
+    return np.frombuffer("\0".join(values).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(array, count: int) -> list:
+    return array.tobytes().decode("utf-8").split("\0") if count else []
+
+
+def file_prefix_sha1(path: str, size: int) -> str:
+    """SHA-1 of the first size bytes of a file"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        remaining = size
+        while remaining > 0:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def aliases_source(path: str) -> dict:
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    return {"size": size, "sha1": file_prefix_sha1(path, size) if size else None}
+
+
+def write_snapshot(resolver, triplet_index, path: str = WARM_START_PATH) -> dict:
+    """Write the resolver tables and entity keys, returns entry counts per section"""
+    started = time.perf_counter()
+    # Source first: aliases persisted meanwhile are replayed on load, which is idempotent
+    source = aliases_source(resolver.path)
+    state = resolver.export_state()
+    names, keys = triplet_index.export_keys()
+    grams = list(state["postings"])
+    posting_offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+    posting_offsets[1:] = np.cumsum([len(state["postings"][gram]) for gram in grams])
+    sections = {
+        "entity_keys": ({"analyzer": triplet_index.analyzer.name}, {
+            "names": names,
+            "keys": keys
+        }),
+        "aliases": (source, {
+            "names": state["names"],
+            "gram_counts": np.asarray(state["gram_counts"], dtype=np.int32),
+            "entity_words": np.asarray(state["entity_words"], dtype=np.int32),
+            "alias_keys": list(state["aliases"]),
+            "alias_ids": np.fromiter(state["aliases"].values(), dtype=np.int32, count=len(state["aliases"])),
+            "lemmas": list(state["lemma_ids"]),
+            "lemma_ids": np.fromiter(state["lemma_ids"].values(), dtype=np.int32, count=len(state["lemma_ids"])),
+            "grams": grams,
+            "posting_offsets": posting_offsets,
+            "posting_ids": np.fromiter((i for gram in grams for i in state["postings"][gram]), dtype=np.int32,
+                                       count=int(posting_offsets[-1]))
+        })
+    }
+
+    header = {"version": WARM_START_VERSION, "created": time.time(), "sections": {}}
+    blobs = []
+    offset = 0
+    for name, (section_source, arrays) in sections.items():
+        table = {}
+        for key, value in arrays.items():
+            spec = {}
+            if isinstance(value, list):
+                spec["strings"] = len(value)
+                value = _encode_strings(value)
+            spec.update(dtype=value.dtype.str, shape=list(value.shape), offset=offset, nbytes=value.nbytes)
+            table[key] = spec
+            blobs.append((offset, value))
+            offset += (value.nbytes + ALIGN - 1) // ALIGN * ALIGN
+        header["sections"][name] = {"source": section_source, "arrays": table}
+
+    encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    # Array offsets are relative to the aligned start of the data area
+    data_start = (len(MAGIC) + 8 + len(encoded) + ALIGN - 1) // ALIGN * ALIGN
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+        for blob_offset, value in blobs:
+            f.seek(data_start + blob_offset)
+            f.write(value.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    counts = {"entity_keys": len(names), "aliases": len(state["aliases"]), "entities": len(state["names"])}
+    debug_logger.log_info(f"Warm-start snapshot written in {time.perf_counter() - started:.2f}s: {counts}")
+    return counts
+
+
+class WarmStartSnapshot:
+    def __init__(self, path: str = WARM_START_PATH):
+        self.path = path
+        self.header = None
+        self.data_start = 0
+        # Sections that were missing or whose source changed
+        self.stale = set()
+
+    @classmethod
+    def open(cls, path: str = WARM_START_PATH) -> "WarmStartSnapshot":
+        """Snapshot with its header read; a missing or unreadable file leaves every section stale"""
+        snapshot = cls(path)
+        if os.path.exists(path):
+            try:
+                snapshot._read_header()
+            except (OSError, ValueError, KeyError, struct.error) as e:
+                debug_logger.log_error(f"Warm-start snapshot unreadable, loading from JSON sources: {e}", e)
+                snapshot.header = None
+        return snapshot
+
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not a warm-start snapshot")
+            (length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(length).decode("utf-8"))
+        if header.get("version") != WARM_START_VERSION:
+            raise ValueError(f"unsupported warm-start snapshot version: {header.get('version')}")
+        self.header = header
+        self.data_start = (len(MAGIC) + 8 + length + ALIGN - 1) // ALIGN * ALIGN
+
+    def _section(self, name: str, is_current) -> dict:
+        """Arrays of a section (strings decoded, numbers memory-mapped), None if missing or stale"""
+        section = self.header["sections"].get(name) if self.header is not None else None
+        if section is None or not is_current(section["source"]):
+            self.stale.add(name)
+            return None
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for key, spec in section["arrays"].items():
+            start = self.data_start + spec["offset"]
+            array = data[start:start + spec["nbytes"]].view(np.dtype(spec["dtype"])).reshape(spec["shape"])
+            arrays[key] = _decode_strings(array, spec["strings"]) if "strings" in spec else array
+        return arrays
+
+    def entity_keys(self, analyzer_name: str) -> dict:
+        """Entity name -> lemma key, None unless built with the same analyzer"""
+        arrays = self._section("entity_keys", lambda source: source.get("analyzer") == analyzer_name)
+        return dict(zip(arrays["names"], arrays["keys"])) if arrays is not None else None
+
+    def resolver_state(self, aliases_path: str) -> dict:
+        """Resolver tables plus the aliases.jsonl offset they cover, None if the file was rewritten"""
+        def is_current(source):
+            size = source.get("size", 0)
+            if not size:
+                return True
+            return (os.path.exists(aliases_path) and os.path.getsize(aliases_path) >= size
+                    and file_prefix_sha1(aliases_path, size) == source.get("sha1"))
+
+        arrays = self._section("aliases", is_current)
+        if arrays is None:
+            return None
+        ids = arrays["posting_ids"].tolist()
+        offsets = arrays["posting_offsets"].tolist()
+        return {
+            "offset": self.header["sections"]["aliases"]["source"]["size"],
+            "names": arrays["names"],
+            "gram_counts": arrays["gram_counts"].tolist(),
+            "entity_words": arrays["entity_words"].tolist(),
+            "aliases": dict(zip(arrays["alias_keys"], arrays["alias_ids"].tolist())),
+            "lemma_ids": dict(zip(arrays["lemmas"], arrays["lemma_ids"].tolist())),
+            "postings": {gram: ids[offsets[i]:offsets[i + 1]] for i, gram in enumerate(arrays["grams"])}
+        }
+
+    def stats(self) -> dict:
+        if self.header is None:
+            return {"path": self.path, "exists": False}
+        return {
+            "path": self.path,
+            "size_mb": os.path.getsize(self.path) / 1024 / 1024,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.header["created"])),
+            "sections": {name: {key: spec.get("strings", spec["shape"][0] if spec["shape"] else 0)
+                                for key, spec in section["arrays"].items()}
+                         for name, section in self.header["sections"].items()}
+        }
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "snapshot":
+        import spacy
+        from entity_resolver import EntityResolver
+        from kg_store import load_or_migrate
+        from triplet_index import TripletIndex
+
+        try:
+            nlp = spacy.load("ru_core_news_sm")
+        except OSError:
+            nlp = None
+        started = time.perf_counter()
+        snapshot = WarmStartSnapshot.open()
+        resolver = EntityResolver(nlp, snapshot=snapshot)
+        index = TripletIndex(nlp, resolver, snapshot)
+        index.sync(load_or_migrate())
+        print(f"Loaded lookup state in {time.perf_counter() - started:.2f}s "
+              f"(stale sections: {sorted(snapshot.stale) or 'none'}, {index.analyzed} names analyzed)")
+        print(json.dumps(write_snapshot(resolver, index), indent=2))
+    elif command == "stats":
+        print(json.dumps(WarmStartSnapshot.open().stats(), indent=2, ensure_ascii=False))
+    else:
+        print("Usage: python warm_start.py snapshot|stats")
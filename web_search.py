@@ -3,6 +3,7 @@ from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
 from config_loader import load_config
 from debug_logger import debug_logger
+from embedding_cache import embedding_cache
 from functools import lru_cache
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -22,11 +23,11 @@ class WebSearcher:
             self._load_embedding_model()
     
     def _load_embedding_model(self):
-        """Load embedding model for semantic ranking"""
+        """Use the shared embedding provider for semantic ranking (same model as RAG, loaded once)"""
         try:
-            from sentence_transformers import SentenceTransformer
-            self.embedding_model = SentenceTransformer(self.config.embedding_model)
-            debug_logger.log_info(f"Loaded embedding model for semantic ranking: {self.config.embedding_model}")
+            from embedding_service import embedding_provider
+            self.embedding_model = embedding_provider
+            debug_logger.log_info(f"Semantic ranking uses shared embedding model: {self.config.embedding_model}")
         except Exception as e:
             debug_logger.log_error(f"Failed to load embedding model: {e}", e)
             self.semantic_ranking = False
@@ -84,18 +85,34 @@ class WebSearcher:
         """Calculate cosine similarity between two vectors"""
         return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
     
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Encode the search query as a query (instruction models embed queries and passages differently)"""
+        from embedding_service import KIND_QUERY
+        return np.asarray(embedding_cache.get(query, self.config.embedding_model, self.embedding_model.embed_query,
+                                              KIND_QUERY), dtype=np.float32)
+    
+    def _encode_texts(self, texts: list) -> list:
+        """Encode result texts through the shared embedding cache, batching all cache misses"""
+        return embedding_cache.get_many(
+            texts, self.config.embedding_model,
+            lambda batch: list(self.embedding_model.embed(batch))
+        )
+    
+    def _result_text(self, title: str, snippet: str) -> str:
+        """Combine title and snippet for better context"""
+        return f"{title} {snippet}" if snippet else title
+    
     def calculate_semantic_score(self, title: str, snippet: str, query: str) -> float:
         """Calculate semantic similarity score using embeddings"""
         if not self.semantic_ranking or self.embedding_model is None:
             return 0.0
         
         try:
-            # Combine title and snippet for better context
-            result_text = f"{title} {snippet}" if snippet else title
+            result_text = self._result_text(title, snippet)
             
-            # Get embeddings
-            query_embedding = self.embedding_model.encode(query, convert_to_numpy=True)
-            result_embedding = self.embedding_model.encode(result_text, convert_to_numpy=True)
+            # Get embeddings (query is embedded once and reused for every result)
+            query_embedding = self._encode_query(query)
+            result_embedding = self._encode_texts([result_text])[0]
             
             # Calculate cosine similarity (returns value between -1 and 1)
             similarity = self.cosine_similarity(query_embedding, result_embedding)
@@ -165,6 +182,13 @@ class WebSearcher:
     
     def rank_results(self, results: list, query: str) -> list:
         """Rank search results by relevance score"""
+        if self.semantic_ranking and self.embedding_model is not None:
+            # Warm the cache: the query, then one batched forward pass for all results
+            try:
+                self._encode_query(query)
+                self._encode_texts([self._result_text(r['title'], r.get('snippet', '')) for r in results])
+            except Exception as e:
+                debug_logger.log_error(f"Batch embedding error: {e}", e)
         for result in results:
             result['score'] = self.calculate_relevance_score(
                 result['title'], result.get('snippet', ''), result['url'], query
@@ -387,7 +411,7 @@ Does NOT need search for:
 - General knowledge questions
 - Philosophical discussions"""
             
-            response = model.modelResponse(classifier_prompt, [])
+            response = model.modelResponse(classifier_prompt, [], retrieval=model.RETRIEVAL_SKIP)
             
             # Parse JSON response
             import json
@@ -445,7 +469,7 @@ Does NOT need search for:
 
 Краткое резюме:"""
             
-            summary = model.modelResponse(compact_prompt, [])
+            summary = model.modelResponse(compact_prompt, [], retrieval=model.RETRIEVAL_SKIP)
             return f"[Информация из интернета: {summary.strip()}]"
             
         except Exception as e: